@@ -216,5 +216,39 @@ var pw = (function() {
         }
     };
 
+    function toggle_patch_file(file, show) {
+        var content = file.find('pre.content');
+
+        if (typeof show == 'undefined')
+            show = !content.is(':visible');
+
+        if (show && !file.data('loaded')) {
+            file.data('loaded', true);
+            content.text('Loading...');
+            $.get(file.data('url'), function(html) {
+                content.html(html);
+            }).fail(function() {
+                file.data('loaded', false);
+                content.text('Failed to load the diff of this file');
+            });
+        }
+
+        content.toggle(show);
+    }
+
+    /* the diffs of the files of large patches are fetched when opened */
+    exports.setup_patch_files = function(selector) {
+        $(selector).find('.patch-file-toggle').click(function(e) {
+            e.preventDefault();
+            toggle_patch_file($(this).closest('.patch-file'));
+        });
+    };
+
+    exports.show_patch_files = function(selector) {
+        $(selector).find('.patch-file').each(function() {
+            toggle_patch_file($(this), true);
+        });
+    };
+
     return exports;
 }());
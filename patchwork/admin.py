@@ -21,7 +21,7 @@ from django.contrib import admin
 
 from patchwork.models import (
     Project, Person, UserProfile, State, Patch, Comment, Bundle, Tag, Test,
-    TestResult)
+    TestResult, Webhook, WebhookDelivery)
 
 
 class ProjectAdmin(admin.ModelAdmin):
@@ -89,6 +89,22 @@ class TestResultAdmin(admin.ModelAdmin):
 admin.site.register(TestResult, TestResultAdmin)
 
 
+class WebhookAdmin(admin.ModelAdmin):
+    list_display = ('url', 'project', 'series_events', 'test_result_events',
+                    'active')
+    list_filter = ('project', 'active')
+admin.site.register(Webhook, WebhookAdmin)
+
+
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('event', 'webhook', 'event_time', 'state', 'attempts',
+                    'next_attempt', 'last_status', 'last_error')
+    list_filter = ('state', 'webhook__project')
+    search_fields = ('webhook__url',)
+    date_hierarchy = 'event_time'
+admin.site.register(WebhookDelivery, WebhookDeliveryAdmin)
+
+
 class BundleAdmin(admin.ModelAdmin):
     list_display = ('name', 'owner', 'project', 'public')
     list_filter = ('public', 'project')
@@ -19,7 +19,8 @@
 # along with Patchwork; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-PATCHWORK_BINDIR=`dirname $0`
+BIN_DIR=`dirname $0`
+PATCHWORK_BASE=`readlink -e $BIN_DIR/../..`
 
 if [ $# -ne 1 ]
 then
@@ -37,9 +38,7 @@ then
 	exit 1
 fi
 
-ls -1rt "$mail_dir" |
-while read line;
-do
-	echo $line
-	$PATCHWORK_BINDIR/parsemail.sh < "$mail_dir/$line"
-done
+# parsearchive parses all the mails in a single process, oldest first
+PYTHONPATH="$PATCHWORK_BASE":"$PATCHWORK_BASE/lib/python:$PYTHONPATH" \
+        DJANGO_SETTINGS_MODULE=patchwork.settings.production \
+        "$PATCHWORK_BASE/manage.py" parsearchive "$mail_dir"
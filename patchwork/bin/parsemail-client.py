@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Hands the mail read on stdin over to parsemaild. This is meant to be used
+# in place of parsemail.sh in the MTA configuration and, as such, doesn't
+# import django or anything from patchwork so it stays cheap to start.
+#
+# Exit status:
+#   0: the daemon has processed the mail. Mails rejected by the daemon are
+#      reported on stderr, but not bounced back, just like with parsemail.sh
+#   75 (EX_TEMPFAIL): the daemon couldn't be reached, the MTA should retry
+#      the delivery later
+
+import argparse
+import socket
+import sys
+
+DEFAULT_SOCKET = '/tmp/patchwork.parsemail.sock'
+EX_TEMPFAIL = 75
+
+
+def send_mail(path, data, timeout=None):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(path)
+        s.sendall(data)
+        s.shutdown(socket.SHUT_WR)
+        return s.makefile().readline().strip()
+    finally:
+        s.close()
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help='path of the unix socket parsemaild listens on')
+    parser.add_argument('--timeout', type=float, default=120,
+                        help='seconds to wait for the mail to be processed')
+    args = parser.parse_args()
+
+    try:
+        status = send_mail(args.socket, sys.stdin.read(), args.timeout)
+    except (socket.error, socket.timeout) as e:
+        sys.stderr.write('parsemail-client: %s: %s\n' % (args.socket, e))
+        return EX_TEMPFAIL
+
+    if not status:
+        sys.stderr.write('parsemail-client: no status from parsemaild\n')
+        return EX_TEMPFAIL
+
+    if status != 'OK':
+        sys.stderr.write('parsemail-client: %s\n' % status)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
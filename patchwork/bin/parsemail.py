@@ -31,19 +31,21 @@ import operator
 import re
 import sys
 import weakref
+import zlib
 
 import django
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.exceptions import MultipleObjectsReturned
+from django.db import connection, transaction, IntegrityError
 from django.db.models import Q
 from django.utils.log import AdminEmailHandler
 
 from patchwork import lock as lockmod
 from patchwork.lock import release
 from patchwork.models import (Patch, Project, Person, Comment, State, Series,
-    SeriesRevision, SeriesRevisionPatch, get_default_initial_patch_state,
-    series_revision_complete, SERIES_DEFAULT_NAME)
+    SeriesRevision, SeriesRevisionPatch, ThreadLock, Message,
+    get_default_initial_patch_state, series_revision_complete,
+    deferred_updates, SERIES_DEFAULT_NAME)
 from patchwork.parser import parse_patch
 
 LOGGER = logging.getLogger(__name__)
@@ -170,6 +172,17 @@ def find_author(mail):
     return (person, new_person)
 
 
+def save_author(author):
+    """Save a new Person, returning the existing one if the same person has
+       been created concurrently, by a mail of another thread"""
+    try:
+        with transaction.atomic():
+            author.save()
+    except IntegrityError:
+        return Person.objects.get(email__iexact=author.email)
+    return author
+
+
 def mail_date(mail):
     t = parsedate_tz(mail.get('Date', ''))
     if not t:
@@ -210,13 +223,15 @@ class MailContent:
         self.series = None
         self.revision = None
         self.patch_order = 1    # place of the patch in the series
+        self.refs = []          # msgids from the parent to the thread root
+        self.is_cover_letter = False
 
 
 def build_references_from_headers(in_reply_to, references):
     refs = []
 
     if in_reply_to:
-        refs.append(in_reply_to)
+        refs.append(in_reply_to.strip())
 
     if references:
         rs = references.split()
@@ -228,48 +243,24 @@ def build_references_from_headers(in_reply_to, references):
     return refs
 
 
-def get_object_by_msgid(cls, msgid):
-    try:
-        return cls.objects.get(msgid=msgid)
-    except cls.DoesNotExist:
-        return None
-    except MultipleObjectsReturned:
-        # it's theoritically possible to have the same message id for 2
-        # patches or comments, take the more recent object then, why
-        # not.
-        return cls.objects.filter(msgid=msgid).order_by('-date')[0]
-
-
 def find_header_in_text(headers, name):
     parser = HeaderParser()
     headers = parser.parsestr(headers)
     return headers[name]
 
 
-def build_references_from_db(msgid):
-    # msgid belongs to either a patch or a comment
-    object = get_object_by_msgid(Patch, msgid)
-    if not object:
-        object = get_object_by_msgid(Comment, msgid)
-
-    if not object:
-        # cover letters are thread roots, but don't have a corresponding
-        # Comment object as the cover letter is stored in Series.
-        return []
-
-    in_reply_to = find_header_in_text(object.headers, 'In-Reply-To')
-    references = find_header_in_text(object.headers, 'References')
-    refs = build_references_from_headers(in_reply_to, references)
+def build_references_from_db(msgid, project=None):
+    messages = Message.objects.filter(msgid=msgid)
+    if project:
+        messages = messages.filter(project=project)
 
-    if not refs:
+    # the same mail can have been sent to several projects, any of them will
+    # do when we don't know the project.
+    messages = list(messages.only('references')[:1])
+    if not messages:
         return []
 
-    # note that we recurse on the highest ancestor found, not necessarily the
-    # immediate parent (depends: if the mail found in the DB is from a
-    # actually MUA which filled in the 'References:' header or if it is a
-    # git send-email mail, with only 'In-References-To: defined
-    ancestor_msgid = refs[-1]
-    return refs + build_references_from_db(ancestor_msgid)
+    return messages[0].references_list()
 
 
 def build_references_from_mail(mail):
@@ -277,7 +268,7 @@ def build_references_from_mail(mail):
                                          mail.get('References', None))
 
 
-def build_references_list(mail):
+def build_references_list(mail, project=None):
     """Construct the list of msgids from 'mail' to the root of the thread"""
 
     # parse the information from the mail headers
@@ -292,8 +283,40 @@ def build_references_list(mail):
     # git send-email emails with --in-reply-to are the ultimate occurrence of
     # this behaviour as they just have the but just the direct parent in
     # References.
-    parent_msgid = refs[-1]
-    return refs + build_references_from_db(parent_msgid)
+    #
+    # The Message index stores the list of ancestors of every mail, so we
+    # only need to look up the highest ancestor we know of.
+    ancestor_msgid = refs[-1]
+    return refs + build_references_from_db(ancestor_msgid, project)
+
+
+def find_messages(project, refs):
+    """Return the indexed messages of 'refs', in the order of 'refs'"""
+    if not refs:
+        return []
+
+    messages = Message.objects.filter(project=project, msgid__in=refs) \
+                              .select_related('patch', 'comment__patch')
+    messages = dict([(m.msgid, m) for m in messages])
+    return [messages[ref] for ref in refs if ref in messages]
+
+
+def index_message(project, mail, content):
+    """Record 'mail', and what it has been parsed into, in the Message
+       index"""
+    msgid = mail.get('Message-Id').strip()
+    refs = content.refs
+    revision = content.revision if content.is_cover_letter else None
+
+    Message.objects.update_or_create(project=project, msgid=msgid,
+        defaults={
+            'parent_msgid': refs[0] if refs else None,
+            'root_msgid': refs[-1] if refs else msgid,
+            'references': ' '.join(refs),
+            'patch': content.patch,
+            'comment': content.comment,
+            'revision': revision,
+        })
 
 
 def parse_series_marker(subject_prefixes):
@@ -371,7 +394,8 @@ def find_content(project, mail):
     drop_prefixes = [project.linkname] + project.get_subject_prefix_tags()
     (name, prefixes) = clean_subject(mail.get('Subject'), drop_prefixes)
     (x, n) = parse_series_marker(prefixes)
-    refs = build_references_list(mail)
+    refs = build_references_list(mail, project)
+    ret.refs = refs
     is_root = refs == []
     is_cover_letter = is_root and x == 0
     is_patch = patchbuf is not None
@@ -406,6 +430,7 @@ def find_content(project, mail):
             ret.series.submitted = date
 
     if is_cover_letter:
+        ret.is_cover_letter = True
         ret.revision.cover_letter = clean_content(commentbuf)
         return ret
 
@@ -441,13 +466,10 @@ def find_previous_patch(revision, order, refs):
     # also need to make sure we don't match a patch from a series without a
     # cover letter (see comment below).
     parent_patch = None
-    for ref in refs:
-        try:
-            patch = Patch.objects.get(msgid=ref)
-            parent_patch = patch
+    for message in find_messages(revision.series.project, refs):
+        if message.patch:
+            parent_patch = message.patch
             break
-        except Patch.DoesNotExist:
-            continue
 
     if not parent_patch:
         return None
@@ -521,22 +543,14 @@ def find_series_for_mail(project, name, msgid, is_patch, order, refs):
 
 
 def find_patch_for_comment(project, refs):
-    for ref in refs:
-        patch = None
-
+    for message in find_messages(project, refs):
         # first, check for a direct reply
-        try:
-            patch = Patch.objects.get(project=project, msgid=ref)
-            return patch
-        except Patch.DoesNotExist:
-            pass
+        if message.patch:
+            return message.patch
 
         # see if we have comments that refer to a patch
-        try:
-            comment = Comment.objects.get(patch__project=project, msgid=ref)
-            return comment.patch
-        except Comment.DoesNotExist:
-            pass
+        if message.comment:
+            return message.comment.patch
 
     return None
 
@@ -654,7 +668,10 @@ def on_revision_complete(sender, revision, **kwargs):
         return
 
     name = clean_series_name(new_series.name)
-    previous_series = Series.objects.filter(Q(project=new_series.project),
+    # lock the previous series: a new revision of it could be completed by
+    # a mail of another thread at the same time
+    previous_series = Series.objects.select_for_update() \
+                                    .filter(Q(project=new_series.project),
                                             Q(name__iexact=name) &
                                             ~Q(pk=new_series.pk))
     if len(previous_series) != 1:
@@ -712,45 +729,49 @@ def parse_mail(mail):
     revision = content.revision
 
     series_revision_complete.connect(on_revision_complete)
+    # parse_mail() is called repeatedly by long running processes, make sure
+    # we never leave the handler connected behind us
+    try:
+        if series:
+            if save_required:
+                author = save_author(author)
+                save_required = False
+            series.project = project
+            series.submitter = author
+            series.save()
 
-    if series:
-        if save_required:
-            author.save()
-            save_required = False
-        series.project = project
-        series.submitter = author
-        series.save()
-
-    if revision:
-        revision.series = series
-        revision.save()
-
-    if patch:
-        # we delay the saving until we know we have a patch.
-        if save_required:
-            author.save()
-            save_required = False
-        patch.submitter = author
-        patch.msgid = msgid
-        patch.project = project
-        patch.state = get_state(mail.get('X-Patchwork-State', '').strip())
-        patch.delegate = get_delegate(
-                mail.get('X-Patchwork-Delegate', '').strip())
-        patch.save()
         if revision:
-            revision.add_patch(patch, content.patch_order)
+            revision.series = series
+            revision.save()
 
-    if comment:
-        if save_required:
-            author.save()
-        # we defer this assignment until we know that we have a saved patch
         if patch:
-            comment.patch = patch
-        comment.submitter = author
-        comment.msgid = msgid
-        comment.save()
-
-    series_revision_complete.disconnect(on_revision_complete)
+            # we delay the saving until we know we have a patch.
+            if save_required:
+                author = save_author(author)
+                save_required = False
+            patch.submitter = author
+            patch.msgid = msgid
+            patch.project = project
+            patch.state = get_state(mail.get('X-Patchwork-State', '').strip())
+            patch.delegate = get_delegate(
+                    mail.get('X-Patchwork-Delegate', '').strip())
+            patch.save()
+            if revision:
+                revision.add_patch(patch, content.patch_order)
+
+        if comment:
+            if save_required:
+                author = save_author(author)
+            # we defer this assignment until we know we have a saved patch
+            if patch:
+                comment.patch = patch
+            comment.submitter = author
+            comment.msgid = msgid
+            comment.save()
+
+        index_message(project, mail, content)
+    finally:
+        series_revision_complete.disconnect(on_revision_complete)
 
     return 0
 
@@ -797,28 +818,60 @@ def lock():
     return l
 
 
-def main(args):
-    django.setup()
-    logger = setup_error_handler()
-    parser = argparse.ArgumentParser()
-    parse_lock = None
+# number of rows of the ThreadLock table
+THREAD_LOCK_SLOTS = 4096
 
-    def list_logging_levels():
-        """Give a summary of all available logging levels."""
-        return sorted(VERBOSITY_LEVELS.keys(),
-                      key=lambda x: VERBOSITY_LEVELS[x])
 
-    parser.add_argument('--verbosity', choices=list_logging_levels(),
-                        help='logging level', default='info')
+def thread_lock_slot(project, mail):
+    """Map the (project, thread root) of 'mail' to a ThreadLock slot"""
+    refs = build_references_list(mail, project)
+    if refs:
+        root_msgid = refs[-1]
+    else:
+        root_msgid = mail.get('Message-Id')
 
-    args = vars(parser.parse_args())
+    if isinstance(root_msgid, unicode):
+        root_msgid = root_msgid.encode('utf-8')
+    key = '%d %s' % (project.id, root_msgid.strip())
+    return (zlib.crc32(key) & 0xffffffff) % THREAD_LOCK_SLOTS
 
-    logging.basicConfig(level=VERBOSITY_LEVELS[args['verbosity']])
 
-    mail = message_from_file(sys.stdin)
+def lock_thread(mail):
+    """Make sure mails of the same thread are parsed one at a time.
+
+       This locks the database row associated with the thread of 'mail'
+       until the end of the current transaction. Mails of other threads, or
+       other projects, can be parsed in parallel, from any host using the
+       database."""
+    if 'Message-Id' not in mail:
+        return
+
+    project = find_project(mail)
+    if project is None:
+        return
+
+    slot = thread_lock_slot(project, mail)
+    ThreadLock.objects.get_or_create(slot=slot)
+    ThreadLock.objects.select_for_update().get(slot=slot)
+
+
+def needs_global_lock():
+    # without SELECT ... FOR UPDATE (sqlite), fall back to the global lock
+    return not connection.features.has_select_for_update
+
+
+def ingest_mail(mail, logger=None):
+    """Parse 'mail' in its own transaction, with its thread locked,
+       reporting errors to the admins through 'logger'"""
+    parse_lock = None
     try:
-        parse_lock = lock()
-        return parse_mail(mail)
+        if needs_global_lock():
+            parse_lock = lock()
+        # the search index and the clients waiting for events are updated
+        # once the mail is committed
+        with deferred_updates(), transaction.atomic():
+            lock_thread(mail)
+            return parse_mail(mail)
     except:
         if logger:
             logger.exception('Error when parsing incoming email', extra={
@@ -829,5 +882,27 @@ def main(args):
         release(parse_lock)
 
 
+def list_logging_levels():
+    """Give a summary of all available logging levels."""
+    return sorted(VERBOSITY_LEVELS.keys(),
+                  key=lambda x: VERBOSITY_LEVELS[x])
+
+
+def main(args):
+    django.setup()
+    logger = setup_error_handler()
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--verbosity', choices=list_logging_levels(),
+                        help='logging level', default='info')
+
+    args = vars(parser.parse_args())
+
+    logging.basicConfig(level=VERBOSITY_LEVELS[args['verbosity']])
+
+    mail = message_from_file(sys.stdin)
+    return ingest_mail(mail, logger)
+
+
 if __name__ == '__main__':
     sys.exit(main(sys.argv))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# parsemaild is a long running version of parsemail.py. It listens on a unix
+# socket and parses the mails it receives there, keeping django and the
+# database connection around between mails instead of paying for their
+# initialization each time.
+#
+# The protocol is kept as simple as possible: a client connects, sends the
+# raw mail and shuts down its side of the connection. The daemon then
+# answers with a single status line, either 'OK' or 'ERROR <reason>', and
+# closes the connection. parsemail-client.py implements the client side.
+
+import argparse
+import errno
+from email import message_from_file
+import logging
+import os
+import signal
+import socket
+import SocketServer
+import sys
+
+import django
+from django.db import connection
+
+from patchwork.bin.parsemail import (ingest_mail, setup_error_handler,
+                                     list_logging_levels, VERBOSITY_LEVELS)
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/tmp/patchwork.parsemail.sock'
+
+
+def check_db_connection():
+    # We hold on to the same database connection for as long as the daemon
+    # runs. If the database server has closed it in the meantime, drop it so
+    # the next query opens a new one.
+    if connection.connection is not None and not connection.is_usable():
+        connection.close()
+
+
+def handle_mail(mail, logger=None):
+    """Parse 'mail' and return the status line to send back to the client"""
+    check_db_connection()
+    try:
+        ingest_mail(mail, logger)
+    except Exception as e:
+        LOGGER.exception('Error when parsing incoming email')
+        return 'ERROR %s' % ' '.join(str(e).split())
+    return 'OK'
+
+
+class MailHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        mail = message_from_file(self.rfile)
+        status = handle_mail(mail, self.server.logger)
+        LOGGER.debug('%s: %s', mail.get('Message-Id', '<no Message-Id>'),
+                     status)
+        self.wfile.write(status + '\n')
+
+
+class MailServer(SocketServer.UnixStreamServer):
+    # mails are parsed one after the other, in the order they are received
+    # in. This keeps a single, warm, database connection around.
+
+    def __init__(self, path, logger=None):
+        SocketServer.UnixStreamServer.__init__(self, path, MailHandler)
+        self.logger = logger
+
+
+def remove_stale_socket(path):
+    """Remove a socket left behind by a daemon that didn't exit cleanly.
+       Returns False if another daemon is still listening on 'path'."""
+    if not os.path.exists(path):
+        return True
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except socket.error as e:
+        if e.errno != errno.ECONNREFUSED:
+            raise
+        os.unlink(path)
+        return True
+    finally:
+        s.close()
+
+    return False
+
+
+def _sigterm(signum, frame):
+    sys.exit(0)
+
+
+def main(args):
+    django.setup()
+    logger = setup_error_handler()
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help='path of the unix socket to listen on')
+    parser.add_argument('--mode', default='0660',
+                        help='permissions of the socket, in octal')
+    parser.add_argument('--verbosity', choices=list_logging_levels(),
+                        help='logging level', default='info')
+
+    args = vars(parser.parse_args())
+
+    logging.basicConfig(level=VERBOSITY_LEVELS[args['verbosity']])
+
+    path = args['socket']
+    if not remove_stale_socket(path):
+        LOGGER.error('Another parsemaild is already listening on %s', path)
+        return 1
+
+    server = MailServer(path, logger)
+    os.chmod(path, int(args['mode'], 8))
+    signal.signal(signal.SIGTERM, _sigterm)
+
+    LOGGER.info('Listening on %s', path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,67 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Cache backends
+
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+# the size of the entries of each SizeBoundedLocMemCache, by name
+_sizes = {}
+
+
+class _Sizes(object):
+    def __init__(self):
+        # {key: size}, oldest first
+        self.entries = OrderedDict()
+        self.total = 0
+
+
+class SizeBoundedLocMemCache(LocMemCache):
+    """A local memory cache evicting the oldest entries when the total size
+       of the values, once pickled, goes over the MAX_SIZE option (in bytes,
+       64MB by default). MAX_ENTRIES still applies."""
+
+    def __init__(self, name, params):
+        super(SizeBoundedLocMemCache, self).__init__(name, params)
+        options = params.get('OPTIONS', {})
+        self._max_size = int(options.get('MAX_SIZE', 64 * 1024 * 1024))
+        self._sizes = _sizes.setdefault(name, _Sizes())
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._delete(key)
+        if len(value) > self._max_size:
+            return
+        # entries which expired may still be counted until they are evicted
+        while self._sizes.total + len(value) > self._max_size:
+            self._delete(next(iter(self._sizes.entries)))
+        super(SizeBoundedLocMemCache, self)._set(key, value, timeout)
+        self._sizes.entries[key] = len(value)
+        self._sizes.total += len(value)
+
+    def _delete(self, key):
+        super(SizeBoundedLocMemCache, self)._delete(key)
+        self._sizes.total -= self._sizes.entries.pop(key, 0)
+
+    def clear(self):
+        super(SizeBoundedLocMemCache, self).clear()
+        self._sizes.entries.clear()
+        self._sizes.total = 0
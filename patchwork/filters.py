@@ -18,7 +18,8 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 
-from patchwork.models import Person, State
+from patchwork.models import Person, State, PatchFile
+from patchwork.search import search_patches
 from django.utils.safestring import mark_safe
 from django.utils.html import escape
 from django.contrib.auth.models import User
@@ -71,6 +72,11 @@ class Filter(object):
     def kwargs(self):
         return {}
 
+    def apply(self, queryset):
+        """Filters needing more than field lookups can restrict the
+           queryset here"""
+        return queryset
+
     def __str__(self):
         return '%s: %s' % (self.name, self.kwargs())
 
@@ -234,8 +240,8 @@ class SearchFilter(Filter):
         self.search = str
         self.applied = True
 
-    def kwargs(self):
-        return {'name__icontains': self.search}
+    def apply(self, queryset):
+        return search_patches(queryset, self.search, self.filters.project)
 
     def condition(self):
         return self.search
@@ -253,6 +259,40 @@ class SearchFilter(Filter):
     def form_function(self):
         return mark_safe('function(form) { return form.x.value }')
 
+class PathFilter(Filter):
+    param = 'path'
+    def __init__(self, filters):
+        super(PathFilter, self).__init__(filters)
+        self.name = 'Path'
+        self.path = None
+
+    def _set_key(self, str):
+        str = str.strip()
+        if str == '':
+            return
+        self.path = str
+        self.applied = True
+
+    def kwargs(self):
+        return {'id__in': PatchFile.patches_touching(self.path)}
+
+    def condition(self):
+        return self.path
+
+    def key(self):
+        return self.path
+
+    def _form(self):
+        value = ''
+        if self.path:
+            value = escape(self.path)
+        return mark_safe('<input name="%s" class="form-control" value="%s" '
+                         'placeholder="drivers/gpu/drm/i915/">' %
+                         (self.param, value))
+
+    def form_function(self):
+        return mark_safe('function(form) { return form.x.value }')
+
 class ArchiveFilter(Filter):
     param = 'archive'
     def __init__(self, filters):
@@ -401,6 +441,7 @@ class DelegateFilter(Filter):
 filterclasses = [SubmitterFilter, \
                  StateFilter,
                  SearchFilter,
+                 PathFilter,
                  ArchiveFilter,
                  DelegateFilter]
 
@@ -426,9 +467,12 @@ class Filters:
 
     def apply(self, queryset):
         kwargs = self.filter_conditions()
-        if not kwargs:
-            return queryset
-        return queryset.filter(**kwargs)
+        if kwargs:
+            queryset = queryset.filter(**kwargs)
+        for f in self._filters:
+            if f.applied:
+                queryset = f.apply(queryset)
+        return queryset
 
     def params(self):
         return [ (f.param, f.key()) for f in self._filters \
@@ -438,7 +482,8 @@ class Filters:
         params = dict(self.params())
 
         for (k, v) in self.dict.iteritems():
-            if k not in params:
+            # the page cursors are only valid for the current filters
+            if k not in params and k not in ('after', 'before'):
                 params[k] = v
 
         if remove is not None:
@@ -0,0 +1,158 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Helpers for the management commands recomputing data derived from the
+# content of all the patches (or a subset of them).
+
+import argparse
+import multiprocessing
+import time
+
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.db.models import Case, When, Value
+from django.utils.dateparse import parse_date, parse_datetime
+
+from patchwork.models import Patch, Project
+
+# number of rows written by a single UPDATE, keeping the number of query
+# parameters below the SQLite limit
+UPDATE_CHUNK = 250
+
+
+def _parse_since(value):
+    date = parse_datetime(value) or parse_date(value)
+    if date is None:
+        raise argparse.ArgumentTypeError("invalid date: '%s'" % value)
+    return date
+
+
+def add_arguments(parser):
+    parser.add_argument('--project', action='append', default=[],
+                        metavar='LINKNAME',
+                        help='only process the patches of this project, '
+                             'can be given several times')
+    parser.add_argument('--since', type=_parse_since, default=None,
+                        metavar='DATE',
+                        help='only process the patches submitted after DATE '
+                             '(YYYY-MM-DD[ HH:MM[:SS]])')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes, defaults to the '
+                             'number of CPUs')
+    parser.add_argument('--chunk-size', type=int, default=500,
+                        help='number of patches processed and written at '
+                             'once')
+
+
+def select_patches(ids, options):
+    """The patches selected by the command line: a list of ids, restricted
+       by the --project and --since options"""
+    query = Patch.objects.all()
+
+    if ids:
+        query = query.filter(id__in=ids)
+
+    if options['project']:
+        projects = Project.objects.filter(linkname__in=options['project'])
+        if len(projects) != len(set(options['project'])):
+            raise CommandError('unknown project in %s' %
+                               ', '.join(options['project']))
+        query = query.filter(project__in=projects)
+
+    if options['since']:
+        query = query.filter(date__gte=options['since'])
+
+    return query
+
+
+def bulk_update(query, field, values):
+    """Set 'field' of the objects of 'query' to values[object.id], with one
+       UPDATE for UPDATE_CHUNK objects and without sending any signal"""
+    output_field = query.model._meta.get_field(field)
+    pks = values.keys()
+    for i in range(0, len(pks), UPDATE_CHUNK):
+        chunk = pks[i:i + UPDATE_CHUNK]
+        whens = [When(pk=pk, then=Value(values[pk])) for pk in chunk]
+        query.filter(pk__in=chunk).update(**{
+            field: Case(*whens, output_field=output_field)
+        })
+
+
+def process_patches(command, query, read, work, write, options):
+    """Recompute something for all the patches of 'query', by chunks of
+       --chunk-size patches:
+
+         - read(ids) loads, from the database, the data needed for the
+           patches with these ids,
+         - work(data) does the actual computation. It's run in a pool of
+           --jobs worker processes and must not use the database,
+         - write(result) stores the result of work() in the database. All
+           the chunks processed at the same time are written in a single
+           transaction.
+
+       Progress and throughput are written to command.stdout. Returns the
+       number of processed patches."""
+    count = query.count()
+    chunk_size = max(options['chunk_size'], 1)
+    jobs = options['jobs'] or multiprocessing.cpu_count()
+
+    pool = None
+    if jobs > 1 and count > chunk_size:
+        # workers inherit the database connection but never use it, they
+        # only get data read by this process
+        pool = multiprocessing.Pool(jobs)
+
+    ids_query = query.order_by('id').values_list('id', flat=True)
+    done = 0
+    last_id = 0
+    start_time = time.time()
+
+    try:
+        while True:
+            # keep all the workers busy, with one chunk each
+            chunks = []
+            for _ in range(jobs):
+                ids = list(ids_query.filter(id__gt=last_id)[:chunk_size])
+                if not ids:
+                    break
+                last_id = ids[-1]
+                done += len(ids)
+                chunks.append(read(ids))
+
+            if not chunks:
+                break
+
+            if pool:
+                results = pool.map(work, chunks)
+            else:
+                results = map(work, chunks)
+
+            with transaction.atomic():
+                for result in results:
+                    write(result)
+
+            rate = done / max(time.time() - start_time, 1e-6)
+            command.stdout.write('%06d/%06d (%.1f patches/s)\r' %
+                                 (done, count, rate), ending='')
+            command.stdout.flush()
+    finally:
+        if pool:
+            pool.terminate()
+
+    return done
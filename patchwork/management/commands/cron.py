@@ -18,12 +18,14 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 from django.core.management.base import BaseCommand
+from patchwork import mboxcache, webhooks
 from patchwork.utils import send_notifications, do_expiry
 
 
 class Command(BaseCommand):
-    help = ('Run periodic patchwork functions: send notifications and '
-            'expire unused users')
+    help = ('Run periodic patchwork functions: send notifications, '
+            'expire unused users, prune the mbox cache and the log of the '
+            'webhook deliveries')
 
     def handle(self, *args, **kwargs):
         errors = send_notifications()
@@ -32,3 +34,5 @@ class Command(BaseCommand):
                               (recipient.email, error))
 
         do_expiry()
+        mboxcache.prune()
+        webhooks.prune()
@@ -0,0 +1,58 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.core.management.base import BaseCommand
+
+from patchwork import webhooks
+
+
+class Command(BaseCommand):
+    help = 'POST the events of the projects to their webhooks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-j', '--jobs', type=int, default=4,
+                            help='number of requests made at once')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='number of seconds between two checks for '
+                                 'new events')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='only deliver the events due now and exit, '
+                                 'rather than running forever')
+
+    def handle(self, *args, **options):
+        jobs = max(options['jobs'], 1)
+        # the threads only make the HTTP requests, not database queries
+        pool = ThreadPool(jobs)
+        deliverer = webhooks.Deliverer(pool, jobs)
+
+        try:
+            while True:
+                started = deliverer.start()
+                if not started and not deliverer.in_flight:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+                # record the completed requests, then start the next ones
+                deliverer.record(options['interval'])
+        finally:
+            pool.terminate()
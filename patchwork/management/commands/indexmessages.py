@@ -0,0 +1,156 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from patchwork.bin.parsemail import (build_references_from_headers,
+                                     find_header_in_text)
+from patchwork.models import Project, Patch, Comment, SeriesRevision, Message
+
+
+class IndexEntry(object):
+    def __init__(self, msgid):
+        self.msgid = msgid
+        self.headers_refs = []
+        self.patch_id = None
+        self.comment_id = None
+        self.revision_id = None
+
+    def set_headers(self, headers):
+        if self.headers_refs:
+            return
+        self.headers_refs = build_references_from_headers(
+            find_header_in_text(headers, 'In-Reply-To'),
+            find_header_in_text(headers, 'References'))
+
+
+def collect_entries(project):
+    entries = {}
+
+    def entry(msgid):
+        if msgid not in entries:
+            entries[msgid] = IndexEntry(msgid)
+        return entries[msgid]
+
+    patches = Patch.objects.filter(project=project) \
+                           .values_list('id', 'msgid', 'headers')
+    for (pk, msgid, headers) in patches.iterator():
+        e = entry(msgid)
+        e.patch_id = pk
+        e.set_headers(headers)
+
+    comments = Comment.objects.filter(patch__project=project) \
+                              .order_by('id') \
+                              .values_list('id', 'msgid', 'headers')
+    for (pk, msgid, headers) in comments.iterator():
+        e = entry(msgid)
+        if e.comment_id is None:
+            e.comment_id = pk
+        e.set_headers(headers)
+
+    # cover letters are thread roots and only the first revision of a series
+    # has the cover letter
+    revisions = SeriesRevision.objects.filter(series__project=project,
+                                              cover_letter__isnull=False) \
+                                      .order_by('-id') \
+                                      .values_list('id', 'root_msgid')
+    for (pk, msgid) in revisions.iterator():
+        entry(msgid).revision_id = pk
+
+    return entries
+
+
+def build_references(entries):
+    """Compute the list of ancestors of each entry, the same way parsemail
+       does it: the references of the mail headers, followed by the ones of
+       the highest known ancestor"""
+    references = {}
+
+    for msgid in entries:
+        # walk up to the first ancestor with known references, then unwind
+        chain = []
+        seen = set()
+        while msgid not in references:
+            seen.add(msgid)
+            chain.append(msgid)
+            refs = entries[msgid].headers_refs
+            if not refs or refs[-1] not in entries or refs[-1] in seen:
+                break
+            msgid = refs[-1]
+
+        for msgid in reversed(chain):
+            refs = entries[msgid].headers_refs
+            if refs and refs[-1] in references:
+                references[msgid] = refs + references[refs[-1]]
+            else:
+                references[msgid] = refs
+
+    return references
+
+
+class Command(BaseCommand):
+    help = 'Add the existing patches, comments and cover letters to the ' \
+           'Message index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('projects', nargs='*',
+                            help='link names of the projects to index')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='number of messages to insert at once')
+
+    def index_project(self, project, batch_size):
+        entries = collect_entries(project)
+        references = build_references(entries)
+
+        # mails parsed since the Message table has been created are already
+        # indexed, and may not be patches or comments.
+        indexed = set(Message.objects.filter(project=project)
+                                     .values_list('msgid', flat=True))
+
+        messages = []
+        for msgid, e in entries.iteritems():
+            if msgid in indexed:
+                continue
+            refs = references[msgid]
+            messages.append(Message(project=project, msgid=msgid,
+                                    parent_msgid=refs[0] if refs else None,
+                                    root_msgid=refs[-1] if refs else msgid,
+                                    references=' '.join(refs),
+                                    patch_id=e.patch_id,
+                                    comment_id=e.comment_id,
+                                    revision_id=e.revision_id))
+
+        with transaction.atomic():
+            Message.objects.bulk_create(messages, batch_size=batch_size)
+
+        return len(messages)
+
+    def handle(self, *args, **options):
+        projects = Project.objects.all()
+        if options['projects']:
+            projects = projects.filter(linkname__in=options['projects'])
+            if len(projects) != len(set(options['projects'])):
+                raise CommandError('unknown project in %s' %
+                                   ', '.join(options['projects']))
+
+        for project in projects:
+            count = self.index_project(project, max(options['batch_size'], 1))
+            self.stdout.write('%s: %d messages' % (project.linkname, count))
+        self.stdout.write('done')
@@ -0,0 +1,196 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from email import message_from_string
+from email.parser import HeaderParser
+import logging
+import mailbox
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from patchwork.bin.parsemail import (parse_mail, mail_date, lock,
+                                     lock_thread, needs_global_lock)
+from patchwork.lock import release
+from patchwork.models import deferred_updates
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _file_loader(path):
+    def load():
+        with open(path) as f:
+            return f.read()
+    return load
+
+
+def _mailbox_loader(mbox, key):
+    return lambda: mbox.get_string(key)
+
+
+def archive_mails(path):
+    """List the mails of the mbox file or the (Mail)dir at 'path', in the
+       order they've arrived in.
+
+       Returns a list of callables, each of them returning the raw content of
+       one mail."""
+    if os.path.isfile(path):
+        # mails are appended to mbox files as they arrive
+        mbox = mailbox.mbox(path, factory=None, create=False)
+        return [_mailbox_loader(mbox, key) for key in mbox.iterkeys()]
+
+    if not os.path.isdir(path):
+        raise CommandError("%s is neither a file nor a directory" % path)
+
+    if os.path.isdir(os.path.join(path, 'cur')):
+        dirs = [os.path.join(path, d) for d in ('new', 'cur')]
+    else:
+        dirs = [path]
+
+    files = []
+    for d in dirs:
+        for name in os.listdir(d):
+            filename = os.path.join(d, name)
+            if os.path.isfile(filename):
+                files.append((os.path.getmtime(filename), name, filename))
+
+    # oldest first, like parsemail-batch.sh (ls -rt) used to do
+    files.sort()
+    return [_file_loader(filename) for (_, _, filename) in files]
+
+
+def sort_by_date(mails):
+    """Sort mails by their Date: header, keeping the arrival order for mails
+       with the same date"""
+    parser = HeaderParser()
+    dates = [mail_date(parser.parsestr(load(), True)) for load in mails]
+    order = sorted(range(len(mails)), key=lambda i: (dates[i], i))
+    return [mails[i] for i in order]
+
+
+class Checkpoint(object):
+    """Remembers how many mails of an archive have been committed to the
+       database, so an interrupted import can be resumed."""
+
+    def __init__(self, filename, archive):
+        self.filename = filename
+        self.archive = os.path.abspath(archive)
+
+    def load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return 0
+
+        with open(self.filename) as f:
+            (count, archive) = f.read().strip().split(' ', 1)
+
+        if archive != self.archive:
+            raise CommandError("checkpoint %s is for %s, not %s" %
+                               (self.filename, archive, self.archive))
+        return int(count)
+
+    def save(self, count):
+        if not self.filename:
+            return
+
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('%d %s\n' % (count, self.archive))
+        os.rename(tmp, self.filename)
+
+    def remove(self):
+        if self.filename and os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+
+class Command(BaseCommand):
+    help = 'Parse the mails of an mbox file or of a (Mail)dir'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archive',
+                            help='mbox file, Maildir or directory of mails')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='number of mails to commit at once')
+        parser.add_argument('--checkpoint', default=None,
+                            help='file used to record the progress of the '
+                                 'import and to resume it if interrupted')
+        parser.add_argument('--sort-by-date', action='store_true',
+                            default=False,
+                            help='parse mails in Date: header order instead '
+                                 'of arrival order')
+
+    def parse_batch(self, mails):
+        errors = 0
+
+        # thread locks are held until the batch is committed. When we need
+        # to fall back to the global parsemail lock, only hold it for the
+        # duration of the batch so mails coming from the MTA don't wait for
+        # the whole import.
+        parse_lock = None
+        try:
+            if needs_global_lock():
+                parse_lock = lock()
+            # the patches of the batch are indexed, and its events published,
+            # once it's committed
+            with deferred_updates(), transaction.atomic():
+                for load in mails:
+                    mail = message_from_string(load())
+                    try:
+                        # a failed mail only rolls back its own savepoint
+                        with transaction.atomic():
+                            lock_thread(mail)
+                            parse_mail(mail)
+                    except Exception:
+                        LOGGER.exception('Error when parsing %s',
+                                         mail.get('Message-Id'))
+                        errors += 1
+        finally:
+            release(parse_lock)
+
+        return errors
+
+    def handle(self, *args, **options):
+        path = options['archive']
+        batch_size = max(options['batch_size'], 1)
+
+        mails = archive_mails(path)
+        if options['sort_by_date']:
+            mails = sort_by_date(mails)
+        count = len(mails)
+
+        checkpoint = Checkpoint(options['checkpoint'], path)
+        start = done = checkpoint.load()
+        errors = 0
+        start_time = time.time()
+
+        while done < count:
+            batch = mails[done:done + batch_size]
+            errors += self.parse_batch(batch)
+            done += len(batch)
+            checkpoint.save(done)
+
+            rate = (done - start) / max(time.time() - start_time, 1e-6)
+            self.stdout.write('%06d/%06d (%.1f mails/s)\r' %
+                              (done, count, rate), ending='')
+            self.stdout.flush()
+
+        checkpoint.remove()
+        self.stdout.write('\ndone, %d mails parsed, %d errors' %
+                          (done - start, errors))
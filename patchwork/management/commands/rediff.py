@@ -0,0 +1,54 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from django.core.management.base import BaseCommand
+
+from patchwork.models import Patch
+
+
+class Command(BaseCommand):
+    help = 'Update the diffstat and list of modified files on existing patches'
+    args = '[<patch_id>...]'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true', default=False,
+                            help='only process patches without a diffstat, '
+                                 'eg. the ones parsed before it existed')
+
+    def handle(self, *args, **options):
+        query = Patch.objects
+
+        if args:
+            query = query.filter(id__in=args)
+        else:
+            query = query.all()
+
+        if options['missing']:
+            query = query.filter(n_files__isnull=True, content__isnull=False)
+
+        count = query.count()
+
+        for i, patch in enumerate(query.iterator()):
+            patch.n_files = None
+            patch.save()
+            if (i % 10) == 0:
+                self.stdout.write('%06d/%06d\r' % (i, count), ending='')
+                self.stdout.flush()
+        self.stdout.write('%06d/%06d\r' % (count, count), ending='')
+        self.stdout.write('\ndone')
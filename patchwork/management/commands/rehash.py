@@ -22,27 +22,41 @@
 
 from django.core.management.base import BaseCommand
 
+from patchwork.management import bulk
 from patchwork.models import Patch
+from patchwork.parser import hash_patch
+
+
+def read_patches(ids):
+    return list(Patch.objects.filter(id__in=ids)
+                             .values_list('id', 'content', 'hash'))
+
+
+def hash_patches(patches):
+    """Returns a dict with the new hash of the patches whose hash changed"""
+    hashes = {}
+    for (pk, content, old_hash) in patches:
+        hash = None
+        if content is not None:
+            hash = hash_patch(content).hexdigest()
+        if hash != old_hash:
+            hashes[pk] = hash
+    return hashes
+
+
+def write_hashes(hashes):
+    bulk.bulk_update(Patch.objects.all(), 'hash', hashes)
 
 
 class Command(BaseCommand):
     help = 'Update the hashes on existing patches'
     args = '[<patch_id>...]'
 
-    def handle(self, *args, **options):
-        query = Patch.objects
-
-        if args:
-            query = query.filter(id_in=args)
-        else:
-            query = query.all()
+    def add_arguments(self, parser):
+        bulk.add_arguments(parser)
 
-        count = query.count()
-
-        for i, patch in enumerate(query.iterator()):
-            patch.hash = None
-            patch.save()
-            if (i % 10) == 0:
-                self.stdout.write('%06d/%06d\r' % (i, count), ending='')
-                self.stdout.flush()
+    def handle(self, *args, **options):
+        query = bulk.select_patches(args, options)
+        bulk.process_patches(self, query, read_patches, hash_patches,
+                             write_hashes, options)
         self.stdout.write('\ndone')
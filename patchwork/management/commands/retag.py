@@ -17,29 +17,79 @@
 # along with Patchwork; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-import sys
+from collections import Counter
+
 from django.core.management.base import BaseCommand
-from patchwork.models import Patch
+
+from patchwork.management import bulk
+from patchwork.models import Comment, Patch, PatchTag, Tag, tag_count_field
+from patchwork.parser import extract_tags
+
+
+def read_comments(ids, tags):
+    comments = dict((pk, []) for pk in ids)
+    for (pk, content) in Comment.objects.filter(patch_id__in=ids) \
+                                        .values_list('patch_id', 'content'):
+        comments[pk].append(content)
+    return (tags, comments.items())
+
+
+def count_tags(data):
+    """Returns the {tag id: count} dict of each patch, as a list of
+       (patch id, counts) tuples"""
+    (tags, comments) = data
+    counts = []
+    for (pk, contents) in comments:
+        counter = Counter()
+        for content in contents:
+            counter += extract_tags(content, tags)
+        counts.append((pk, dict((tag.id, n) for (tag, n) in counter.items()
+                                if n)))
+    return counts
+
+
+def write_tag_counts(counts, tags):
+    counts = dict(counts)
+
+    for tag in tags:
+        if tag.slot is not None:
+            bulk.bulk_update(Patch.objects.all(), tag_count_field(tag.slot),
+                             dict((pk, c.get(tag.id, 0)) for (pk, c) in
+                                  counts.iteritems()))
+
+    # the PatchTag objects we have and the ones we want, each of them as a
+    # {(patch id, tag id): ...} dict
+    have = dict(((pt.patch_id, pt.tag_id), pt) for pt in
+                PatchTag.objects.filter(patch_id__in=counts.keys()))
+    want = dict(((pk, tag_id), n) for (pk, tags) in counts.iteritems()
+                for (tag_id, n) in tags.iteritems())
+
+    PatchTag.objects.filter(id__in=[pt.id for (key, pt) in have.iteritems()
+                                    if key not in want]).delete()
+    PatchTag.objects.bulk_create([PatchTag(patch_id=pk, tag_id=tag_id,
+                                           count=n)
+                                  for ((pk, tag_id), n) in want.iteritems()
+                                  if (pk, tag_id) not in have])
+    bulk.bulk_update(PatchTag.objects.all(), 'count',
+                     dict((have[key].id, n) for (key, n) in want.iteritems()
+                          if key in have and have[key].count != n))
 
 
 class Command(BaseCommand):
     help = 'Update the tag (Ack/Review/Test) counts on existing patches'
     args = '[<patch_id>...]'
 
+    def add_arguments(self, parser):
+        bulk.add_arguments(parser)
+
     def handle(self, *args, **options):
-        query = Patch.objects
-
-        if args:
-            query = query.filter(id__in=args)
-        else:
-            query = query.all()
-
-        count = query.count()
-
-        for i, patch in enumerate(query.iterator()):
-            patch.refresh_tag_counts()
-            if (i % 10) == 0:
-                sys.stdout.write('%06d/%06d\r' % (i, count))
-                sys.stdout.flush()
-        sys.stdout.write('%06d/%06d\r' % (count, count))
-        sys.stdout.write('\ndone\n')
+        # tags aren't counted on projects with use_tags unset
+        query = bulk.select_patches(args, options) \
+                    .filter(project__use_tags=True)
+        tags = list(Tag.objects.all())
+        bulk.process_patches(self, query,
+                             lambda ids: read_comments(ids, tags),
+                             count_tags,
+                             lambda counts: write_tag_counts(counts, tags),
+                             options)
+        self.stdout.write('\ndone')
@@ -0,0 +1,117 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from patchwork.models import Project, ProjectCounters, TodoCounter
+
+
+class Command(BaseCommand):
+    help = 'Check the cached patch and series counts of the projects and ' \
+           'todo lists, and fix the wrong ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('projects', nargs='*',
+                            help='link names of the projects to check')
+        parser.add_argument('--verify', action='store_true', default=False,
+                            help='only report the wrong counters, and fail '
+                                 'if there are any')
+
+    def check_projects(self, projects, verify):
+        counts = ProjectCounters.compute(projects)
+        counters = dict((c.project_id, c) for c in
+                        ProjectCounters.objects.filter(project__in=projects))
+        linknames = dict(projects.values_list('id', 'linkname'))
+
+        errors = 0
+        for (pk, fields) in counts.iteritems():
+            counter = counters.get(pk)
+            if counter is None:
+                self.stdout.write('%s: missing counters' % linknames[pk])
+                errors += 1
+                if not verify:
+                    ProjectCounters.objects.create(project_id=pk, **fields)
+                continue
+
+            wrong = dict((f, n) for (f, n) in fields.iteritems()
+                         if getattr(counter, f) != n)
+            for (f, n) in sorted(wrong.iteritems()):
+                self.stdout.write('%s: %s is %d instead of %d' %
+                                  (linknames[pk], f, getattr(counter, f), n))
+            if wrong:
+                errors += 1
+                if not verify:
+                    ProjectCounters.objects.filter(project_id=pk) \
+                                           .update(**wrong)
+
+        return errors
+
+    def check_todo_lists(self, projects, verify):
+        counts = TodoCounter.compute(projects)
+        counters = dict(((c.user_id, c.project_id), c) for c in
+                        TodoCounter.objects.filter(project__in=projects)
+                                           .select_related('user',
+                                                           'project'))
+
+        errors = 0
+        for key in set(counts) | set(counters):
+            n = counts.get(key, 0)
+            counter = counters.get(key)
+            if counter is not None and counter.count == n:
+                continue
+            if counter is None and not n:
+                continue
+
+            errors += 1
+            if counter is None:
+                self.stdout.write('todo list of user %d for project %d: '
+                                  'missing counter' % key)
+                if not verify:
+                    TodoCounter.objects.create(user_id=key[0],
+                                               project_id=key[1], count=n)
+            else:
+                self.stdout.write('todo list of %s for %s: count is %d '
+                                  'instead of %d' %
+                                  (counter.user.username,
+                                   counter.project.linkname, counter.count,
+                                   n))
+                if not verify:
+                    TodoCounter.objects.filter(pk=counter.pk).update(count=n)
+
+        return errors
+
+    def handle(self, *args, **options):
+        projects = Project.objects.all()
+        if options['projects']:
+            projects = projects.filter(linkname__in=options['projects'])
+            if len(projects) != len(set(options['projects'])):
+                raise CommandError('unknown project in %s' %
+                                   ', '.join(options['projects']))
+
+        verify = options['verify']
+        with transaction.atomic():
+            errors = self.check_projects(projects, verify)
+            errors += self.check_todo_lists(projects, verify)
+
+        if verify and errors:
+            raise CommandError('%d wrong counters' % errors)
+        if errors:
+            self.stdout.write('fixed %d counters' % errors)
+        self.stdout.write('done')
@@ -0,0 +1,71 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from django.core.management.base import BaseCommand, CommandError
+
+from patchwork import mboxcache
+from patchwork.management import bulk
+from patchwork.models import Patch
+from patchwork.views import patches_to_mbox
+
+
+def read_mboxes(ids):
+    """The (patch id, mbox generation, mbox) of the patches with these ids
+       which aren't in the cache yet"""
+    patches = [p for p in Patch.objects.filter(id__in=ids)
+               if not mboxcache.contains(p.id, p.mbox_generation)]
+    return [(p.id, p.mbox_generation, mail.as_string(True))
+            for (p, mail) in zip(patches, patches_to_mbox(patches))]
+
+
+def write_mboxes(mboxes):
+    for (patch_id, generation, mbox) in mboxes:
+        mboxcache.put(patch_id, generation, mbox)
+
+
+class Command(BaseCommand):
+    help = 'Add the mboxes of existing patches to the mbox cache, or prune it'
+    args = '[<patch_id>...]'
+
+    def add_arguments(self, parser):
+        bulk.add_arguments(parser)
+        parser.add_argument('--prune', action='store_true', default=False,
+                            help='only remove the stale and least recently '
+                                 'used mboxes from the cache')
+        parser.add_argument('--max-size', type=int, default=None,
+                            help='maximum size of the cache in bytes, '
+                                 'defaults to settings.MBOX_CACHE_SIZE')
+
+    def handle(self, *args, **options):
+        if not mboxcache.enabled():
+            raise CommandError('the mbox cache is disabled, see '
+                               'settings.MBOX_CACHE_DIR')
+
+        if not options['prune']:
+            # generating mboxes is mostly database work
+            options['jobs'] = 1
+            query = bulk.select_patches(args, options)
+            bulk.process_patches(self, query, read_mboxes,
+                                 lambda mboxes: mboxes, write_mboxes,
+                                 options)
+            self.stdout.write('')
+
+        (removed, size) = mboxcache.prune(options['max_size'])
+        self.stdout.write('removed %d mboxes, the cache is now %d bytes' %
+                          (removed, size))
@@ -0,0 +1,45 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from django.core.management.base import BaseCommand, CommandError
+
+from patchwork import search
+from patchwork.management import bulk
+from patchwork.models import patch_search_documents
+
+
+class Command(BaseCommand):
+    help = 'Add existing patches to the search index, or update them'
+    args = '[<patch_id>...]'
+
+    def add_arguments(self, parser):
+        bulk.add_arguments(parser)
+
+    def handle(self, *args, **options):
+        if search.get_backend() is None:
+            raise CommandError('the database has no search index')
+
+        # building the documents is all database work, there's nothing to
+        # share with worker processes
+        options['jobs'] = 1
+        query = bulk.select_patches(args, options)
+        bulk.process_patches(self, query, patch_search_documents,
+                             lambda documents: documents,
+                             search.write_documents, options)
+        self.stdout.write('\ndone')
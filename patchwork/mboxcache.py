@@ -0,0 +1,180 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# On-disk cache of the mbox of the patches.
+#
+# The mbox of a patch is stored in settings.MBOX_CACHE_DIR, in a file named
+# after the patch id and its mbox generation, which is incremented whenever
+# the patch, its comments or its submitter change. A cached mbox is never
+# out of date: a new generation is simply a different file.
+#
+# Files are spread over 256 subdirectories. The modification time of a file
+# is the last time it was used, prune() removes the least recently used ones
+# when the cache is bigger than settings.MBOX_CACHE_SIZE, as well as the ones
+# of previous generations.
+
+import os
+import re
+import tempfile
+import time
+
+from django.conf import settings
+
+from patchwork.models import Patch
+
+_file_re = re.compile(r'^(\d+)-(\d+)\.mbox$')
+# files being written by put()
+_tmp_file_re = re.compile(r'^\.\d+-')
+
+# temporary files older than this (in seconds) were left by a failed put()
+_TMP_FILE_MAX_AGE = 3600
+
+# number of patches whose generation is read at once when pruning
+_PRUNE_CHUNK = 500
+
+# mkstemp() creates files only readable by their owner, cached mboxes get the
+# permissions of the files usually created by the process instead
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def enabled():
+    return settings.MBOX_CACHE_DIR is not None
+
+
+def _path(patch_id, generation):
+    return os.path.join(settings.MBOX_CACHE_DIR, '%02x' % (patch_id % 256),
+                        '%d-%d.mbox' % (patch_id, generation))
+
+
+def contains(patch_id, generation):
+    return enabled() and os.path.exists(_path(patch_id, generation))
+
+
+def get(patch_id, generation):
+    """The cached mbox of a patch, None if it isn't in the cache"""
+    if not enabled():
+        return None
+
+    path = _path(patch_id, generation)
+    try:
+        with open(path, 'rb') as f:
+            mbox = f.read()
+        os.utime(path, None)
+    except (IOError, OSError):
+        return None
+    return mbox
+
+
+def put(patch_id, generation, mbox):
+    """Store the mbox of a patch, replacing its previous generation. The
+       cache being only an optimisation, errors are ignored."""
+    if not enabled():
+        return
+
+    path = _path(patch_id, generation)
+    directory = os.path.dirname(path)
+    tmp_path = None
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # readers never see partially written files
+        (fd, tmp_path) = tempfile.mkstemp(dir=directory,
+                                          prefix='.%d-' % patch_id)
+        os.fchmod(fd, 0o666 & ~_umask)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(mbox)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        if tmp_path is not None:
+            _remove(tmp_path)
+        return
+
+    # older generations, when the previous one wasn't cached, are left to
+    # prune()
+    _remove(_path(patch_id, generation - 1))
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+        return True
+    except OSError:
+        return False
+
+
+def prune(max_size=None):
+    """Remove the mboxes of previous generations and of deleted patches from
+       the cache, as well as the temporary files left by failed writes, then
+       the least recently used mboxes until the cache is no bigger than
+       'max_size' bytes (settings.MBOX_CACHE_SIZE by default). Returns the
+       number of removed files and the size of the cache."""
+    if not enabled():
+        return (0, 0)
+    if max_size is None:
+        max_size = settings.MBOX_CACHE_SIZE
+
+    removed = 0
+    files = []
+    tmp_limit = time.time() - _TMP_FILE_MAX_AGE
+    for (directory, _, names) in os.walk(settings.MBOX_CACHE_DIR):
+        for name in names:
+            match = _file_re.match(name)
+            is_tmp = _tmp_file_re.match(name)
+            if not match and not is_tmp:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if is_tmp:
+                # the ones still being written are recent
+                if st.st_mtime < tmp_limit and _remove(path):
+                    removed += 1
+                continue
+            files.append((st.st_mtime, st.st_size, path,
+                          int(match.group(1)), int(match.group(2))))
+
+    generations = {}
+    ids = list(set(f[3] for f in files))
+    for i in range(0, len(ids), _PRUNE_CHUNK):
+        generations.update(Patch.objects.filter(id__in=ids[i:i + _PRUNE_CHUNK])
+                                        .values_list('id', 'mbox_generation'))
+
+    size = 0
+    current = []
+    for f in files:
+        if generations.get(f[3]) == f[4]:
+            current.append(f)
+            size += f[1]
+        elif _remove(f[2]):
+            removed += 1
+
+    # oldest first
+    current.sort()
+    for (_, file_size, path, _, _) in current:
+        if size <= max_size:
+            break
+        if _remove(path):
+            removed += 1
+            size -= file_size
+
+    return (removed, size)
@@ -0,0 +1,44 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from patchwork.models import deferred_updates
+
+
+class DeferredUpdatesMiddleware(object):
+    """Run each request in a deferred_updates() block, so the events logged
+       by the views are only published once their transactions are over,
+       with the patches they changed indexed once."""
+
+    def process_request(self, request):
+        request._deferred_updates = deferred_updates()
+        request._deferred_updates.__enter__()
+
+    def _end(self, request, exc_info):
+        block = getattr(request, '_deferred_updates', None)
+        if block is None:
+            return
+        del request._deferred_updates
+        block.__exit__(*exc_info)
+
+    def process_exception(self, request, exception):
+        self._end(request, (type(exception), exception, None))
+
+    def process_response(self, request, response):
+        self._end(request, (None, None, None))
+        return response
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0009_test_results_mail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadLock',
+            fields=[
+                ('slot', models.IntegerField(serialize=False, primary_key=True)),
+            ],
+        ),
+    ]
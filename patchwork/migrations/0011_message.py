@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0010_threadlock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('msgid', models.CharField(max_length=255)),
+                ('parent_msgid', models.CharField(max_length=255, null=True, blank=True)),
+                ('root_msgid', models.CharField(max_length=255, db_index=True)),
+                ('references', models.TextField(blank=True)),
+                ('comment', models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='patchwork.Comment', null=True)),
+                ('patch', models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='patchwork.Patch', null=True)),
+                ('project', models.ForeignKey(to='patchwork.Project')),
+                ('revision', models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='patchwork.SeriesRevision', null=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='message',
+            unique_together=set([('project', 'msgid')]),
+        ),
+    ]
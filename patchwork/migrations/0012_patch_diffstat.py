@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0011_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatchFile',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('path', models.CharField(max_length=255)),
+                ('old_path', models.CharField(max_length=255, blank=True)),
+                ('start', models.IntegerField()),
+                ('end', models.IntegerField()),
+                ('insertions', models.IntegerField(default=0)),
+                ('deletions', models.IntegerField(default=0)),
+                ('hunks', jsonfield.fields.JSONField(default=[])),
+            ],
+            options={
+                'ordering': ['start'],
+            },
+        ),
+        migrations.AddField(
+            model_name='patch',
+            name='n_deletions',
+            field=models.IntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='patch',
+            name='n_files',
+            field=models.IntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='patch',
+            name='n_insertions',
+            field=models.IntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='patchfile',
+            name='patch',
+            field=models.ForeignKey(to='patchwork.Patch'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0012_patch_diffstat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='patchfile',
+            name='old_path',
+            field=models.CharField(db_index=True, max_length=255, blank=True),
+        ),
+        migrations.AlterField(
+            model_name='patchfile',
+            name='path',
+            field=models.CharField(max_length=255, db_index=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import patchwork.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0013_patchfile_path_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='patch',
+            name='hash',
+            field=patchwork.models.HashField(db_index=True, max_length=40, null=True, blank=True),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_tag_counts(apps, schema_editor):
+    Tag = apps.get_model('patchwork', 'Tag')
+    cursor = schema_editor.connection.cursor()
+
+    # give the first tags a slot and copy their counts from PatchTag
+    for (slot, tag) in enumerate(Tag.objects.order_by('id')[:8]):
+        tag.slot = slot
+        tag.save()
+        cursor.execute(
+            "UPDATE patchwork_patch SET tag_count_%d = coalesce("
+            "(SELECT count FROM patchwork_patchtag "
+            "WHERE patchwork_patchtag.patch_id=patchwork_patch.id "
+            "AND patchwork_patchtag.tag_id=%%s), 0)" % slot, [tag.id])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0014_patch_hash_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patch',
+            name='tag_count_0',
+            field=models.IntegerField(default=0, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='patch',
+            name='tag_count_1',
+            field=models.IntegerField(default=0, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='patch',
+            name='tag_count_2',
+            field=models.IntegerField(default=0, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='patch',
+            name='tag_count_3',
+            field=models.IntegerField(default=0, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='patch',
+            name='tag_count_4',
+            field=models.IntegerField(default=0, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='patch',
+            name='tag_count_5',
+            field=models.IntegerField(default=0, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='patch',
+            name='tag_count_6',
+            field=models.IntegerField(default=0, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='patch',
+            name='tag_count_7',
+            field=models.IntegerField(default=0, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='slot',
+            field=models.PositiveSmallIntegerField(unique=True, null=True, editable=False, blank=True),
+        ),
+        migrations.RunPython(fill_tag_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.conf import settings
+
+
+def fill_counters(apps, schema_editor):
+    Project = apps.get_model('patchwork', 'Project')
+    Patch = apps.get_model('patchwork', 'Patch')
+    Series = apps.get_model('patchwork', 'Series')
+    ProjectCounters = apps.get_model('patchwork', 'ProjectCounters')
+    TodoCounter = apps.get_model('patchwork', 'TodoCounter')
+
+    counters = dict((pk, ProjectCounters(project_id=pk))
+                    for pk in Project.objects.values_list('id', flat=True))
+    patches = Patch.objects.order_by().values_list('project', 'archived') \
+                                      .annotate(n=Count('id'))
+    for (pk, archived, n) in patches:
+        if archived:
+            counters[pk].n_archived_patches = n
+        else:
+            counters[pk].n_patches = n
+    for (pk, n) in Series.objects.order_by().values_list('project') \
+                                 .annotate(n=Count('id')):
+        counters[pk].n_series = n
+    ProjectCounters.objects.bulk_create(counters.values())
+
+    todo = Patch.objects.filter(archived=False, delegate__isnull=False,
+                                state__action_required=True) \
+                        .order_by().values_list('delegate', 'project') \
+                        .annotate(n=Count('id'))
+    TodoCounter.objects.bulk_create([TodoCounter(user_id=user_id,
+                                                 project_id=project_id,
+                                                 count=n)
+                                     for (user_id, project_id, n) in todo])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('patchwork', '0015_patch_tag_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectCounters',
+            fields=[
+                ('project', models.OneToOneField(related_name='counters', primary_key=True, serialize=False, to='patchwork.Project')),
+                ('n_patches', models.IntegerField(default=0)),
+                ('n_archived_patches', models.IntegerField(default=0)),
+                ('n_series', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TodoCounter',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('count', models.IntegerField(default=0)),
+                ('project', models.ForeignKey(to='patchwork.Project')),
+                ('user', models.ForeignKey(related_name='todo_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='todocounter',
+            unique_together=set([('user', 'project')]),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
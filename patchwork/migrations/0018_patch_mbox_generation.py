@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0017_patch_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patch',
+            name='mbox_generation',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_project(apps, schema_editor):
+    Series = apps.get_model('patchwork', 'Series')
+    EventLog = apps.get_model('patchwork', 'EventLog')
+
+    series = Series.objects.filter(eventlog__isnull=False).distinct() \
+                           .values_list('id', 'project')
+    for (series_id, project_id) in series:
+        EventLog.objects.filter(series_id=series_id) \
+                        .update(project_id=project_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0018_patch_mbox_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventlog',
+            name='project',
+            field=models.ForeignKey(to='patchwork.Project', null=True),
+        ),
+        migrations.RunPython(fill_project, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# separate from 0019, PostgreSQL can't alter a table with pending updates in
+# the same transaction
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0019_eventlog_project'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eventlog',
+            name='project',
+            field=models.ForeignKey(to='patchwork.Project'),
+        ),
+        migrations.AlterIndexTogether(
+            name='eventlog',
+            index_together=set([('project', 'id')]),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import datetime
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0020_eventlog_project_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Webhook',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('url', models.URLField(max_length=2000)),
+                ('secret', models.CharField(help_text=b'Key of the HMAC-SHA256 signature of the requests, in their X-Patchwork-Signature header', max_length=255, blank=True)),
+                ('series_events', models.BooleanField(default=True, help_text=b'Send the series-new-revision events')),
+                ('test_result_events', models.BooleanField(default=True, help_text=b'Send the test-result events')),
+                ('active', models.BooleanField(default=True)),
+                ('project', models.ForeignKey(to='patchwork.Project')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WebhookDelivery',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('event', models.CharField(max_length=20)),
+                ('event_time', models.DateTimeField(default=datetime.datetime.now)),
+                ('payload', jsonfield.fields.JSONField()),
+                ('state', models.SmallIntegerField(default=0, choices=[(0, b'pending'), (1, b'delivered'), (2, b'failed')])),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=datetime.datetime.now)),
+                ('delivered', models.DateTimeField(null=True, blank=True)),
+                ('last_status', models.IntegerField(null=True, blank=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('webhook', models.ForeignKey(to='patchwork.Webhook')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='webhookdelivery',
+            index_together=set([('state', 'next_attempt')]),
+        ),
+    ]
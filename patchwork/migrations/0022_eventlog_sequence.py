@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def number_events(apps, schema_editor):
+    EventLog = apps.get_model('patchwork', 'EventLog')
+    ProjectCounters = apps.get_model('patchwork', 'ProjectCounters')
+
+    last_event = {}
+    events = EventLog.objects.order_by('id').values_list('id', 'project')
+    for (event_id, project_id) in events.iterator():
+        last_event[project_id] = last_event.get(project_id, 0) + 1
+        EventLog.objects.filter(id=event_id) \
+                        .update(sequence=last_event[project_id])
+
+    for (project_id, sequence) in last_event.iteritems():
+        ProjectCounters.objects.filter(project_id=project_id) \
+                               .update(last_event=sequence)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0021_webhooks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventlog',
+            name='sequence',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='projectcounters',
+            name='last_event',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(number_events, migrations.RunPython.noop),
+    ]
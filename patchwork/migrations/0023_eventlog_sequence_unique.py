@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# separate from 0022, PostgreSQL can't alter a table with pending updates in
+# the same transaction
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0022_eventlog_sequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eventlog',
+            name='sequence',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='eventlog',
+            unique_together=set([('project', 'sequence')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='eventlog',
+            index_together=set([]),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def lines_to_offsets(apps, schema_editor):
+    Patch = apps.get_model('patchwork', 'Patch')
+    PatchFile = apps.get_model('patchwork', 'PatchFile')
+
+    ids = PatchFile.objects.order_by('patch').values_list('patch', flat=True) \
+                           .distinct()
+    for patch_id in ids.iterator():
+        content = Patch.objects.filter(id=patch_id) \
+                               .values_list('content', flat=True)[0] or ''
+        # character offset of each line of the content
+        offsets = [0]
+        for line in content.split('\n'):
+            offsets.append(offsets[-1] + len(line) + 1)
+        for f in PatchFile.objects.filter(patch_id=patch_id):
+            PatchFile.objects.filter(id=f.id).update(
+                start=offsets[min(f.start, len(offsets) - 1)],
+                end=offsets[min(f.end, len(offsets) - 1)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0023_eventlog_sequence_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(lines_to_offsets, migrations.RunPython.noop),
+    ]
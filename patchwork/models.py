@@ -18,21 +18,28 @@
 # along with Patchwork; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, F, Count, Sum, Max
+from django.db.models.functions import Substr
 import django.dispatch
 from django.contrib import auth
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
 from django.contrib.sites.models import Site
 from django.conf import settings
 from django.utils.functional import cached_property
-from patchwork.parser import hash_patch, extract_tags
+from patchwork import search
+from patchwork.parser import hash_patch, extract_tags, parse_diff, \
+                             probe_tag_pattern, TagMatcher
 import jsonfield
 
 import re
+import contextlib
 import datetime, time
 import random
+import threading
 from collections import Counter, OrderedDict
 
 class Person(models.Model):
@@ -60,6 +67,25 @@ class Person(models.Model):
         self.name = user.profile.name()
         self.user = user
 
+    # (name, email) in the cached mboxes of the patches of this person, None
+    # if unknown
+    _mbox_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        person = super(Person, cls).from_db(db, field_names, values)
+        if 'name' in field_names and 'email' in field_names:
+            person._mbox_values = (person.name, person.email)
+        return person
+
+    def save(self, *args, **kwargs):
+        super(Person, self).save(*args, **kwargs)
+        mbox_values = (self.name, self.email)
+        if self._mbox_values and self._mbox_values != mbox_values:
+            Patch.objects.filter(submitter=self) \
+                 .update(mbox_generation=F('mbox_generation') + 1)
+        self._mbox_values = mbox_values
+
     class Meta:
         verbose_name_plural = 'People'
 
@@ -96,6 +122,79 @@ class Project(models.Model):
         tags = [tag for tag in tags if tag]
         return tags
 
+    def get_counters(self):
+        try:
+            return self.counters
+        except ProjectCounters.DoesNotExist:
+            self.counters = ProjectCounters.recount(self.id)
+            return self.counters
+
+    # number of hashes looked up per query, well below the SQLite limit on
+    # the number of query parameters
+    UPDATE_COMMITS_CHUNK = 500
+
+    def update_commits(self, records):
+        """Update the patches of this project that have been committed.
+
+           'records' is a list of dicts with a 'hash' key, the patchwork hash
+           of a commit, and optional 'commit_ref' and 'state' (name or id of
+           a State) keys to set on the patches with that hash.
+
+           Returns a (matched, unmatched) tuple of lists of records. Matched
+           records have a 'patches' key with the ids of the updated patches.
+           ValueError is raised on invalid records, before any change is
+           made."""
+        states = list(State.objects.all())
+        states_by_name = dict((s.name.lower(), s) for s in states)
+        states_by_id = dict((s.id, s) for s in states)
+
+        updates = OrderedDict()
+        for record in records:
+            if not isinstance(record, dict) or not record.get('hash'):
+                raise ValueError("Invalid commit record: %r" % (record, ))
+            record = dict((k, v) for (k, v) in record.iteritems()
+                          if k in ('hash', 'commit_ref', 'state') and
+                          v is not None)
+            record['hash'] = unicode(record['hash']).strip().lower()
+
+            state = record.get('state')
+            if state is not None:
+                try:
+                    state = states_by_id[int(state)]
+                except (KeyError, ValueError):
+                    state = states_by_name.get(unicode(state).lower())
+                if state is None:
+                    raise ValueError("Unknown state: %s" % record['state'])
+            updates[record['hash']] = (record, state)
+
+        patches = {}
+        hashes = updates.keys()
+        for i in range(0, len(hashes), self.UPDATE_COMMITS_CHUNK):
+            chunk = hashes[i:i + self.UPDATE_COMMITS_CHUNK]
+            for patch in Patch.objects.filter(project=self, hash__in=chunk) \
+                                      .order_by('id'):
+                patches.setdefault(patch.hash, []).append(patch)
+
+        matched = []
+        unmatched = []
+        with transaction.atomic():
+            for (hash, (record, state)) in updates.iteritems():
+                if hash not in patches:
+                    unmatched.append(record)
+                    continue
+
+                for patch in patches[hash]:
+                    # share the instances we already have, saving queries
+                    patch.project = self
+                    patch.state = state or states_by_id.get(patch.state_id)
+                    if 'commit_ref' in record:
+                        patch.commit_ref = record['commit_ref']
+                    patch.save()
+                record['patches'] = [p.id for p in patches[hash]]
+                matched.append(record)
+
+        return (matched, unmatched)
+
     class Meta:
         ordering = ['linkname']
 
@@ -133,7 +232,7 @@ class UserProfile(models.Model):
         pass
 
     def n_todo_patches(self):
-        return self.todo_patches().count()
+        return self.user.todo_counters.aggregate(n=Sum('count'))['n'] or 0
 
     def todo_patches(self, project = None):
 
@@ -170,6 +269,25 @@ class State(models.Model):
     def __unicode__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        old = None
+        if self.pk is not None:
+            old = State.objects.filter(pk=self.pk) \
+                               .values_list('action_required', flat=True) \
+                               .first()
+        super(State, self).save(*args, **kwargs)
+
+        # the patches in this state enter or leave the todo lists
+        if old is not None and old != self.action_required:
+            delta = 1 if self.action_required else -1
+            patches = Patch.objects.filter(state=self, archived=False,
+                                           delegate__isnull=False) \
+                                   .order_by() \
+                                   .values_list('delegate', 'project') \
+                                   .annotate(n=Count('id'))
+            for (user_id, project_id, n) in patches:
+                TodoCounter.add(user_id, project_id, delta * n)
+
     class Meta:
         ordering = ['ordering']
 
@@ -200,6 +318,12 @@ class HashField(models.CharField):
     def db_type(self, connection=None):
         return 'char(%d)' % self.n_bytes
 
+# number of tags whose counts are stored in the patch table, see Tag.slot
+TAG_SLOTS = 8
+
+def tag_count_field(slot):
+    return 'tag_count_%d' % slot
+
 class Tag(models.Model):
     name = models.CharField(max_length=20)
     pattern = models.CharField(max_length=50,
@@ -209,10 +333,44 @@ class Tag(models.Model):
     abbrev = models.CharField(max_length=2, unique=True,
                 help_text='Short (one-or-two letter) abbreviation for the tag, '
                     'used in table column headers')
+    # the Patch.tag_count_<slot> column holding the counts of this tag,
+    # None when all the slots are taken
+    slot = models.PositiveSmallIntegerField(null=True, blank=True,
+                                            unique=True, editable=False)
 
     def __unicode__(self):
         return self.name
 
+    def clean(self):
+        try:
+            fast = probe_tag_pattern(self.pattern)
+        except re.error as e:
+            raise ValidationError({'pattern': 'Invalid regex: %s' % e})
+        if not fast:
+            raise ValidationError({'pattern': 'This regex is too slow to '
+                                   'match, it would never be used'})
+
+        # the patterns of all the tags are matched with a single regex
+        others = list(Tag.objects.exclude(pk=self.pk)
+                                 .values_list('pattern', flat=True))
+        error = TagMatcher(others + [self.pattern]).combine_error
+        if error and not TagMatcher(others).combine_error:
+            raise ValidationError({'pattern': 'This regex can\'t be combined '
+                                   'with the ones of the other tags (%s), use '
+                                   'non-capturing groups' % error})
+
+    def save(self, *args, **kwargs):
+        if self.slot is None:
+            used = set(Tag.objects.exclude(slot=None)
+                                  .values_list('slot', flat=True))
+            free = [slot for slot in range(TAG_SLOTS) if slot not in used]
+            if free:
+                # the column may still have the counts of a deleted tag
+                self.slot = free[0]
+                field = tag_count_field(self.slot)
+                Patch.objects.exclude(**{field: 0}).update(**{field: 0})
+        super(Tag, self).save(*args, **kwargs)
+
     @property
     def attr_name(self):
         return 'tag_%d_count' % self.id
@@ -245,6 +403,10 @@ class PatchQuerySet(models.query.QuerySet):
         select = OrderedDict()
         select_params = []
         for tag in project.tags:
+            if tag.slot is not None:
+                select[tag.attr_name] = 'patchwork_patch.' + \
+                                        tag_count_field(tag.slot)
+                continue
             select[tag.attr_name] = ("coalesce("
                 "(SELECT count FROM patchwork_patchtag "
                 "WHERE patchwork_patchtag.patch_id=patchwork_patch.id "
@@ -253,6 +415,9 @@ class PatchQuerySet(models.query.QuerySet):
 
         return qs.extra(select=select, select_params=select_params)
 
+    def touching(self, path):
+        return self.filter(id__in=PatchFile.patches_touching(path))
+
 class PatchManager(models.Manager):
     use_for_related_fields = True
 
@@ -262,6 +427,9 @@ class PatchManager(models.Manager):
     def with_tag_counts(self, project):
         return self.get_queryset().with_tag_counts(project)
 
+    def touching(self, path):
+        return self.get_queryset().touching(path)
+
 def filename(name, ext):
     fname_re = re.compile('[^-_A-Za-z0-9\.]+')
     str = fname_re.sub('-', name)
@@ -280,9 +448,32 @@ class Patch(models.Model):
     content = models.TextField(null = True, blank = True)
     pull_url = models.CharField(max_length=255, null = True, blank = True)
     commit_ref = models.CharField(max_length=255, null = True, blank = True)
-    hash = HashField(null = True, blank = True)
+    hash = HashField(null=True, blank=True, db_index=True)
     tags = models.ManyToManyField(Tag, through=PatchTag)
 
+    # diffstat, NULL if not computed yet. The details of each file are in
+    # PatchFile.
+    n_files = models.IntegerField(null=True, blank=True)
+    n_insertions = models.IntegerField(null=True, blank=True)
+    n_deletions = models.IntegerField(null=True, blank=True)
+
+    # counts of the tags with a slot, duplicating PatchTag so lists don't
+    # need to look at the PatchTag table. They are only written by the tag
+    # update methods below and never by save().
+    tag_count_0 = models.IntegerField(default=0, db_index=True)
+    tag_count_1 = models.IntegerField(default=0, db_index=True)
+    tag_count_2 = models.IntegerField(default=0, db_index=True)
+    tag_count_3 = models.IntegerField(default=0, db_index=True)
+    tag_count_4 = models.IntegerField(default=0, db_index=True)
+    tag_count_5 = models.IntegerField(default=0, db_index=True)
+    tag_count_6 = models.IntegerField(default=0, db_index=True)
+    tag_count_7 = models.IntegerField(default=0, db_index=True)
+
+    # incremented when the mbox of the patch changes, to not use the cached
+    # mbox of the previous generation. Like the tag counts, it's only
+    # written by bump_mbox_generations().
+    mbox_generation = models.IntegerField(default=0)
+
     objects = PatchManager()
 
     def __unicode__(self):
@@ -310,14 +501,85 @@ class Patch(models.Model):
             patchtag.count = count
             patchtag.save()
 
+    def update_tag_counts(self, added=None, removed=None):
+        """Update the tag counts with the tags of a comment 'added' to the
+           patch and/or of one 'removed' from it, without looking at the
+           other comments of the patch. Use refresh_tag_counts() to recount
+           everything."""
+        if added == removed:
+            return
+
+        tags = self.project.tags
+        counter = Counter()
+        if added:
+            counter.update(extract_tags(added, tags))
+        if removed:
+            counter.subtract(extract_tags(removed, tags))
+
+        columns = {}
+        for (tag, delta) in counter.iteritems():
+            if not delta:
+                continue
+            self._add_tag(tag, delta)
+            if tag.slot is not None:
+                field = tag_count_field(tag.slot)
+                columns[field] = F(field) + delta
+                setattr(self, field, getattr(self, field) + delta)
+
+        if columns:
+            Patch.objects.filter(pk=self.pk).update(**columns)
+
+    def _add_tag(self, tag, delta):
+        patchtags = PatchTag.objects.filter(patch=self, tag=tag)
+        if not patchtags.update(count=F('count') + delta) and delta > 0:
+            PatchTag.objects.create(patch=self, tag=tag, count=delta)
+        elif delta < 0:
+            patchtags.filter(count__lte=0).delete()
+
     def refresh_tag_counts(self):
         tags = self.project.tags
         counter = Counter()
         for comment in self.comment_set.all():
             counter = counter + extract_tags(comment.content, tags)
 
+        columns = {}
         for tag in tags:
             self._set_tag(tag, counter[tag])
+            if tag.slot is not None:
+                columns[tag_count_field(tag.slot)] = counter[tag]
+
+        if columns:
+            Patch.objects.filter(pk=self.pk).update(**columns)
+            for (field, count) in columns.iteritems():
+                setattr(self, field, count)
+
+    # (project id, archived, state id, delegate id) currently accounted for
+    # in the project and todo list counters, None if unknown
+    _counted = None
+    # name currently in the search index, None if unknown
+    _indexed_name = None
+    _counted_fields = ('project_id', 'archived', 'state_id', 'delegate_id')
+    # values of the fields in the cached mbox of the patch, None if unknown
+    _mbox_values = None
+    _mbox_fields = ('msgid', 'name', 'date', 'headers', 'content',
+                    'submitter_id')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        patch = super(Patch, cls).from_db(db, field_names, values)
+        if all(f in field_names for f in cls._counted_fields):
+            patch._counted = patch._counter_values()
+        if 'name' in field_names:
+            patch._indexed_name = patch.name
+        if all(f in field_names for f in cls._mbox_fields):
+            patch._mbox_values = patch._get_mbox_values()
+        return patch
+
+    def _counter_values(self):
+        return tuple(getattr(self, f) for f in self._counted_fields)
+
+    def _get_mbox_values(self):
+        return tuple(getattr(self, f) for f in self._mbox_fields)
 
     def save(self):
         if not hasattr(self, 'state') or not self.state:
@@ -326,7 +588,61 @@ class Patch(models.Model):
         if self.hash is None and self.content is not None:
             self.hash = hash_patch(self.content).hexdigest()
 
-        super(Patch, self).save()
+        files = None
+        if self.n_files is None and self.content is not None:
+            files = parse_diff(self.content)
+            self.n_files = len(files)
+            self.n_insertions = sum([f.insertions for f in files])
+            self.n_deletions = sum([f.deletions for f in files])
+
+        counted = self._counted
+        if counted is None and self.pk is not None:
+            counted = Patch.objects.filter(pk=self.pk) \
+                                   .values_list(*self._counted_fields) \
+                                   .first()
+
+        if self._state.adding:
+            super(Patch, self).save()
+        else:
+            # don't overwrite the tag counts and mbox generation with
+            # possibly stale values
+            deferred = self.get_deferred_fields()
+            super(Patch, self).save(update_fields=[f.attname for f in
+                    self._meta.concrete_fields if not f.primary_key and
+                    f.attname not in deferred and
+                    not f.attname.startswith('tag_count_') and
+                    f.attname != 'mbox_generation'])
+            if self._mbox_values is None or \
+               self._mbox_values != self._get_mbox_values():
+                bump_mbox_generations([self.pk])
+        self._mbox_values = self._get_mbox_values()
+
+        if files is not None:
+            self._save_files(files)
+
+        self._counted = self._counter_values()
+        update_patch_counters(counted, self._counted)
+
+        if self.name != self._indexed_name:
+            index_patches([self.id])
+            self._indexed_name = self.name
+
+    def delete(self, *args, **kwargs):
+        counted = self._counted or self._counter_values()
+        pk = self.pk
+        super(Patch, self).delete(*args, **kwargs)
+        update_patch_counters(counted, None)
+        search.remove_documents([pk])
+        self._counted = None
+
+    def _save_files(self, files):
+        self.patchfile_set.all().delete()
+        PatchFile.objects.bulk_create([PatchFile(patch=self,
+                path=f.path[:PatchFile.PATH_MAX_LENGTH],
+                old_path=(f.old_path or '')[:PatchFile.PATH_MAX_LENGTH],
+                start=f.start_offset, end=f.end_offset,
+                insertions=f.insertions,
+                deletions=f.deletions, hunks=f.hunks) for f in files])
 
     def is_editable(self, user):
         if not user.is_authenticated():
@@ -349,6 +665,45 @@ class Patch(models.Model):
         ordering = ['date']
         unique_together = [('msgid', 'project')]
 
+# A file modified by a patch. 'start' and 'end' are character offsets in the
+# patch content, see parser.DiffFile.
+class PatchFile(models.Model):
+    PATH_MAX_LENGTH = 255
+
+    patch = models.ForeignKey(Patch)
+    path = models.CharField(max_length=PATH_MAX_LENGTH, db_index=True)
+    old_path = models.CharField(max_length=PATH_MAX_LENGTH, blank=True,
+                                db_index=True)
+    start = models.IntegerField()
+    end = models.IntegerField()
+    insertions = models.IntegerField(default=0)
+    deletions = models.IntegerField(default=0)
+    hunks = jsonfield.JSONField(default=[])
+
+    class Meta:
+        ordering = ['start']
+
+    def diff(self):
+        """The part of the patch content modifying this file, the rest of the
+           content isn't read from the database"""
+        diff = Patch.objects.filter(pk=self.patch_id) \
+                            .annotate(diff=Substr('content', self.start + 1,
+                                                  self.end - self.start)) \
+                            .values_list('diff', flat=True).first() or ''
+        if not diff.endswith('\n'):
+            diff += '\n'
+        return diff
+
+    @staticmethod
+    def patches_touching(path):
+        """A subquery selecting the ids of the patches modifying files
+           starting with 'path'. A trailing '*' is ignored, so 'drivers/*'
+           and 'drivers/' are the same thing."""
+        path = path.rstrip('*')
+        return PatchFile.objects.filter(Q(path__startswith=path) |
+                                        Q(old_path__startswith=path)) \
+                                .values('patch_id')
+
 class Comment(models.Model):
     patch = models.ForeignKey(Patch)
     msgid = models.CharField(max_length=255)
@@ -365,13 +720,57 @@ class Comment(models.Model):
         return ''.join([ match.group(0) + '\n' for match in
                                 self.response_re.finditer(self.content)])
 
+    # (patch id, content) currently accounted for in the tag counts of the
+    # patch, None if unknown
+    _counted = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        comment = super(Comment, cls).from_db(db, field_names, values)
+        if 'patch_id' in field_names and 'content' in field_names:
+            comment._counted = (comment.patch_id, comment.content)
+        return comment
+
     def save(self, *args, **kwargs):
+        adding = self._state.adding
+        counted = self._counted
         super(Comment, self).save(*args, **kwargs)
-        self.patch.refresh_tag_counts()
+
+        # only apply the difference made by this comment to the tag counts,
+        # recounting all the comments of the patch if we don't know it
+        if adding:
+            self.patch.update_tag_counts(added=self.content)
+        elif counted and counted[0] == self.patch_id:
+            self.patch.update_tag_counts(added=self.content,
+                                         removed=counted[1])
+        else:
+            if counted:
+                Patch.objects.get(pk=counted[0]).refresh_tag_counts()
+            self.patch.refresh_tag_counts()
+
+        if not counted or counted[0] == self.patch_id:
+            patch_ids = [self.patch_id]
+        else:
+            patch_ids = [counted[0], self.patch_id]
+        # a new comment only adds its text to the search document
+        if adding:
+            index_new_comment(self)
+        else:
+            index_patches(patch_ids)
+        bump_mbox_generations(patch_ids)
+        self._counted = (self.patch_id, self.content)
 
     def delete(self, *args, **kwargs):
+        counted = self._counted
         super(Comment, self).delete(*args, **kwargs)
-        self.patch.refresh_tag_counts()
+
+        if counted and counted[0] == self.patch_id:
+            self.patch.update_tag_counts(removed=counted[1])
+        else:
+            self.patch.refresh_tag_counts()
+        index_patches([self.patch_id])
+        bump_mbox_generations([self.patch_id])
+        self._counted = None
 
     class Meta:
         ordering = ['date']
@@ -459,6 +858,16 @@ class Series(models.Model):
     def __unicode__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super(Series, self).save(*args, **kwargs)
+        if adding:
+            ProjectCounters.add(self.project_id, n_series=1)
+
+    def delete(self, *args, **kwargs):
+        super(Series, self).delete(*args, **kwargs)
+        ProjectCounters.add(self.project_id, n_series=-1)
+
     def revisions(self):
         return SeriesRevision.objects.filter(series=self)
 
@@ -503,6 +912,22 @@ class SeriesRevision(models.Model):
         unique_together = [('series', 'version')]
         ordering = ['version']
 
+    # cover letter currently in the search index, None if unknown
+    _indexed_cover_letter = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        revision = super(SeriesRevision, cls).from_db(db, field_names, values)
+        if 'cover_letter' in field_names:
+            revision._indexed_cover_letter = revision.cover_letter
+        return revision
+
+    def save(self, *args, **kwargs):
+        super(SeriesRevision, self).save(*args, **kwargs)
+        if self.cover_letter != self._indexed_cover_letter:
+            index_patches(self.patches.values_list('id', flat=True))
+            self._indexed_cover_letter = self.cover_letter
+
     def ordered_patches(self):
         return self.patches.order_by('seriesrevisionpatch__order')
 
@@ -515,6 +940,8 @@ class SeriesRevision(models.Model):
         sp = SeriesRevisionPatch.objects.create(revision=self, patch=patch,
                                                 order=order)
         sp.save()
+        if self.cover_letter:
+            index_patches([patch.id])
 
         revision_complete = self.patches.count() == self.series.n_patches
         if revision_complete:
@@ -559,18 +986,332 @@ class SeriesRevisionPatch(models.Model):
         unique_together = [('revision', 'patch'), ('revision', 'order')]
         ordering = ['order']
 
+# Number of patches and series of a project, maintained as patches and series
+# are created, archived or deleted so the project page doesn't have to count
+# them. The 'updatecounters' command checks them against the actual counts.
+class ProjectCounters(models.Model):
+    project = models.OneToOneField(Project, primary_key=True,
+                                   related_name='counters')
+    n_patches = models.IntegerField(default=0)
+    n_archived_patches = models.IntegerField(default=0)
+    n_series = models.IntegerField(default=0)
+    # sequence number of the latest event logged for the project
+    last_event = models.IntegerField(default=0)
+
+    @classmethod
+    def compute(cls, projects=None):
+        """Count the patches and series of 'projects' (a queryset, all the
+           projects by default) from scratch, as a {project id: {field:
+           count}} dict"""
+        if projects is None:
+            projects = Project.objects.all()
+        counts = dict((pk, {'n_patches': 0, 'n_archived_patches': 0,
+                            'n_series': 0})
+                      for pk in projects.values_list('id', flat=True))
+
+        patches = Patch.objects.filter(project__in=projects).order_by() \
+                               .values_list('project', 'archived') \
+                               .annotate(n=Count('id'))
+        for (pk, archived, n) in patches:
+            field = 'n_archived_patches' if archived else 'n_patches'
+            counts[pk][field] = n
+
+        series = Series.objects.filter(project__in=projects).order_by() \
+                               .values_list('project') \
+                               .annotate(n=Count('id'))
+        for (pk, n) in series:
+            counts[pk]['n_series'] = n
+
+        return counts
+
+    @classmethod
+    def recount(cls, project_id):
+        counts = cls.compute(Project.objects.filter(pk=project_id))
+        counts[project_id]['last_event'] = \
+            EventLog.objects.filter(project_id=project_id) \
+                            .aggregate(Max('sequence'))['sequence__max'] or 0
+        (counters, created) = cls.objects.update_or_create(
+                project_id=project_id, defaults=counts[project_id])
+        return counters
+
+    @classmethod
+    def next_event(cls, project_id):
+        """Allocate the sequence number of a new event of the project. The
+           counters of the project stay locked until the end of the
+           transaction, so events are committed in the order of their
+           sequence numbers."""
+        counters = cls.objects.filter(project_id=project_id)
+        if not counters.update(last_event=F('last_event') + 1):
+            cls.recount(project_id)
+            counters.update(last_event=F('last_event') + 1)
+        return counters.values_list('last_event', flat=True)[0]
+
+    @classmethod
+    def add(cls, project_id, **deltas):
+        deltas = dict((f, d) for (f, d) in deltas.iteritems() if d)
+        if not deltas:
+            return
+        if not cls.objects.filter(project_id=project_id).update(
+                **dict((f, F(f) + d) for (f, d) in deltas.iteritems())):
+            # the change being counted is already in the database
+            cls.recount(project_id)
+
+# Number of patches in the todo list of a user for a project, see
+# UserProfile.todo_patches()
+class TodoCounter(models.Model):
+    user = models.ForeignKey(User, related_name='todo_counters')
+    project = models.ForeignKey(Project)
+    count = models.IntegerField(default=0)
+
+    @classmethod
+    def compute(cls, projects=None):
+        """Count the patches of the todo lists for 'projects' from scratch,
+           as a {(user id, project id): count} dict"""
+        patches = Patch.objects.filter(archived=False, delegate__isnull=False,
+                                       state__action_required=True)
+        if projects is not None:
+            patches = patches.filter(project__in=projects)
+        patches = patches.order_by().values_list('delegate', 'project') \
+                         .annotate(n=Count('id'))
+        return dict(((user_id, project_id), n)
+                    for (user_id, project_id, n) in patches)
+
+    @classmethod
+    def add(cls, user_id, project_id, delta):
+        if not delta:
+            return
+        counters = cls.objects.filter(user_id=user_id, project_id=project_id)
+        if counters.update(count=F('count') + delta):
+            return
+
+        # the change being counted is already in the database
+        count = User.objects.get(pk=user_id).profile \
+                    .todo_patches(project=project_id).count()
+        try:
+            with transaction.atomic():
+                cls.objects.create(user_id=user_id, project_id=project_id,
+                                   count=count)
+        except IntegrityError:
+            # created in the meantime, with this patch counted or not
+            counters.update(count=count)
+
+    class Meta:
+        unique_together = [('user', 'project')]
+
+def update_patch_counters(old, new):
+    """Update the project and todo list counters for a patch going from
+       'old' to 'new', (project id, archived, state id, delegate id) tuples
+       or None when the patch doesn't exist"""
+    if old == new:
+        return
+
+    action_required = None
+    if (old and old[3]) or (new and new[3]):
+        action_required = set(State.objects.filter(action_required=True)
+                                           .values_list('id', flat=True))
+
+    projects = {}
+    todo_lists = Counter()
+    for (values, delta) in ((old, -1), (new, 1)):
+        if values is None:
+            continue
+        (project_id, archived, state_id, delegate_id) = values
+        field = 'n_archived_patches' if archived else 'n_patches'
+        deltas = projects.setdefault(project_id, Counter())
+        deltas[field] += delta
+        if delegate_id and not archived and state_id in action_required:
+            todo_lists[(delegate_id, project_id)] += delta
+
+    for (project_id, deltas) in projects.iteritems():
+        ProjectCounters.add(project_id, **deltas)
+    for ((user_id, project_id), delta) in todo_lists.iteritems():
+        TodoCounter.add(user_id, project_id, delta)
+
+def patch_search_documents(ids):
+    """The search documents of the patches with these ids, see
+       search.write_documents()"""
+    messages = {}
+    comments = dict((pk, []) for pk in ids)
+    cover_letters = dict((pk, []) for pk in ids)
+
+    patches = Patch.objects.filter(id__in=ids) \
+                           .values_list('id', 'project', 'name', 'msgid')
+    msgids = dict((pk, msgid) for (pk, _, _, msgid) in patches)
+
+    # the comment with the same msgid as the patch is its commit message
+    for (pk, msgid, content) in Comment.objects.filter(patch__in=ids) \
+                                  .values_list('patch', 'msgid', 'content'):
+        if msgid == msgids.get(pk):
+            messages[pk] = content
+        else:
+            comments[pk].append(content)
+
+    for (pk, content) in SeriesRevisionPatch.objects \
+                             .filter(patch__in=ids,
+                                     revision__cover_letter__isnull=False) \
+                             .values_list('patch', 'revision__cover_letter'):
+        if content not in cover_letters[pk]:
+            cover_letters[pk].append(content)
+
+    return [(pk, project_id, name, messages.get(pk, ''),
+             '\n'.join(comments[pk]), '\n'.join(cover_letters[pk]))
+            for (pk, project_id, name, _) in patches]
+
+def bump_mbox_generations(ids):
+    """Increment the mbox generation of the patches with these ids,
+       invalidating their cached mboxes"""
+    Patch.objects.filter(pk__in=ids) \
+                 .update(mbox_generation=F('mbox_generation') + 1)
+
+# Work left to the end of the current deferred_updates() block of the
+# thread: the 'ids' of the patches to index and, in 'events', the sequence
+# number of the latest event of each project. None outside of such a block.
+_deferred = threading.local()
+
+@contextlib.contextmanager
+def deferred_updates():
+    """Index the patches changed in the block once, when it ends, instead
+       of each time one of their mails is saved, and only then publish the
+       new events to the clients waiting for them. Put around the
+       transaction ingesting a mail, as nothing is done when the block ends
+       with an exception. Requests are run in such a block by
+       DeferredUpdatesMiddleware."""
+    if getattr(_deferred, 'ids', None) is not None:
+        yield
+        return
+    _deferred.ids = set()
+    _deferred.events = {}
+    try:
+        yield
+        ids = _deferred.ids
+        events = _deferred.events
+    finally:
+        _deferred.ids = None
+        _deferred.events = None
+    index_patches(ids)
+    for (project_id, sequence) in events.iteritems():
+        publish_event(project_id, sequence)
+
+def index_patches(ids):
+    """Update the search documents of the patches with these ids"""
+    ids = list(ids)
+    pending = getattr(_deferred, 'ids', None)
+    if pending is not None:
+        pending.update(ids)
+    elif ids and search.get_backend() is not None:
+        search.write_documents(patch_search_documents(ids))
+
+def index_new_comment(comment):
+    """Add the text of a new comment to the search document of its patch,
+       without reading the other mails of the patch"""
+    pending = getattr(_deferred, 'ids', None)
+    if pending is not None and comment.patch_id in pending:
+        return
+    if comment.msgid == comment.patch.msgid:
+        field = 'message'
+    else:
+        field = 'comments'
+    search.append_document(comment.patch_id, field, comment.content)
+
+# Index of the mails received for a project, used to navigate mail threads
+# without having to parse the headers of each message up to the thread root.
+# 'references' is the list of ancestors of the mail, from the parent to the
+# root of the thread. A message can be a patch, a comment, both (the
+# description of a patch), a cover letter or none of those.
+class Message(models.Model):
+    project = models.ForeignKey(Project)
+    msgid = models.CharField(max_length=255)
+    parent_msgid = models.CharField(max_length=255, null=True, blank=True)
+    root_msgid = models.CharField(max_length=255, db_index=True)
+    references = models.TextField(blank=True)
+    patch = models.ForeignKey(Patch, null=True, blank=True,
+                              on_delete=models.SET_NULL)
+    comment = models.ForeignKey(Comment, null=True, blank=True,
+                                on_delete=models.SET_NULL)
+    revision = models.ForeignKey(SeriesRevision, null=True, blank=True,
+                                 on_delete=models.SET_NULL)
+
+    class Meta:
+        unique_together = [('project', 'msgid')]
+
+    def references_list(self):
+        return self.references.split()
+
 class Event(models.Model):
     name = models.CharField(max_length=20)
 
+# The id of an event is the cursor of the event stream of its project:
+# events are read in the order they are logged with the (project, id) index,
+# without joining the series.
 class EventLog(models.Model):
     event = models.ForeignKey(Event)
     event_time = models.DateTimeField(auto_now=True)
+    project = models.ForeignKey(Project)
+    # Numbers the events of the project in the order they are committed,
+    # unlike ids which concurrent transactions can commit out of order
+    sequence = models.IntegerField()
     series = models.ForeignKey(Series)
     user = models.ForeignKey(User, null=True)
     parameters = jsonfield.JSONField(null=True)
 
+    def save(self, *args, **kwargs):
+        if self.project_id is None:
+            self.project_id = self.series.project_id
+        with transaction.atomic():
+            if self.sequence is None:
+                self.sequence = ProjectCounters.next_event(self.project_id)
+            super(EventLog, self).save(*args, **kwargs)
+
+        events = getattr(_deferred, 'events', None)
+        if events is None:
+            publish_event(self.project_id, self.sequence)
+        elif self.sequence > events.get(self.project_id, 0):
+            events[self.project_id] = self.sequence
+
     class Meta:
         ordering = ['-event_time']
+        unique_together = [('project', 'sequence')]
+
+# Long polling clients wait for new events by polling the sequence number of
+# the latest event of the project in the cache, not the database. The cache
+# has to be shared between the processes logging events and the web server.
+_EVENT_POLL_INTERVAL = 0.1
+
+def _latest_event_key(project_id):
+    return 'latest-event-%d' % project_id
+
+def publish_event(project_id, sequence):
+    """Wake up the clients waiting for the events of the project up to
+       'sequence'. Only to be done once the event is committed, see
+       deferred_updates()."""
+    key = _latest_event_key(project_id)
+    # the latest sequence number only ever increases: a process publishing
+    # its events after another one mustn't hide the newer events, set it
+    # again if a concurrent publisher lowered it in between
+    while not cache.add(key, sequence, None):
+        latest = cache.get(key)
+        if latest is not None and latest >= sequence:
+            return
+        cache.set(key, sequence, None)
+
+def wait_for_events(project_id, after, timeout):
+    """Wait up to 'timeout' seconds for an event to be logged in the project
+       after the event with the sequence number 'after'. Returns the sequence
+       number of the latest event, the events still have to be read from the
+       database afterwards."""
+    key = _latest_event_key(project_id)
+    latest = cache.get(key)
+    if latest is None:
+        latest = EventLog.objects.filter(project_id=project_id) \
+                                 .aggregate(Max('sequence'))['sequence__max'] \
+                 or 0
+        cache.add(key, latest, None)
+
+    deadline = time.time() + timeout
+    while latest <= after and time.time() < deadline:
+        time.sleep(_EVENT_POLL_INTERVAL)
+        latest = cache.get(key, latest)
+    return latest
 
 class Test(models.Model):
     # no mail, default so test systems/scripts can have a grace period to
@@ -635,6 +1376,60 @@ class TestResult(models.Model):
     def __unicode__(self):
         return self.get_state_display()
 
+class Webhook(models.Model):
+    """An URL the events of a project are POSTed to, as JSON, by the
+       deliverwebhooks management command"""
+    project = models.ForeignKey(Project)
+    url = models.URLField(max_length=2000)
+    secret = models.CharField(max_length=255, blank=True,
+            help_text='Key of the HMAC-SHA256 signature of the requests, '
+                      'in their X-Patchwork-Signature header')
+    series_events = models.BooleanField(default=True,
+            help_text='Send the series-new-revision events')
+    test_result_events = models.BooleanField(default=True,
+            help_text='Send the test-result events')
+    active = models.BooleanField(default=True)
+
+    def __unicode__(self):
+        return self.url
+
+# An event to be POSTed to a webhook, kept once delivered (or given up on)
+# as a log of the deliveries until the cron command removes it.
+class WebhookDelivery(models.Model):
+    STATE_PENDING = 0
+    STATE_DELIVERED = 1
+    STATE_FAILED = 2
+    STATE_CHOICES = (
+        (STATE_PENDING, 'pending'),
+        (STATE_DELIVERED, 'delivered'),
+        (STATE_FAILED, 'failed'),
+    )
+
+    webhook = models.ForeignKey(Webhook)
+    event = models.CharField(max_length=20)
+    event_time = models.DateTimeField(default=datetime.datetime.now)
+    payload = jsonfield.JSONField()
+    state = models.SmallIntegerField(choices=STATE_CHOICES,
+                                     default=STATE_PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=datetime.datetime.now)
+    delivered = models.DateTimeField(null=True, blank=True)
+    # HTTP status or error of the last attempt
+    last_status = models.IntegerField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        index_together = [('state', 'next_attempt')]
+
+    def __unicode__(self):
+        return self.event
+
+# Rows of this table are locked (SELECT ... FOR UPDATE) while parsing a mail so
+# that mails of the same thread are parsed one at a time. Mail threads are
+# hashed into a fixed number of slots to keep the table small.
+class ThreadLock(models.Model):
+    slot = models.IntegerField(primary_key=True)
+
 class EmailConfirmation(models.Model):
     validity = datetime.timedelta(days = settings.CONFIRMATION_VALIDITY_DAYS)
     type = models.CharField(max_length = 20, choices = [
@@ -716,11 +1511,65 @@ def _patch_change_callback(sender, instance, **kwargs):
 
 models.signals.pre_save.connect(_patch_change_callback, sender = Patch)
 
+def _queue_webhook_deliveries(project_id, event, event_time, payload):
+    """Queue the delivery of an event to the webhooks of the project wanting
+       it. Only the database is used here, the HTTP requests are done by the
+       deliverwebhooks command."""
+    webhooks = Webhook.objects.filter(project_id=project_id, active=True)
+    if event == 'series-new-revision':
+        webhooks = webhooks.filter(series_events=True)
+    else:
+        webhooks = webhooks.filter(test_result_events=True)
+
+    deliveries = [WebhookDelivery(webhook_id=webhook_id, event=event,
+                                  event_time=event_time, payload=payload)
+                  for webhook_id in webhooks.values_list('id', flat=True)]
+    if deliveries:
+        WebhookDelivery.objects.bulk_create(deliveries)
+
 def _on_revision_complete(sender, revision, **kwargs):
     new_revision = Event.objects.get(name='series-new-revision')
-    log = EventLog(event=new_revision, series=revision.series,
-                   user=revision.series.submitter.user,
+    log = EventLog(event=new_revision, project_id=revision.series.project_id,
+                   series=revision.series, user=revision.series.submitter.user,
                    parameters={'revision': revision.version})
     log.save()
 
+    # the same fields as the events of the REST API
+    _queue_webhook_deliveries(log.project_id, new_revision.name,
+                              log.event_time, {
+        'id': log.id,
+        'sequence': log.sequence,
+        'name': new_revision.name,
+        'event_time': log.event_time.isoformat(),
+        'series': log.series_id,
+        'user': log.user_id,
+        'parameters': log.parameters,
+    })
+
 series_revision_complete.connect(_on_revision_complete)
+
+def _on_test_result_save(sender, instance, **kwargs):
+    result = instance
+    series_id = None
+    version = None
+    if result.revision_id is not None:
+        series_id = result.revision.series_id
+        version = result.revision.version
+
+    _queue_webhook_deliveries(result.test.project_id, 'test-result',
+                              result.date, {
+        'name': 'test-result',
+        'event_time': result.date.isoformat(),
+        'series': series_id,
+        'user': result.user_id,
+        'parameters': {
+            'revision': version,
+            'patch': result.patch_id,
+            'test_name': result.test.name,
+            'state': result.get_state_display(),
+            'url': result.url,
+            'summary': result.summary,
+        },
+    })
+
+models.signals.post_save.connect(_on_test_result_save, sender=TestResult)
@@ -18,8 +18,15 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 
+import hashlib
+import re
+
 from django.core import paginator
+from django.core.cache import cache
 from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
 
 DEFAULT_PATCHES_PER_PAGE = 100
 LONG_PAGE_THRESHOLD = 30
@@ -33,20 +40,27 @@ ADJACENT_PAGES = 1
 # parts from:
 #  http://blog.localkinegrinds.com/2007/09/06/digg-style-pagination-in-django/
 
-class Paginator(paginator.Paginator):
-    def __init__(self, request, objects):
+def get_patches_per_page(request):
+    patches_per_page = settings.DEFAULT_PATCHES_PER_PAGE
 
-        patches_per_page = settings.DEFAULT_PATCHES_PER_PAGE
+    if request.user.is_authenticated():
+        patches_per_page = request.user.profile.patches_per_page
 
-        if request.user.is_authenticated():
-            patches_per_page = request.user.profile.patches_per_page
+    n = request.META.get('ppp')
+    if n:
+        try:
+            patches_per_page = int(n)
+        except ValueError:
+            pass
+
+    return patches_per_page
 
-        n = request.META.get('ppp')
-        if n:
-            try:
-                patches_per_page = int(n)
-            except ValueError:
-                pass
+class Paginator(paginator.Paginator):
+    keyset = False
+
+    def __init__(self, request, objects):
+
+        patches_per_page = get_patches_per_page(request)
 
         super(Paginator, self).__init__(objects, patches_per_page)
 
@@ -88,3 +102,161 @@ class Paginator(paginator.Paginator):
         self.leading_set.reverse()
         self.long_page = \
                 len(self.current_page.object_list) >= LONG_PAGE_THRESHOLD
+
+_explain_rows_re = re.compile(r'rows=(\d+)')
+
+def estimate_count(objects):
+    """An estimation of the number of objects in a queryset, cached for
+       settings.PATCH_COUNT_CACHE_TIMEOUT seconds.
+
+       On PostgreSQL, this is the number of rows the planner expects, which
+       doesn't need to scan the table. Other databases do a full count."""
+    query = objects.order_by().values('pk')
+    sql, params = query.query.sql_with_params()
+    key = 'patchwork-count-' + hashlib.md5(
+        (u'%s %r' % (sql, params)).encode('utf-8')).hexdigest()
+
+    count = cache.get(key)
+    if count is not None:
+        return count
+
+    count = None
+    if connection.vendor == 'postgresql':
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN ' + sql, params)
+        match = _explain_rows_re.search(cursor.fetchone()[0])
+        if match:
+            count = int(match.group(1))
+    if count is None:
+        count = query.count()
+
+    cache.set(key, count, settings.PATCH_COUNT_CACHE_TIMEOUT)
+    return count
+
+def _parse_cursor(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class KeysetPage(object):
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous and bool(object_list)
+        self._has_next = has_next and bool(object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def previous_cursor(self):
+        return self.object_list[0].pk
+
+    def next_cursor(self):
+        return self.object_list[-1].pk
+
+class KeysetPaginator(object):
+    """Paginates through a list of patches sorted by an Order, without
+       counting them nor using OFFSET: the pages are given by the 'after' or
+       'before' request parameter, the id of the patch the page starts after
+       or ends before. This keeps deep pages of large lists as fast as the
+       first one, at the cost of not being able to jump to a page number.
+
+       count is only an estimation, see estimate_count()."""
+    keyset = True
+
+    def __init__(self, request, objects, order):
+        self.per_page = get_patches_per_page(request)
+        self.count = estimate_count(objects)
+
+        # NULLs don't sort the same way on all databases and can't be
+        # compared to, replace them by a value sorting first
+        annotations = {}
+        self.keys = []
+        for (i, (field, null_value, descending)) in enumerate(order.keys()):
+            if null_value is not None:
+                name = 'page_key_%d' % i
+                annotations[name] = Coalesce(F(field), Value(null_value))
+                field = name
+            self.keys.append((field, descending))
+        self.annotations = annotations
+        self.objects = objects.annotate(**annotations)
+
+        after = _parse_cursor(request.GET.get('after'))
+        before = _parse_cursor(request.GET.get('before'))
+
+        self.current_page = None
+        if before is not None:
+            self.current_page = self._page(before, backwards=True)
+        elif after is not None:
+            self.current_page = self._page(after)
+        if self.current_page is None:
+            self.current_page = self._page(None)
+
+        self.long_page = \
+                len(self.current_page.object_list) >= LONG_PAGE_THRESHOLD
+
+    def _ordering(self, backwards):
+        return [('-' if descending ^ backwards else '') + field
+                for (field, descending) in self.keys]
+
+    def _filter(self, values, backwards):
+        """The condition selecting the rows sorted after the row with the key
+           'values', or before it when going backwards"""
+        q = Q()
+        for (i, (field, descending)) in enumerate(self.keys):
+            lookup = 'lt' if descending ^ backwards else 'gt'
+            term = Q(**{'%s__%s' % (field, lookup): values[i]})
+            for (j, (previous, _)) in enumerate(self.keys[:i]):
+                term &= Q(**{previous: values[j]})
+            q |= term
+        return q
+
+    def _page(self, cursor, backwards=False):
+        """The page starting after the patch with id 'cursor', or ending
+           before it when going backwards. Returns None if that patch doesn't
+           exist anymore or if there's nothing before it, in which case the
+           first page should be displayed"""
+        objects = self.objects.order_by(*self._ordering(backwards))
+
+        if cursor is not None:
+            fields = [field for (field, _) in self.keys]
+            values = self.objects.model.objects \
+                         .annotate(**self.annotations) \
+                         .filter(pk=cursor).values_list(*fields)
+            if not values:
+                return None
+            objects = objects.filter(self._filter(values[0], backwards))
+
+        object_list = list(objects[:self.per_page + 1])
+        more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+
+        if not backwards:
+            return KeysetPage(object_list, self, cursor is not None, more)
+
+        if not more:
+            return None
+        object_list.reverse()
+        return KeysetPage(object_list, self, True, True)
+
+def get_paginator(request, objects, order=None):
+    """Use keyset pagination for lists sorted by an Order with more than
+       settings.KEYSET_PAGINATION_THRESHOLD patches, and the usual numbered
+       pages for the others"""
+    if order is not None:
+        threshold = settings.KEYSET_PAGINATION_THRESHOLD
+        if 'after' in request.GET or 'before' in request.GET or \
+           (threshold is not None and estimate_count(objects) > threshold):
+            return KeysetPaginator(request, objects, order)
+
+    return Paginator(request, objects)
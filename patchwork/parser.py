@@ -21,16 +21,54 @@
 
 
 import hashlib
+import logging
 import re
-from collections import Counter
+import time
+from collections import Counter, OrderedDict
 
 _hunk_re = re.compile('^\@\@ -\d+(?:,(\d+))? \+\d+(?:,(\d+))? \@\@')
+_hunk_lines_re = re.compile('^\@\@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? \@\@')
 _filename_re = re.compile('^(---|\+\+\+) (\S+)')
-
-def parse_patch(text):
-    patchbuf = ''
-    commentbuf = ''
-    buf = ''
+_git_diff_re = re.compile('^diff --git (\S+) (\S+)')
+
+LOGGER = logging.getLogger(__name__)
+
+def _text_lines(text):
+    # same lines as text.split('\n'), with their '\n', without building the
+    # list of all lines
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end < 0:
+            yield text[start:] + '\n'
+            return
+        yield text[start:end + 1]
+        start = end + 1
+
+def _file_lines(f):
+    # same as _text_lines(f.read())
+    for line in f:
+        if not line.endswith('\n'):
+            yield line + '\n'
+            return
+        yield line
+    yield '\n'
+
+def iter_patch(text):
+    """Split 'text', a string or a file-like object, into patch and comment.
+
+       This is a generator of (is_patch, chunk) tuples, yielded as soon as
+       the lines of a chunk have been classified. Concatenating the patch
+       chunks gives the patch, concatenating the comment chunks gives the
+       comment."""
+
+    if isinstance(text, basestring):
+        lines = _text_lines(text)
+    else:
+        lines = _file_lines(text)
+
+    # suspected patch header lines, see below
+    buf = []
 
     # state specified the line we just saw, and what to expect next
     state = 0
@@ -62,25 +100,31 @@ def parse_patch(text):
     lc = (0, 0)
     hunk = 0
 
+    # the content of hunks is yielded in chunks of that many lines
+    hunk_lines = []
+    max_hunk_lines = 1024
 
-    for line in text.split('\n'):
-        line += '\n'
+    for line in lines:
+        if hunk_lines and (state not in (4, 5) or
+                           len(hunk_lines) >= max_hunk_lines):
+            yield (True, ''.join(hunk_lines))
+            hunk_lines = []
 
         if state == 0:
             if line.startswith('diff ') or line.startswith('===') \
                     or line.startswith('Index: '):
                 state = 1
-                buf += line
+                buf.append(line)
 
             elif line.startswith('--- '):
                 state = 2
-                buf += line
+                buf.append(line)
 
             else:
-                commentbuf += line
+                yield (False, line)
 
         elif state == 1:
-            buf += line
+            buf.append(line)
             if line.startswith('--- '):
                 state = 2
 
@@ -90,16 +134,17 @@ def parse_patch(text):
         elif state == 2:
             if line.startswith('+++ '):
                 state = 3
-                buf += line
+                buf.append(line)
 
             elif hunk:
                 state = 1
-                buf += line
+                buf.append(line)
 
             else:
                 state = 0
-                commentbuf += buf + line
-                buf = ''
+                buf.append(line)
+                yield (False, ''.join(buf))
+                buf = []
 
         elif state == 3:
             match = _hunk_re.match(line)
@@ -113,27 +158,30 @@ def parse_patch(text):
                 lc = map(fn, match.groups())
 
                 state = 4
-                patchbuf += buf + line
-                buf = ''
+                buf.append(line)
+                yield (True, ''.join(buf))
+                buf = []
 
             elif line.startswith('--- '):
-                patchbuf += buf + line
-                buf = ''
+                buf.append(line)
+                yield (True, ''.join(buf))
+                buf = []
                 state = 2
 
             elif hunk and line.startswith('\ No newline at end of file'):
                 # If we had a hunk and now we see this, it's part of the patch,
                 # and we're still expecting another @@ line.
-                patchbuf += line
+                yield (True, line)
 
             elif hunk:
                 state = 1
-                buf += line
+                buf.append(line)
 
             else:
                 state = 0
-                commentbuf += buf + line
-                buf = ''
+                buf.append(line)
+                yield (False, ''.join(buf))
+                buf = []
 
         elif state == 4 or state == 5:
             if line.startswith('-'):
@@ -147,7 +195,7 @@ def parse_patch(text):
                 lc[0] -= 1
                 lc[1] -= 1
 
-            patchbuf += line
+            hunk_lines.append(line)
 
             if lc[0] <= 0 and lc[1] <= 0:
                 state = 3
@@ -157,31 +205,178 @@ def parse_patch(text):
 
         elif state == 6:
             if line.startswith('rename to ') or line.startswith('rename from '):
-                patchbuf += buf + line
-                buf = ''
+                buf.append(line)
+                yield (True, ''.join(buf))
+                buf = []
 
             elif line.startswith('--- '):
-                patchbuf += buf + line
-                buf = ''
+                buf.append(line)
+                yield (True, ''.join(buf))
+                buf = []
                 state = 2
 
             else:
-                buf += line
+                buf.append(line)
                 state = 1
 
         else:
             raise Exception("Unknown state %d! (line '%s')" % (state, line))
 
-    commentbuf += buf
+    if hunk_lines:
+        yield (True, ''.join(hunk_lines))
+
+    if buf:
+        yield (False, ''.join(buf))
 
-    if patchbuf == '':
-        patchbuf = None
+def parse_patch(text):
+    """Split 'text', a string or a file-like object, into a (patch, comment)
+       tuple. Either of them is None if empty."""
+    patchbuf = []
+    commentbuf = []
+
+    for (is_patch, chunk) in iter_patch(text):
+        if is_patch:
+            patchbuf.append(chunk)
+        else:
+            commentbuf.append(chunk)
 
-    if commentbuf == '':
-        commentbuf = None
+    patchbuf = ''.join(patchbuf) or None
+    commentbuf = ''.join(commentbuf) or None
 
     return (patchbuf, commentbuf)
 
+class DiffFile(object):
+    """A file modified by a patch.
+
+       'start' and 'end' are the (0-based) lines of the patch content where
+       the diff of this file starts and ends (excluded), 'start_offset' and
+       'end_offset' the same positions as character offsets. Each hunk is a
+       tuple (line, old_start, old_count, new_start, new_count), 'line' being
+       the line of the @@ header in the patch content."""
+
+    def __init__(self, start, start_offset):
+        self.old_path = None
+        self.new_path = None
+        self.start = start
+        self.end = start + 1
+        self.start_offset = start_offset
+        self.end_offset = start_offset
+        self.hunks = []
+        self.insertions = 0
+        self.deletions = 0
+
+    @property
+    def path(self):
+        if self.new_path and self.new_path != '/dev/null':
+            return self.new_path
+        return self.old_path
+
+def _strip_path(path):
+    # normalise -p1 top-directories, as hash_patch() does
+    if path == '/dev/null' or '/' not in path:
+        return path
+    return path.split('/', 1)[1]
+
+def parse_diff(content):
+    """Split the diff extracted by parse_patch() into a list of DiffFile"""
+    files = []
+    diff = None
+    # have we seen a line naming the file for the current diff?
+    seen_header = False
+    seen_old_path = False
+    # svn and cvs diffs don't have the a/ b/ prefixes
+    strip = _strip_path
+
+    # lines left in the current hunk
+    lc = [0, 0]
+
+    # character offset of the next line
+    offset = 0
+
+    for (i, line) in enumerate(content.split('\n')):
+        line_offset = offset
+        offset += len(line) + 1
+
+        # don't trust the line counts of hunks that have been edited by hand
+        if line and line[0] not in ' -+\\':
+            lc = [0, 0]
+
+        if lc[0] > 0 or lc[1] > 0:
+            if line.startswith('-'):
+                lc[0] -= 1
+                diff.deletions += 1
+            elif line.startswith('+'):
+                lc[1] -= 1
+                diff.insertions += 1
+            elif line.startswith('\\'):
+                # '\ No newline at end of file'
+                pass
+            else:
+                lc[0] -= 1
+                lc[1] -= 1
+            diff.end = i + 1
+            diff.end_offset = offset
+            continue
+
+        # the previous file is done if we see the start of another one. cvs
+        # diffs have both an 'Index:' and a 'diff' line.
+        git_header = _git_diff_re.match(line)
+        new_file = diff is None or diff.hunks or seen_old_path
+        if git_header or line.startswith('Index: '):
+            new_file = new_file or seen_header
+        elif not line.startswith('diff '):
+            new_file = new_file and line.startswith('--- ')
+
+        if new_file:
+            diff = DiffFile(i, line_offset)
+            files.append(diff)
+            seen_header = False
+            seen_old_path = False
+            strip = _strip_path
+
+        if diff is None or not line:
+            continue
+
+        diff.end = i + 1
+        diff.end_offset = offset
+
+        if line.startswith('Index: '):
+            diff.old_path = diff.new_path = line[len('Index: '):].strip()
+            seen_header = True
+            strip = lambda path: path
+            continue
+
+        if git_header:
+            diff.old_path = _strip_path(git_header.group(1))
+            diff.new_path = _strip_path(git_header.group(2))
+            seen_header = True
+            continue
+
+        match = _filename_re.match(line)
+        if match:
+            path = strip(match.group(2))
+            if match.group(1) == '---':
+                diff.old_path = path
+                seen_old_path = True
+            else:
+                diff.new_path = path
+            continue
+
+        match = _hunk_lines_re.match(line)
+        if match:
+            (old_start, old_count, new_start, new_count) = \
+                [int(x) if x is not None else 1 for x in match.groups()]
+            diff.hunks.append((i, old_start, old_count, new_start, new_count))
+            lc = [old_count, new_count]
+            continue
+
+        if line.startswith('rename from '):
+            diff.old_path = line[len('rename from '):].strip()
+        elif line.startswith('rename to '):
+            diff.new_path = line[len('rename to '):].strip()
+
+    return files
+
 def hash_patch(str):
     # normalise spaces
     str = str.replace('\r', '')
@@ -229,14 +424,226 @@ def hash_patch(str):
 
     return hash
 
-def extract_tags(content, tags):
-    counts = Counter()
-
-    for tag in tags:
-        regex = re.compile(tag.pattern, re.MULTILINE | re.IGNORECASE)
-        counts[tag] = len(regex.findall(content))
+_tag_flags = re.MULTILINE | re.IGNORECASE
+
+# patterns referring to their own groups can't be combined with others
+_backref_re = re.compile(r'\\[1-9]|\(\?P=')
+
+# matching the tags of a mail taking longer than this (in seconds) is
+# logged
+TAG_MATCH_WARNING_TIME = 1.0
+
+# how long (in seconds) a tag pattern may take to match one of the probe
+# strings of probe_tag_pattern(), and the strings themselves: a prefix, n
+# times a unit and a character unlikely to be matched
+TAG_PATTERN_PROBE_TIME = 0.05
+_probe_units = ['a', 'A', '0', ' ', '-', '.', 'a ', 'a-', 'a.', 'a@', '\t']
+_probe_lengths = range(8, 33, 2)
+
+def _literal_prefix(pattern):
+    """The literal text a pattern starts with, eg. 'Acked-by: ' for
+       '^Acked-by: \S+'"""
+    prefix = []
+    for c in pattern.lstrip('^'):
+        if c in '\\.[]{}()*+?|^$':
+            # a quantifier applies to the previous character
+            if c in '*+?{' and prefix:
+                prefix.pop()
+            break
+        prefix.append(c)
+    return ''.join(prefix)
+
+def probe_tag_pattern(pattern):
+    """Try to find out if a tag pattern can take exponential time to match,
+       eg. '^Acked-by: (\w+\s?)*$', by matching it against strings of
+       growing length. Returns False if a match took longer than
+       TAG_PATTERN_PROBE_TIME. Raises re.error if the pattern is invalid."""
+    regex = re.compile(pattern, _tag_flags)
+    prefixes = set(['', _literal_prefix(pattern)])
+    units = set(_probe_units + [c for c in pattern if c.isalnum()])
+
+    # polynomial patterns can stay under the limit for each string, so
+    # limit the total time as well
+    deadline = time.time() + 5 * TAG_PATTERN_PROBE_TIME
+
+    for prefix in prefixes:
+        for unit in units:
+            for n in _probe_lengths:
+                probe = prefix + unit * n + '\x00'
+                start = time.time()
+                for _ in regex.finditer(probe):
+                    pass
+                end = time.time()
+                if end - start > TAG_PATTERN_PROBE_TIME or end > deadline:
+                    return False
+    return True
+
+class TagMatcher(object):
+    """Count the matches of a list of tag patterns in a single scan of the
+       content, with the MULTILINE and IGNORECASE flags.
+
+       Patterns are combined in one regular expression, so text matching
+       several patterns is only counted for the first one. Patterns that
+       can't be combined, because of backreferences or group names used by
+       several patterns, are matched on their own and patterns that don't
+       compile never match. Slow patterns are rejected when tags are edited
+       (see probe_tag_pattern()), a warning is logged when matching takes
+       longer than TAG_MATCH_WARNING_TIME."""
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.n_patterns = len(patterns)
+        # {group number in self.regex: pattern index}
+        self.groups = {}
+        # [(pattern index, regex)] of patterns matched on their own
+        self.separate = []
+        # why the patterns couldn't be combined, None if they could
+        self.combine_error = None
+
+        combined = []
+        for (i, pattern) in enumerate(patterns):
+            try:
+                regex = re.compile(pattern, _tag_flags)
+            except re.error as e:
+                LOGGER.warning("Invalid tag pattern '%s': %s", pattern, e)
+                continue
+
+            if _backref_re.search(pattern):
+                self.separate.append((i, regex))
+            else:
+                combined.append((i, pattern, regex))
+
+        self.regex = None
+        parts = []
+        group = 1
+        for (i, pattern, regex) in combined:
+            self.groups[group] = i
+            parts.append('(%s)' % pattern)
+            group += 1 + regex.groups
+        if not parts:
+            return
+
+        try:
+            self.regex = re.compile('|'.join(parts), _tag_flags)
+        except (re.error, AssertionError) as e:
+            # the same group name in several patterns, or more groups than
+            # the re module supports (AssertionError)
+            LOGGER.warning('Tag patterns matched separately, they can\'t be '
+                           'combined: %s', e)
+            self.combine_error = str(e)
+            self.groups = {}
+            self.separate += [(i, regex) for (i, _, regex) in combined]
+
+    def count(self, content):
+        """Returns the number of matches of each pattern"""
+        start = time.time()
+        counts = [0] * self.n_patterns
+        if self.regex:
+            # the group of the whole pattern is the last one to be closed
+            for match in self.regex.finditer(content):
+                counts[self.groups[match.lastindex]] += 1
+        for (i, regex) in self.separate:
+            counts[i] = len(regex.findall(content))
+
+        duration = time.time() - start
+        if duration > TAG_MATCH_WARNING_TIME:
+            LOGGER.warning('Matching the tags of %d characters took %.1fs, '
+                           'a pattern may be too slow: %s', len(content),
+                           duration, ', '.join(self.patterns))
+        return counts
+
+# most recently used TagMatchers, by tuple of patterns. A new matcher is
+# built when the tags are changed.
+TAG_MATCHER_CACHE_SIZE = 16
+_tag_matchers = OrderedDict()
+
+def get_tag_matcher(patterns):
+    key = tuple(patterns)
+    matcher = _tag_matchers.pop(key, None)
+    if matcher is None:
+        matcher = TagMatcher(patterns)
+    _tag_matchers[key] = matcher
+    while len(_tag_matchers) > TAG_MATCHER_CACHE_SIZE:
+        _tag_matchers.popitem(last=False)
+    return matcher
 
-    return counts
+def extract_tags(content, tags):
+    tags = list(tags)
+    matcher = get_tag_matcher([tag.pattern for tag in tags])
+    return Counter(dict(zip(tags, matcher.count(content))))
+
+# commit headers of 'git log' and 'git format-patch' outputs. The commit
+# messages of 'git log' are indented, but not the ones of 'git format-patch',
+# where only the mbox separator, with its fixed date, starts a commit.
+_log_commit_re = re.compile('^commit ([0-9a-f]{40})(?:\s|$)')
+_format_patch_commit_re = re.compile(
+        '^From ([0-9a-f]{40}) Mon Sep 17 00:00:00 2001$')
+
+def split_commits(lines):
+    """Split a 'git log -p' or 'git format-patch --stdout' stream into
+       (commit sha, text) tuples. The format of the stream is given by its
+       first line."""
+    commit_re = None
+    sha = None
+    text = []
+
+    for line in lines:
+        if commit_re is None:
+            if _log_commit_re.match(line):
+                commit_re = _log_commit_re
+            elif _format_patch_commit_re.match(line):
+                commit_re = _format_patch_commit_re
+            else:
+                return
+
+        match = commit_re.match(line)
+        if match:
+            if sha:
+                yield (sha, ''.join(text))
+            sha = match.group(1)
+            text = []
+        text.append(line)
+
+    if sha:
+        yield (sha, ''.join(text))
+
+def _hash_commit(commit):
+    (sha, text) = commit
+    (patch, _) = parse_patch(text.decode('utf-8', 'replace'))
+    if not patch:
+        return (sha, None)
+    return (sha, hash_patch(patch).hexdigest())
+
+def hash_commits(input, output, jobs=None):
+    """Print 'sha<TAB>hash' for each commit of 'input' with a diff. The work
+       is spread across 'jobs' processes if there are enough commits to make
+       it worth it."""
+    import itertools
+    import multiprocessing
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    commits = split_commits(input)
+
+    # don't bother starting processes for a handful of commits
+    first = list(itertools.islice(commits, 64))
+    commits = itertools.chain(first, commits)
+
+    pool = None
+    if jobs > 1 and len(first) == 64:
+        pool = multiprocessing.Pool(jobs)
+        hashes = pool.imap(_hash_commit, commits, 16)
+    else:
+        hashes = itertools.imap(_hash_commit, commits)
+
+    try:
+        for (sha, hash) in hashes:
+            if hash:
+                output.write('%s\t%s\n' % (sha, hash))
+    finally:
+        if pool:
+            pool.terminate()
 
 def main(args):
     from optparse import OptionParser
@@ -248,9 +655,19 @@ def main(args):
             dest = 'print_comment', help = 'print parsed comment')
     parser.add_option('-#', '--hash', action = 'store_true',
             dest = 'print_hash', help = 'print patch hash')
+    parser.add_option('-b', '--batch', action = 'store_true',
+            dest = 'batch', help = 'read a git log -p or git format-patch '
+            'stream and print the hash of each commit, as "sha<TAB>hash"')
+    parser.add_option('-j', '--jobs', type = 'int', dest = 'jobs',
+            help = 'number of processes used in batch mode (default: number '
+            'of CPUs)')
 
     (options, args) = parser.parse_args()
 
+    if options.batch:
+        hash_commits(sys.stdin, sys.stdout, options.jobs)
+        return
+
     # decode from (assumed) UTF-8
     content = sys.stdin.read().decode('utf-8')
 
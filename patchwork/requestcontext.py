@@ -50,6 +50,8 @@ class PatchworkRequestContext(RequestContext):
             'messages': [],
         })
         if list_view:
+            # the 'after' and 'before' cursors depend on the order and the
+            # filters, the links to the previous and next pages set them
             params = self.filters.params()
             for param in ['order', 'page']:
                 data = {}
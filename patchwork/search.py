@@ -0,0 +1,246 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Full-text search of the patches.
+#
+# Each patch has a document in the search index, made of its name, its commit
+# message, the replies it received and the cover letters of the series it's
+# part of. The index is a table outside of the Django models as it depends on
+# the database: a tsvector column with a GIN index on PostgreSQL, a FTS5
+# virtual table on SQLite. Other databases fall back to searching the patch
+# names.
+#
+# Queries are lists of words and "quoted phrases", all of which have to be
+# found in the document. Words are sequences of letters and digits, so
+# 'use-after-free' is the phrase 'use after free'.
+
+import re
+
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from django.db.utils import OperationalError
+
+SEARCH_TABLE = 'patchwork_patchsearch'
+
+# the fields of a search document, from the most to the least relevant
+SEARCH_FIELDS = ('name', 'message', 'comments', 'cover_letter')
+
+_phrase_re = re.compile(r'"([^"]*)"?|([^"\s]+)', re.U)
+_word_re = re.compile(r'[^\W_]+', re.U)
+
+
+def parse_query(text):
+    """Split a search string into a list of phrases, lists of lower case
+       words"""
+    phrases = []
+    for match in _phrase_re.finditer(text):
+        text = match.group(1) or match.group(2) or ''
+        words = _word_re.findall(text.lower())
+        if words:
+            phrases.append(words)
+    return phrases
+
+
+class SearchBackend(object):
+    vendor = None
+
+    def create_index(self, cursor):
+        raise NotImplementedError
+
+    def drop_index(self, cursor):
+        cursor.execute('DROP TABLE IF EXISTS %s' % SEARCH_TABLE)
+
+    def write(self, cursor, documents):
+        """Replace the documents of the index, (patch id, project id, name,
+           message, comments, cover letter) tuples"""
+        self.remove(cursor, [d[0] for d in documents])
+        cursor.executemany(self.insert_sql, documents)
+
+    def append(self, cursor, patch_id, field, text):
+        """Add 'text' to a field of the document of a patch, if it has one"""
+        raise NotImplementedError
+
+    def remove(self, cursor, ids):
+        if not ids:
+            return
+        cursor.execute('DELETE FROM %s WHERE %s IN (%s)' %
+                       (SEARCH_TABLE, self.id_column,
+                        ', '.join(['%s'] * len(ids))), ids)
+
+    def filter(self, queryset, phrases, project=None):
+        """Restrict queryset to the patches matching 'phrases', annotated
+           with their search_rank (the higher, the more relevant)"""
+        query = self.query(phrases)
+        where = ['%s.%s = patchwork_patch.id' % (SEARCH_TABLE,
+                                                self.id_column),
+                 self.match_sql]
+        params = [query]
+        if project is not None:
+            where.append('%s.project_id = %%s' % SEARCH_TABLE)
+            params.append(project.id)
+        return queryset.extra(tables=[SEARCH_TABLE], where=where,
+                              params=params,
+                              select={'search_rank': self.rank_sql},
+                              select_params=self.rank_params(query))
+
+
+class PostgresSearchBackend(SearchBackend):
+    vendor = 'postgresql'
+    id_column = 'patch_id'
+    insert_sql = ('INSERT INTO %s (patch_id, project_id, document) '
+                  'VALUES (%%s, %%s, ' % SEARCH_TABLE +
+                  ' || '.join(["setweight(to_tsvector('english', "
+                               "coalesce(%%s, '')), '%s')" % weight
+                               for weight in 'ABDC']) + ')')
+    match_sql = "%s.document @@ to_tsquery('english', %%s)" % SEARCH_TABLE
+    rank_sql = "ts_rank(%s.document, to_tsquery('english', %%s))" % \
+               SEARCH_TABLE
+
+    weights = dict(zip(SEARCH_FIELDS, 'ABDC'))
+
+    def append(self, cursor, patch_id, field, text):
+        cursor.execute("UPDATE %s SET document = document || "
+                       "setweight(to_tsvector('english', %%s), '%s') "
+                       "WHERE patch_id = %%s" %
+                       (SEARCH_TABLE, self.weights[field]), [text, patch_id])
+
+    def create_index(self, cursor):
+        cursor.execute('CREATE TABLE %s ('
+                       'patch_id integer PRIMARY KEY '
+                       'REFERENCES patchwork_patch (id) ON DELETE CASCADE '
+                       'DEFERRABLE INITIALLY DEFERRED, '
+                       'project_id integer NOT NULL, '
+                       'document tsvector NOT NULL)' % SEARCH_TABLE)
+        cursor.execute('CREATE INDEX %s_document ON %s USING gin(document)' %
+                       (SEARCH_TABLE, SEARCH_TABLE))
+        cursor.execute('CREATE INDEX %s_project_id ON %s (project_id)' %
+                       (SEARCH_TABLE, SEARCH_TABLE))
+
+    def query(self, phrases):
+        return ' & '.join(['(%s)' % ' <-> '.join(words)
+                           for words in phrases])
+
+    def rank_params(self, query):
+        return (query, )
+
+
+class SqliteSearchBackend(SearchBackend):
+    vendor = 'sqlite'
+    id_column = 'rowid'
+    insert_sql = ('INSERT INTO %s (rowid, project_id, %s) '
+                  'VALUES (%%s, %%s, %%s, %%s, %%s, %%s)' %
+                  (SEARCH_TABLE, ', '.join(SEARCH_FIELDS)))
+    match_sql = '%s MATCH %%s' % SEARCH_TABLE
+    # bm25() is lower for more relevant documents, with one weight per column
+    rank_sql = '-bm25(%s, 0, 10.0, 4.0, 1.0, 2.0)' % SEARCH_TABLE
+
+    def append(self, cursor, patch_id, field, text):
+        cursor.execute("UPDATE %s SET %s = coalesce(%s, '') || %%s "
+                       "WHERE rowid = %%s" % (SEARCH_TABLE, field, field),
+                       ['\n' + text, patch_id])
+
+    def create_index(self, cursor):
+        cursor.execute("CREATE VIRTUAL TABLE %s USING fts5("
+                       "project_id UNINDEXED, %s, "
+                       "tokenize='porter unicode61')" %
+                       (SEARCH_TABLE, ', '.join(SEARCH_FIELDS)))
+
+    def query(self, phrases):
+        # words are only made of letters and digits, they can't contain a
+        # double quote
+        return ' '.join(['"%s"' % ' '.join(words) for words in phrases])
+
+    def rank_params(self, query):
+        return ()
+
+
+_backends = dict((b.vendor, b) for b in (PostgresSearchBackend,
+                                         SqliteSearchBackend))
+
+# the backend of each database, None if it doesn't have a search index
+_available = {}
+
+
+def get_backend(using=DEFAULT_DB_ALIAS):
+    """The search backend of a database, None when the database doesn't
+       support full-text search"""
+    conn = connections[using]
+    key = (using, conn.settings_dict['NAME'])
+    if key not in _available:
+        backend = _backends.get(conn.vendor)
+        if backend is not None and \
+           SEARCH_TABLE not in conn.introspection.table_names():
+            backend = None
+        _available[key] = backend() if backend else None
+    return _available[key]
+
+
+def create_index(schema_editor):
+    backend = _backends.get(schema_editor.connection.vendor)
+    if backend is None:
+        return
+    try:
+        backend().create_index(schema_editor.connection.cursor())
+    except OperationalError:
+        # SQLite built without FTS5
+        if backend.vendor != 'sqlite':
+            raise
+    _available.clear()
+
+
+def drop_index(schema_editor):
+    backend = _backends.get(schema_editor.connection.vendor)
+    if backend is not None:
+        backend().drop_index(schema_editor.connection.cursor())
+    _available.clear()
+
+
+def write_documents(documents):
+    backend = get_backend()
+    if backend is not None and documents:
+        backend.write(connection.cursor(), documents)
+
+
+def append_document(patch_id, field, text):
+    backend = get_backend()
+    if backend is not None and text:
+        backend.append(connection.cursor(), patch_id, field, text)
+
+
+def remove_documents(ids):
+    backend = get_backend()
+    if backend is not None:
+        backend.remove(connection.cursor(), list(ids))
+
+
+def search_patches(queryset, text, project=None, ranked=False):
+    """Restrict a Patch queryset to the patches matching the search string
+       'text', optionally only in 'project'. Sort them by decreasing
+       relevance when 'ranked' is set."""
+    backend = get_backend()
+    if backend is None:
+        return queryset.filter(name__icontains=text.strip())
+
+    phrases = parse_query(text)
+    if not phrases:
+        return queryset.none()
+
+    queryset = backend.filter(queryset, phrases, project)
+    if ranked:
+        queryset = queryset.order_by('-search_rank', '-date')
+    return queryset
@@ -42,6 +42,7 @@ class PatchworkModelSerializerOptions(serializers.ModelSerializerOptions):
     def __init__(self, meta):
         super(PatchworkModelSerializerOptions, self).__init__(meta)
         self.expand_serializers = getattr(meta, 'expand_serializers', {})
+        self.list_exclude = getattr(meta, 'list_exclude', ())
 
 class PatchworkModelSerializer(serializers.ModelSerializer):
     """A model serializer with configurable related fields.
@@ -50,10 +51,36 @@ class PatchworkModelSerializer(serializers.ModelSerializer):
        or expand them to include the related full JSON object.
        This behaviour is selectable through the 'related' GET parameter. Adding
        'related=expand' to the GET request will expand related fields.
+
+       The fields of the objects of the view can be chosen with the 'fields'
+       and 'exclude' GET parameters, comma separated lists of fields to show
+       and to leave out. Lists leave out the Meta.list_exclude fields unless
+       'fields' or 'exclude' is given.
     """
 
     _options_class = PatchworkModelSerializerOptions
 
+    @classmethod
+    def selected_fields(cls, request, many):
+        """The fields selected by the GET parameters of 'request', for a list
+           of objects if 'many'"""
+        opts = cls._options_class(cls.Meta)
+        params = request.QUERY_PARAMS
+
+        fields = opts.fields
+        if 'fields' in params:
+            requested = params['fields'].split(',')
+            fields = [f for f in fields if f in requested]
+
+        if 'exclude' in params:
+            exclude = params['exclude'].split(',')
+        elif many and 'fields' not in params:
+            exclude = opts.list_exclude
+        else:
+            exclude = ()
+
+        return [f for f in fields if f not in exclude]
+
     def __init__(self, *args, **kwargs):
         super(PatchworkModelSerializer, self).__init__(*args, **kwargs)
 
@@ -64,15 +91,24 @@ class PatchworkModelSerializer(serializers.ModelSerializer):
         # correctly.
         self.field_mapping[models.DateTimeField] = Iso8601DateTimeField
 
+        request = self.context['request']
         self._pw_related = RelatedMode.primary_key
-        related = self.context['request'].QUERY_PARAMS.get('related')
-        if not related:
-            return
-
-        try:
-            self._pw_related = RelatedMode[related]
-        except KeyError:
-            pass
+        related = request.QUERY_PARAMS.get('related')
+        if related:
+            try:
+                self._pw_related = RelatedMode[related]
+            except KeyError:
+                pass
+
+        # expanded related objects and nested lists always have all their
+        # fields
+        view_serializer = getattr(self.context.get('view'),
+                                  'serializer_class', None)
+        if view_serializer and isinstance(self, view_serializer):
+            selected = self.selected_fields(request, self.many)
+            for name in self.fields.keys():
+                if name not in selected:
+                    del self.fields[name]
 
     def _pw_get_nested_field(self, model_field, related_model, to_many):
         class NestedModelSerializer(serializers.ModelSerializer):
@@ -141,9 +177,12 @@ class PatchSerializer(PatchworkModelSerializer):
     class Meta:
         model = Patch
         fields = ('id', 'project', 'name', 'date', 'submitter', 'state',
-                  'content')
+                  'n_files', 'n_insertions', 'n_deletions', 'content')
         read_only_fields = ('id', 'project', 'name', 'date', 'submitter',
+                            'n_files', 'n_insertions', 'n_deletions',
                             'content')
+        # the diff of the patches can be big
+        list_exclude = ('content', )
         expand_serializers = {
             'project': ProjectSerializer,
             'submitter': PersonSerializer,
@@ -176,7 +215,8 @@ class EventLogSerializer(PatchworkModelSerializer):
     parameters = JSONField(read_only=True)
     class Meta:
         model = EventLog
-        fields = ('name', 'event_time', 'series', 'user', 'parameters')
+        fields = ('id', 'sequence', 'name', 'event_time', 'series', 'user',
+                  'parameters')
         expand_serializers = {
             'series': SeriesSerializer,
             'user': UserSerializer,
@@ -31,6 +31,7 @@ INSTALLED_APPS = [
 # HTTP
 
 MIDDLEWARE_CLASSES = [
+    'patchwork.middleware.DeferredUpdatesMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -106,12 +107,82 @@ REST_FRAMEWORK = {
 }
 
 
+#
+# Cache settings
+# https://docs.djangoproject.com/en/1.8/ref/settings/#caches
+#
+
+# 'default' holds, among others, the id of the latest event of each project,
+# which long polling clients of the events API wait for. It has to be shared
+# with the mail parser, using memcached for instance, for them to be woken up
+# as soon as new events are logged.
+#
+# 'highlight' holds the syntax highlighted HTML of patches and comments. The
+# oldest entries are evicted when their total size reaches MAX_SIZE bytes in
+# each process. A memcached backend can be used to share it between
+# processes, its memory being limited by memcached itself.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'highlight': {
+        'BACKEND': 'patchwork.cache.SizeBoundedLocMemCache',
+        'LOCATION': 'patchwork-highlight',
+        'TIMEOUT': 7 * 24 * 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'MAX_SIZE': 64 * 1024 * 1024,
+        },
+    },
+}
+
 #
 # Patchwork settings
 #
 
+# Cache used for the syntax highlighted patches and comments, 'default' is
+# used if it isn't in CACHES
+HIGHLIGHT_CACHE = 'highlight'
+
+# Patches with more characters than this only show their list of files on
+# the patch page, the diff of each file being loaded when it is opened. None
+# disables it.
+LARGE_PATCH_SIZE = 256 * 1024
+
 DEFAULT_PATCHES_PER_PAGE = 100
 
+# Patch lists with more patches than this are paginated with next/previous
+# links only, which stay fast on any page. None disables it.
+KEYSET_PAGINATION_THRESHOLD = 10000
+
+# Number of seconds the (estimated) number of patches of a list is cached
+PATCH_COUNT_CACHE_TIMEOUT = 300
+
+# Maximum number of seconds a request to the events API can wait for new
+# events with the 'wait' parameter
+EVENTS_MAX_WAIT = 30
+
+# Webhook deliveries, see the deliverwebhooks management command. Events are
+# POSTed to a webhook by batches of up to WEBHOOK_BATCH_SIZE. Failed requests
+# are retried WEBHOOK_RETRY_DELAY seconds later, the delay doubling after
+# each attempt up to WEBHOOK_MAX_RETRY_DELAY, until WEBHOOK_MAX_ATTEMPTS
+# attempts have been made. The cron command removes the deliveries older
+# than WEBHOOK_LOG_DAYS days.
+WEBHOOK_BATCH_SIZE = 50
+WEBHOOK_TIMEOUT = 10
+WEBHOOK_RETRY_DELAY = 60
+WEBHOOK_MAX_RETRY_DELAY = 6 * 3600
+WEBHOOK_MAX_ATTEMPTS = 10
+WEBHOOK_LOG_DAYS = 30
+
+# Directory where the mboxes of the patches are cached, None disables the
+# cache. It must be writable by the web server.
+MBOX_CACHE_DIR = None
+
+# Maximum size of the mbox cache in bytes. The least recently used mboxes
+# are removed by the cron command when the cache gets bigger.
+MBOX_CACHE_SIZE = 1024 * 1024 * 1024
+
 CONFIRMATION_VALIDITY_DAYS = 7
 
 NOTIFICATION_DELAY_MINUTES = 10
@@ -27,7 +27,8 @@ from django.core.urlresolvers import reverse, NoReverseMatch
 register = template.Library()
 
 # params to preserve across views
-list_params = [c.param for c in filterclasses] + ['order', 'page']
+list_params = [c.param for c in filterclasses] + ['order', 'page', 'after',
+                                                  'before']
 
 
 class ListURLNode(template.defaulttags.URLNode):
@@ -64,8 +65,14 @@ class ListURLNode(template.defaulttags.URLNode):
         except Exception:
             pass
 
+        # an empty value removes the parameter
         for (k, v) in self.params.iteritems():
-            params[smart_str(k, 'ascii')] = v.resolve(context)
+            k = smart_str(k, 'ascii')
+            value = v.resolve(context)
+            if value == '' or value is None:
+                params.pop(k, None)
+            else:
+                params[k] = value
 
         if not params:
             return str
@@ -17,59 +17,115 @@
 # along with Patchwork; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import hashlib
+import re
+
 from django import template
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
-import re
 
 register = template.Library()
 
-def _compile(t):
-    (r, str) = t
-    return (re.compile(r, re.M | re.I), str)
-
-_patch_span_res = map(_compile, [
-        ('^(Index:?|diff|\-\-\-|\+\+\+|\*\*\*) .*$', 'p_header'),
-        ('^\+.*$', 'p_add'),
-        ('^-.*$', 'p_del'),
-        ('^!.*$', 'p_mod'),
-        ])
-
-_patch_chunk_re = \
-        re.compile('^(@@ \-\d+(?:,\d+)? \+\d+(?:,\d+)? @@)(.*)$', re.M | re.I)
-
-_comment_span_res = map(_compile, [
-        ('^\s*Signed-off-by: .*$', 'signed-off-by'),
-        ('^\s*Acked-by: .*$', 'acked-by'),
-        ('^\s*Nacked-by: .*$', 'nacked-by'),
-        ('^\s*Tested-by: .*$', 'tested-by'),
-        ('^\s*Reviewed-by: .*$', 'reviewed-by'),
-        ('^\s*From: .*$', 'from'),
-        ('^\s*&gt;.*$', 'quote'),
-        ])
+# Each line is classified by the first of these prefixes it starts with.
+# Bump HIGHLIGHT_VERSION when changing the generated HTML, to not use the
+# cached output of the previous version.
+HIGHLIGHT_VERSION = 1
+
+_patch_line_re = re.compile(
+        r'(?P<p_header>(?:Index:?|diff|\-\-\-|\+\+\+|\*\*\*) )|'
+        r'(?P<p_add>\+)|'
+        r'(?P<p_del>-)|'
+        r'(?P<p_mod>!)|'
+        r'(?P<p_chunk>@@ \-\d+(?:,\d+)? \+\d+(?:,\d+)? @@)', re.I)
+
+_comment_classes = [
+        ('signed_off_by', 'signed-off-by', 'Signed-off-by: '),
+        ('acked_by', 'acked-by', 'Acked-by: '),
+        ('nacked_by', 'nacked-by', 'Nacked-by: '),
+        ('tested_by', 'tested-by', 'Tested-by: '),
+        ('reviewed_by', 'reviewed-by', 'Reviewed-by: '),
+        ('from_', 'from', 'From: '),
+        ('quote', 'quote', '&gt;'),
+        ]
+
+_comment_line_re = re.compile(r'\s*(?:' + '|'.join(
+        ['(?P<%s>%s)' % (group, re.escape(prefix))
+         for (group, _, prefix) in _comment_classes]) + ')', re.I)
+
+_comment_group_classes = dict((group, cls)
+                              for (group, cls, _) in _comment_classes)
 
 _span = '<span class="%s">%s</span>'
 
-@register.filter
-def patchsyntax(patch):
-    content = escape(patch.content)
+def _patch_line(line):
+    # fast path for the most common lines: context, additions and removals
+    c = line[:1]
+    if c == ' ' or c == '':
+        return line
+    elif c == '+' and not line.startswith('+++ '):
+        return _span % ('p_add', line)
+    elif c == '-' and not line.startswith('--- '):
+        return _span % ('p_del', line)
 
-    for (r,cls) in _patch_span_res:
-        content = r.sub(lambda x: _span % (cls, x.group(0)), content)
+    match = _patch_line_re.match(line)
+    if match is None:
+        return line
+    cls = match.lastgroup
+    if cls == 'p_chunk':
+        return _span % ('p_chunk', match.group(cls)) + ' ' + \
+               _span % ('p_context', line[match.end():])
+    return _span % (cls, line)
 
-    content = _patch_chunk_re.sub( \
-            lambda x: \
-                _span % ('p_chunk', x.group(1)) + ' ' + \
-                _span % ('p_context', x.group(2)), \
-            content)
+def _comment_line(line):
+    match = _comment_line_re.match(line)
+    if match is None:
+        return line
+    return _span % (_comment_group_classes[match.lastgroup], line)
 
-    return mark_safe(content)
+def highlight_patch(content):
+    return '\n'.join([_patch_line(l) for l in escape(content).split('\n')])
 
-@register.filter
-def commentsyntax(comment):
-    content = escape(comment.content)
+def highlight_comment(content):
+    return '\n'.join([_comment_line(l)
+                      for l in escape(content).split('\n')])
 
-    for (r,cls) in _comment_span_res:
-        content = r.sub(lambda x: _span % (cls, x.group(0)), content)
+def highlight_cache_key(kind, content):
+    # keyed by a digest of the content, so a patch sent several times is
+    # only highlighted once and an edited comment never gets stale HTML
+    return 'patchwork-%s-%d-%s' % (kind, HIGHLIGHT_VERSION,
+            hashlib.sha1(content.encode('utf-8')).hexdigest())
 
-    return mark_safe(content)
+def _highlight_cache():
+    # settings written before the highlight cache don't define it
+    alias = settings.HIGHLIGHT_CACHE
+    if alias not in settings.CACHES:
+        alias = DEFAULT_CACHE_ALIAS
+    return caches[alias]
+
+def _cached_highlight(kind, content, highlight):
+    """The highlighted HTML of 'content', from the settings.HIGHLIGHT_CACHE
+       cache"""
+    content = content or ''
+    cache = _highlight_cache()
+    key = highlight_cache_key(kind, content)
+
+    html = cache.get(key)
+    if html is None:
+        html = highlight(content)
+        cache.set(key, html)
+
+    return mark_safe(html)
+
+def patch_html(content):
+    """The highlighted HTML of a diff, eg. the content of a patch"""
+    return _cached_highlight('patch', content, highlight_patch)
+
+@register.filter
+def patchsyntax(patch):
+    return patch_html(patch.content)
+
+@register.filter
+def commentsyntax(comment):
+    return _cached_highlight('comment', comment.content, highlight_comment)
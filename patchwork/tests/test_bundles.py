@@ -19,6 +19,9 @@
 
 import unittest
 import datetime
+import gzip
+import re
+import StringIO
 from django.test import TestCase
 from django.test.client import Client
 from django.utils.http import urlencode
@@ -126,6 +129,36 @@ class BundleViewTest(BundleTestBase):
             self.failUnless(next_pos < pos)
             pos = next_pos
 
+class BundleMboxTest(BundleTestBase):
+
+    def get_mbox(self, **extra):
+        response = self.client.get(bundle_url(self.bundle) + 'mbox/', **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response
+
+    def testBundleOrder(self):
+        for patch in self.patches.__reversed__():
+            self.bundle.append_patch(patch)
+
+        response = self.get_mbox()
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename=bundle-%d-testbundle.mbox' %
+                         self.bundle.id)
+        names = re.findall('^Subject: (.*)$',
+                           ''.join(response.streaming_content), re.M)
+        self.assertEqual(names, [p.name for p in self.patches.__reversed__()])
+
+    def testGzip(self):
+        for patch in self.patches:
+            self.bundle.append_patch(patch)
+
+        response = self.get_mbox(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        mbox = gzip.GzipFile(fileobj=StringIO.StringIO(
+                ''.join(response.streaming_content))).read()
+        self.assertEqual(mbox, ''.join(self.get_mbox().streaming_content))
+
 class BundleUpdateTest(BundleTestBase):
 
     def setUp(self):
@@ -0,0 +1,69 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from django.test import TestCase
+
+from patchwork.cache import SizeBoundedLocMemCache
+
+
+class SizeBoundedLocMemCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = SizeBoundedLocMemCache('test-size-bounded', {
+            'OPTIONS': {'MAX_SIZE': 1000},
+        })
+        self.cache.clear()
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def testEviction(self):
+        for key in 'abcd':
+            self.cache.set(key, key * 300)
+        # the oldest entries make room for the new ones
+        self.assertEqual(self.cache.get('a'), None)
+        for key in 'bcd':
+            self.assertEqual(self.cache.get(key), key * 300)
+
+        # replacing an entry doesn't count it twice
+        self.cache.set('b', 'b' * 300)
+        self.assertEqual(self.cache.get('c'), 'c' * 300)
+
+        self.cache.delete('c')
+        self.cache.set('e', 'e' * 300)
+        self.assertEqual(self.cache.get('b'), 'b' * 300)
+        self.assertEqual(self.cache.get('d'), 'd' * 300)
+
+    def testTooLarge(self):
+        self.cache.set('a', 'a' * 300)
+        self.cache.set('b', 'b' * 2000)
+        self.assertEqual(self.cache.get('b'), None)
+        self.assertEqual(self.cache.get('a'), 'a' * 300)
+
+    def testMaxEntries(self):
+        cache = SizeBoundedLocMemCache('test-size-bounded-entries', {
+            'OPTIONS': {'MAX_SIZE': 1000, 'MAX_ENTRIES': 2,
+                        'CULL_FREQUENCY': 0},
+        })
+        for key in 'abc':
+            cache.set(key, key * 300)
+        # culled entries aren't counted anymore
+        cache.set('d', 'd' * 600)
+        self.assertEqual(cache.get('c'), 'c' * 300)
+        self.assertEqual(cache.get('d'), 'd' * 600)
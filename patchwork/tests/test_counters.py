@@ -0,0 +1,254 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from patchwork.models import Patch, Person, Project, ProjectCounters, \
+                             Series, State, TodoCounter
+from patchwork.tests.utils import defaults, create_user
+
+
+class CounterTest(TestCase):
+    fixtures = ['default_states', 'default_events']
+
+    def setUp(self):
+        self.project = Project(linkname='test-project', name='Test Project',
+                               listid='test.example.com')
+        self.project.save()
+        self.user = create_user()
+        self.person = Person(name='Patch Author', email='author@example.com')
+        self.person.save()
+        self.new = State.objects.get(name='New')
+        self.accepted = State.objects.get(name='Accepted')
+        self.assertTrue(self.new.action_required)
+        self.assertFalse(self.accepted.action_required)
+
+    def create_patch(self, **kwargs):
+        patch = Patch(project=self.project, msgid='patch%d' %
+                      Patch.objects.count(), name=defaults.patch_name,
+                      submitter=self.person, content='', **kwargs)
+        patch.save()
+        return patch
+
+    def assertCounters(self, n_patches, n_archived_patches, n_series, todo):
+        project = Project.objects.get(pk=self.project.pk)
+        counters = project.get_counters()
+        self.assertEqual((counters.n_patches, counters.n_archived_patches,
+                          counters.n_series),
+                         (n_patches, n_archived_patches, n_series))
+        self.assertEqual(self.user.profile.n_todo_patches(), todo)
+
+        # and they are the actual counts
+        self.assertEqual(ProjectCounters.compute()[self.project.pk],
+                         {'n_patches': n_patches,
+                          'n_archived_patches': n_archived_patches,
+                          'n_series': n_series})
+        self.assertEqual(TodoCounter.compute().get((self.user.pk,
+                                                    self.project.pk), 0),
+                         todo)
+
+
+class PatchCounterTest(CounterTest):
+
+    def testCreate(self):
+        self.create_patch()
+        self.create_patch(delegate=self.user)
+        self.create_patch(delegate=self.user, state=self.accepted)
+        self.create_patch(archived=True)
+        self.assertCounters(3, 1, 0, 1)
+
+    def testArchive(self):
+        patch = self.create_patch(delegate=self.user)
+        patch.archived = True
+        patch.save()
+        self.assertCounters(0, 1, 0, 0)
+
+        patch = Patch.objects.get(pk=patch.pk)
+        patch.archived = False
+        patch.save()
+        self.assertCounters(1, 0, 0, 1)
+
+    def testState(self):
+        patch = self.create_patch(delegate=self.user)
+        patch = Patch.objects.get(pk=patch.pk)
+        patch.state = self.accepted
+        patch.save()
+        self.assertCounters(1, 0, 0, 0)
+
+        patch.state = self.new
+        patch.save()
+        self.assertCounters(1, 0, 0, 1)
+
+    def testDelegate(self):
+        other = create_user()
+        patch = self.create_patch(delegate=other)
+        self.assertCounters(1, 0, 0, 0)
+
+        patch.delegate = self.user
+        patch.save()
+        self.assertCounters(1, 0, 0, 1)
+        self.assertEqual(other.profile.n_todo_patches(), 0)
+
+        patch.delegate = None
+        patch.save()
+        self.assertCounters(1, 0, 0, 0)
+
+    def testUnknownValues(self):
+        # a patch not loaded from the database
+        patch = self.create_patch(delegate=self.user)
+        patch = Patch(pk=patch.pk, project=self.project, msgid=patch.msgid,
+                      name=patch.name, submitter=self.person, content='',
+                      date=patch.date, state=self.new, archived=True)
+        patch.save()
+        self.assertCounters(0, 1, 0, 0)
+
+    def testDelete(self):
+        self.create_patch(delegate=self.user)
+        patch = self.create_patch(delegate=self.user)
+        Patch.objects.get(pk=patch.pk).delete()
+        self.assertCounters(1, 0, 0, 1)
+
+    def testStateActionRequired(self):
+        self.create_patch(delegate=self.user, state=self.accepted)
+        self.create_patch(delegate=self.user, state=self.accepted)
+        self.accepted.action_required = True
+        self.accepted.save()
+        self.assertCounters(2, 0, 0, 2)
+
+        self.accepted.action_required = False
+        self.accepted.save()
+        self.assertCounters(2, 0, 0, 0)
+
+    def testSeries(self):
+        series = Series(project=self.project, submitter=self.person)
+        series.save()
+        Series(project=self.project, submitter=self.person).save()
+        self.assertCounters(0, 0, 2, 0)
+
+        series.delete()
+        self.assertCounters(0, 0, 1, 0)
+
+    def testMissingCounters(self):
+        self.create_patch(delegate=self.user)
+        ProjectCounters.objects.all().delete()
+        TodoCounter.objects.all().delete()
+
+        self.create_patch(delegate=self.user)
+        self.assertCounters(2, 0, 0, 2)
+
+    def testSaveNumQueries(self):
+        patch = self.create_patch()
+        patch = Patch.objects.get(pk=patch.pk)
+
+        # changes not affecting the counters don't touch them
+        patch.name = 'foo'
+        with CaptureQueriesContext(connection) as queries:
+            patch.save()
+        self.assertFalse([q for q in queries if 'counter' in q['sql']])
+
+        # updating the project counters is a single query
+        patch.archived = True
+        with CaptureQueriesContext(connection) as queries:
+            patch.save()
+        self.assertEqual(len([q for q in queries if 'counter' in q['sql']]),
+                         1)
+
+
+class CounterViewsTest(CounterTest):
+
+    def testProjectView(self):
+        self.create_patch()
+        self.create_patch(archived=True)
+        Series(project=self.project, submitter=self.person).save()
+
+        url = reverse('patchwork.views.project.project',
+                      kwargs={'project_id': self.project.linkname})
+        response = self.client.get(url)
+        self.assertEqual(response.context['n_patches'], 1)
+        self.assertEqual(response.context['n_archived_patches'], 1)
+        self.assertEqual(response.context['n_series'], 1)
+
+    def testTodoLists(self):
+        other = Project(linkname='other-project', name='Other Project',
+                        listid='other.example.com')
+        other.save()
+        self.create_patch(delegate=self.user)
+        self.create_patch(delegate=self.user)
+        self.create_patch(delegate=self.user, state=self.accepted)
+        Patch(project=other, msgid='other', name=defaults.patch_name,
+              submitter=self.person, content='', delegate=self.user).save()
+
+        self.client.login(username=self.user.username,
+                          password=self.user.username)
+        response = self.client.get(reverse('patchwork.views.user.todo_lists'))
+        self.assertEqual([(l['project'].linkname, l['n_patches'])
+                          for l in response.context['todo_lists']],
+                         [('other-project', 1), ('test-project', 2)])
+
+
+class UpdateCountersCommandTest(CounterTest):
+
+    def updatecounters(self, *args, **kwargs):
+        stdout = StringIO.StringIO()
+        call_command('updatecounters', *args, stdout=stdout, **kwargs)
+        return stdout.getvalue()
+
+    def setUp(self):
+        super(UpdateCountersCommandTest, self).setUp()
+        self.create_patch(delegate=self.user)
+        self.create_patch(archived=True)
+        Series(project=self.project, submitter=self.person).save()
+
+        # break the counters
+        ProjectCounters.objects.update(n_patches=10, n_series=0)
+        TodoCounter.objects.update(count=3)
+        other = create_user()
+        TodoCounter(user=other, project=self.project, count=1).save()
+
+    def testVerify(self):
+        self.assertRaises(CommandError, self.updatecounters, verify=True)
+        self.assertEqual(ProjectCounters.objects.get().n_patches, 10)
+
+    def testUpdate(self):
+        output = self.updatecounters()
+        self.assertTrue('n_patches is 10 instead of 1' in output)
+        self.assertTrue('fixed 3 counters' in output)
+        self.assertCounters(1, 1, 1, 1)
+        self.assertEqual(TodoCounter.objects.filter(count__gt=0).count(), 1)
+
+        output = self.updatecounters(verify=True)
+        self.assertFalse('fixed' in output)
+
+    def testMissingCounters(self):
+        ProjectCounters.objects.all().delete()
+        TodoCounter.objects.all().delete()
+        self.assertRaises(CommandError, self.updatecounters, 'test-project',
+                          verify=True)
+        self.updatecounters('test-project')
+        self.assertCounters(1, 1, 1, 1)
+
+    def testUnknownProject(self):
+        self.assertRaises(CommandError, self.updatecounters, 'foo')
@@ -50,7 +50,8 @@ class UTF8PatchViewTest(TestCase):
         response = self.client.get('/patch/%d/mbox/' % self.patch.id)
         self.assertEquals(response.status_code, 200)
         self.assertTrue(self.patch.content in \
-                response.content.decode(self.patch_encoding))
+                ''.join(response.streaming_content) \
+                .decode(self.patch_encoding))
 
     def testRawView(self):
         response = self.client.get('/patch/%d/raw/' % self.patch.id)
@@ -20,7 +20,9 @@
 import unittest
 from django.test import TestCase
 from django.test.client import Client
-from patchwork.tests.utils import defaults, create_user, find_in_context
+from patchwork.models import Patch
+from patchwork.tests.utils import defaults, create_user, find_in_context, \
+                                  read_patch
 
 class FilterQueryStringTest(TestCase):
     def testFilterQSEscaping(self):
@@ -43,3 +45,27 @@ class FilterQueryStringTest(TestCase):
         url = '/project/%s/list/?submitter=%%E2%%98%%83' % project.linkname
         response = self.client.get(url)
         self.failUnlessEqual(response.status_code, 200)
+
+class PathFilterTest(TestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        meep = read_patch('0001-add-line.patch')
+        for (name, content) in (('patch a', defaults.patch),
+                                ('patch meep', meep)):
+            Patch(project=defaults.project, name=name, msgid=name,
+                  submitter=defaults.patch_author_person,
+                  content=content).save()
+
+    def get_patches(self, path):
+        url = '/project/%s/list/?path=%s' % (defaults.project.linkname, path)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [p.name for p in response.context['page'].object_list]
+
+    def testPathFilter(self):
+        self.assertEqual(self.get_patches('meep.text'), ['patch meep'])
+        self.assertEqual(self.get_patches('a'), ['patch a'])
+        self.assertEqual(self.get_patches('foo/'), [])
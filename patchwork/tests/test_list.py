@@ -22,10 +22,13 @@ import random
 import datetime
 import string
 import re
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
 from django.test.client import Client
+from django.test.utils import CaptureQueriesContext, override_settings
 from patchwork.tests.utils import defaults, create_user, find_in_context
-from patchwork.models import Person, Patch
+from patchwork.models import Person, Patch, State
 from django.core.urlresolvers import reverse
 
 class EmptyPatchListTest(TestCase):
@@ -115,3 +118,121 @@ class PatchOrderTest(TestCase):
                                     p2.submitter.name.lower())
         self._test_sequence(response, test_fn)
 
+
+@override_settings(KEYSET_PAGINATION_THRESHOLD=5)
+class KeysetPaginationTest(TestCase):
+    fixtures = ['default_states', 'default_events']
+    orders = ['date', '-date', 'name', '-name', 'state', '-state',
+              'submitter', '-submitter', 'delegate', '-delegate']
+
+    def setUp(self):
+        cache.clear()
+        defaults.project.save()
+        self.url = reverse('patchwork.views.patch.list',
+                           kwargs={'project_id': defaults.project.linkname})
+
+        # plenty of ties and NULLs, to check the pages don't skip or repeat
+        # patches
+        people = [Person(name=name, email='%s@example.com' % i)
+                  for (i, name) in enumerate(['a', 'b', None])]
+        for person in people:
+            person.save()
+        delegate = create_user()
+        states = list(State.objects.all()[:2]) + [None]
+        date = datetime.datetime(2014, 1, 1)
+
+        for i in range(12):
+            Patch(project=defaults.project, msgid='patch%d' % i,
+                  name='patch%d' % (i % 5), submitter=people[i % 3],
+                  delegate=delegate if i % 2 else None, state=states[i % 3],
+                  date=date + datetime.timedelta(days=i % 4),
+                  content='').save()
+
+    def get_page(self, order, **params):
+        params['order'] = order
+        response = self.client.get(self.url, params, ppp=5)
+        return response.context['page']
+
+    def ids(self, page):
+        return [patch.id for patch in page.object_list]
+
+    def testWalk(self):
+        for order in self.orders:
+            # all the patches, on a single page
+            page = self.client.get(self.url, {'order': order},
+                                   ppp=100).context['page']
+            self.assertTrue(page.paginator.keyset)
+            expected = self.ids(page)
+            self.assertEqual(len(expected), 12)
+
+            page = self.get_page(order)
+            self.assertFalse(page.has_previous())
+            pages = [self.ids(page)]
+            while page.has_next():
+                page = self.get_page(order, after=page.next_cursor())
+                pages.append(self.ids(page))
+            self.assertEqual(sum(pages, []), expected)
+            self.assertEqual(map(len, pages), [5, 5, 2])
+
+            # and back to the first page
+            page = self.get_page(order, before=page.previous_cursor())
+            self.assertEqual(self.ids(page), pages[1])
+            page = self.get_page(order, before=page.previous_cursor())
+            self.assertEqual(self.ids(page), pages[0])
+            self.assertFalse(page.has_previous())
+
+    def testShortPreviousPage(self):
+        # going back from the 3rd patch gives the full first page
+        first = self.ids(self.get_page('date'))
+        page = self.get_page('date', before=first[2])
+        self.assertEqual(self.ids(page), first)
+
+    def testUnknownCursor(self):
+        first = self.ids(self.get_page('date'))
+        self.assertEqual(self.ids(self.get_page('date', after=9999)), first)
+        self.assertEqual(self.ids(self.get_page('date', after='x')), first)
+
+    def testNoOffsetNorCount(self):
+        page = self.get_page('-submitter')
+        with CaptureQueriesContext(connection) as queries:
+            page = self.get_page('-submitter', after=page.next_cursor())
+        self.assertEqual(page.paginator.count, 12)
+        for query in queries:
+            self.assertFalse('OFFSET' in query['sql'])
+            self.assertFalse('COUNT(' in query['sql'])
+
+    def testLinks(self):
+        page = self.get_page('date')
+        response = self.client.get(self.url, {'order': 'date',
+                                              'after': page.next_cursor()},
+                                   ppp=5)
+        page = response.context['page']
+        self.assertContains(response, 'about 12 patches')
+        self.assertContains(response, 'before=%d' % page.previous_cursor())
+        self.assertContains(response, 'after=%d' % page.next_cursor())
+        self.assertNotContains(response, 'after=%d&amp;before' %
+                               page.next_cursor())
+
+    def testOtherLinks(self):
+        page = self.get_page('date')
+        cursor = page.next_cursor()
+        response = self.client.get(self.url, {'order': 'date',
+                                              'after': cursor,
+                                              'submitter': 'a'}, ppp=5)
+        links = re.findall(r'href="([^"]*)"', response.content)
+
+        # changing the order or the filters starts from the first page
+        order_links = [l for l in links if 'order=-date' in l]
+        self.assertTrue(order_links)
+        filter_links = [l for l in links if 'submitter' not in l and
+                        'order=date' in l]
+        self.assertTrue(filter_links)
+        for link in order_links + filter_links:
+            self.assertFalse('after=' in link)
+            self.assertFalse('before=' in link)
+
+    @override_settings(KEYSET_PAGINATION_THRESHOLD=100)
+    def testSmallList(self):
+        page = self.get_page('date')
+        self.assertFalse(page.paginator.keyset)
+        self.assertEqual(page.paginator.num_pages, 3)
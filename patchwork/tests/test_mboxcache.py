@@ -0,0 +1,224 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import os
+import shutil
+import StringIO
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from patchwork import mboxcache
+from patchwork.models import Comment, Patch, Person, Project, State
+from patchwork.tests.utils import defaults
+
+
+class MboxCacheTest(TestCase):
+    fixtures = ['default_states', 'default_events']
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings = override_settings(MBOX_CACHE_DIR=self.cache_dir)
+        self.settings.enable()
+
+        self.project = Project(linkname='test-project', name='Test Project',
+                               listid='test.example.com')
+        self.project.save()
+        self.person = Person(name='Patch Author', email='author@example.com')
+        self.person.save()
+        self.patch = self.create_patch('foo')
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.cache_dir)
+
+    def create_patch(self, name):
+        patch = Patch(project=self.project, msgid='<%s@example.com>' % name,
+                      name=name, submitter=self.person, content=defaults.patch)
+        patch.save()
+        Comment(patch=patch, msgid=patch.msgid, submitter=self.person,
+                content='commit message').save()
+        return Patch.objects.get(pk=patch.pk)
+
+    def mbox(self, patches=None):
+        # patchwork.views can't be imported before the test database exists
+        from patchwork.views import iter_mbox
+        if patches is None:
+            patches = Patch.objects.filter(pk=self.patch.pk)
+        return ''.join(iter_mbox(patches))
+
+    def generation(self):
+        return Patch.objects.get(pk=self.patch.pk).mbox_generation
+
+    def cached_files(self):
+        return sorted(name for (_, _, names) in os.walk(self.cache_dir)
+                      for name in names)
+
+    def testCached(self):
+        mbox = self.mbox()
+        self.assertEqual(self.cached_files(),
+                         ['%d-%d.mbox' % (self.patch.pk, self.generation())])
+
+        # only the generation is read from the database
+        with self.assertNumQueries(1):
+            self.assertEqual(self.mbox(), mbox)
+
+    def testPartlyCached(self):
+        other = self.create_patch('bar')
+        self.mbox()
+        patches = Patch.objects.filter(pk__in=[self.patch.pk, other.pk]) \
+                               .order_by('-pk')
+        mbox = self.mbox(patches)
+        self.assertTrue(mbox.index('Subject: bar') <
+                        mbox.index('Subject: foo'))
+        self.assertEqual(len(self.cached_files()), 2)
+
+    def testDeletedPatch(self):
+        # patchwork.views can't be imported before the test database exists
+        from patchwork.views import iter_mbox
+        other = self.create_patch('bar')
+        patches = Patch.objects.filter(pk__in=[self.patch.pk, other.pk])
+
+        # delete a patch once its id has been read, before its mbox is
+        # generated
+        get = mboxcache.get
+
+        def get_and_delete(id, generation):
+            Patch.objects.filter(pk=other.pk).delete()
+            return get(id, generation)
+        mboxcache.get = get_and_delete
+        try:
+            mbox = ''.join(iter_mbox(patches))
+        finally:
+            mboxcache.get = get
+
+        self.assertTrue(mbox.startswith('From patchwork'))
+        self.assertTrue('Subject: foo' in mbox)
+        self.assertFalse('Subject: bar' in mbox)
+
+    def testComment(self):
+        self.mbox()
+        comment = Comment(patch=self.patch, msgid='reply',
+                          submitter=self.person, content='Acked-by: foo')
+        comment.save()
+        self.assertTrue('Acked-by: foo' in self.mbox())
+
+        comment.content = 'Reviewed-by: foo'
+        comment.save()
+        mbox = self.mbox()
+        self.assertTrue('Reviewed-by: foo' in mbox)
+        self.assertFalse('Acked-by: foo' in mbox)
+
+        comment.delete()
+        self.assertFalse('Reviewed-by: foo' in self.mbox())
+
+        # previous generations are removed
+        self.assertEqual(len(self.cached_files()), 1)
+
+    def testPermissions(self):
+        self.mbox()
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = os.stat(mboxcache._path(self.patch.pk, self.generation())) \
+                 .st_mode
+        self.assertEqual(mode & 0o777, 0o666 & ~umask)
+
+    def testPatchChange(self):
+        self.mbox()
+        generation = self.generation()
+
+        # the mbox doesn't depend on the state
+        self.patch.state = State.objects.get(name='Accepted')
+        self.patch.save()
+        self.assertEqual(self.generation(), generation)
+
+        self.patch.name = 'bar'
+        self.patch.save()
+        self.assertTrue('Subject: bar' in self.mbox())
+
+    def testSubmitterChange(self):
+        self.mbox()
+        person = Person.objects.get(pk=self.person.pk)
+        person.name = 'Someone Else'
+        person.save()
+        self.assertTrue('From: Someone Else <author@example.com>' in
+                        self.mbox())
+
+    def testPrune(self):
+        self.mbox()
+        other = self.create_patch('bar')
+        self.mbox(Patch.objects.filter(pk=other.pk))
+        path = mboxcache._path(other.pk, other.mbox_generation)
+        os.utime(path, (0, 0))
+
+        # stale generations and a deleted patch
+        mboxcache.put(self.patch.pk, self.generation() - 1, 'stale')
+        Patch.objects.filter(pk=self.patch.pk).update(mbox_generation=100)
+        mboxcache.put(1000, 0, 'deleted patch')
+        self.assertEqual(len(self.cached_files()), 4)
+
+        self.assertEqual(mboxcache.prune()[0], 3)
+        self.assertEqual(self.cached_files(),
+                         ['%d-%d.mbox' % (other.pk, other.mbox_generation)])
+
+        # least recently used
+        self.mbox()
+        path = mboxcache._path(self.patch.pk, 100)
+        size = os.path.getsize(path)
+        self.assertEqual(mboxcache.prune(size), (1, size))
+        self.assertEqual(self.cached_files(),
+                         ['%d-100.mbox' % self.patch.pk])
+
+    def testFailedWrite(self):
+        # the temporary file is removed when the mbox can't be stored, here
+        # because a directory is in the way
+        path = mboxcache._path(self.patch.pk, 1)
+        os.makedirs(path)
+        mboxcache.put(self.patch.pk, 1, 'mbox')
+        self.assertEqual(self.cached_files(), [])
+
+        # and the ones left behind are pruned once they are old enough
+        directory = os.path.dirname(path)
+        stale = os.path.join(directory, '.%d-stale' % self.patch.pk)
+        recent = os.path.join(directory, '.%d-recent' % self.patch.pk)
+        for path in (stale, recent):
+            open(path, 'w').close()
+        os.utime(stale, (0, 0))
+        self.assertEqual(mboxcache.prune()[0], 1)
+        self.assertEqual(self.cached_files(), ['.%d-recent' % self.patch.pk])
+
+    def testCommand(self):
+        other = self.create_patch('bar')
+        self.mbox()
+        call_command('updatemboxcache', stdout=StringIO.StringIO())
+        self.assertTrue(mboxcache.contains(other.pk, other.mbox_generation))
+
+        stdout = StringIO.StringIO()
+        call_command('updatemboxcache', prune=True, max_size=0, stdout=stdout)
+        self.assertTrue('removed 2 mboxes' in stdout.getvalue())
+        self.assertEqual(self.cached_files(), [])
+
+    @override_settings(MBOX_CACHE_DIR=None)
+    def testDisabled(self):
+        self.assertEqual(self.mbox(), self.mbox())
+        self.assertEqual(self.cached_files(), [])
+        self.assertRaises(CommandError, call_command, 'updatemboxcache')
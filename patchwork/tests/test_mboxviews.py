@@ -169,7 +169,8 @@ class MboxDateHeaderTest(TestCase):
 
     def testDateHeader(self):
         response = self.client.get('/patch/%d/mbox/' % self.patch.id)
-        mail = email.message_from_string(response.content)
+        mail = email.message_from_string(
+                ''.join(response.streaming_content))
         mail_date = dateutil.parser.parse(mail['Date'])
         # patch dates are all in UTC
         patch_date = self.patch.date.replace(tzinfo=dateutil.tz.tzutc(),
@@ -186,7 +187,8 @@ class MboxDateHeaderTest(TestCase):
         self.patch.save()
 
         response = self.client.get('/patch/%d/mbox/' % self.patch.id)
-        mail = email.message_from_string(response.content)
+        mail = email.message_from_string(
+                ''.join(response.streaming_content))
         mail_date = dateutil.parser.parse(mail['Date'])
         self.assertEqual(mail_date, date)
 
@@ -219,3 +221,53 @@ class MboxCommentPostcriptUnchangedTest(TestCase):
         self.assertContains(response, self.txt)
         self.txt += "\n"
         self.assertNotContains(response, self.txt)
+
+class MboxQueriesTest(TestCase):
+    fixtures = ['default_states', 'default_events']
+
+    """ Test that the mbox of several patches is generated in a fixed number
+        of queries """
+    def setUp(self):
+        defaults.project.save()
+
+    def createPatches(self, n):
+        for i in range(n):
+            person = Person(name = 'author %d' % i,
+                            email = 'author%d@example.com' % i)
+            person.save()
+            patch = Patch(project = defaults.project,
+                          msgid = 'patch%d' % i, name = 'patch %d' % i,
+                          submitter = person, content = defaults.patch,
+                          headers = 'Cc: foo@example.com\n')
+            patch.save()
+            Comment(patch = patch, msgid = patch.msgid, submitter = person,
+                    content = 'commit message %d\n---\nv2: foo\n' % i).save()
+            Comment(patch = patch, msgid = 'reply%d' % i, submitter = person,
+                    content = 'Acked-by: %d\n' % i).save()
+        return Patch.objects.filter(project = defaults.project) \
+                            .order_by('-id')
+
+    def testBatch(self):
+        # patchwork.views can't be imported before the test database exists
+        from patchwork.views import iter_mbox, patch_to_mbox, patches_to_mbox
+
+        patches = self.createPatches(5)
+        mbox = '\n'.join([patch_to_mbox(p).as_string(True) for p in patches])
+
+        # the patches, their submitters and their comments
+        with self.assertNumQueries(3):
+            mails = patches_to_mbox(patches.all())
+        self.assertEqual('\n'.join([m.as_string(True) for m in mails]), mbox)
+
+        # 1 query for the patch ids, and 3 queries per chunk of patches
+        with self.assertNumQueries(4):
+            self.assertEqual(''.join(iter_mbox(patches.all())), mbox)
+
+    def testChunks(self):
+        from patchwork.views import MBOX_CHUNK_SIZE, iter_mbox
+
+        patches = self.createPatches(MBOX_CHUNK_SIZE + 1)
+        with self.assertNumQueries(7):
+            mbox = ''.join(iter_mbox(patches))
+        self.assertEqual(mbox.count('\nFrom patchwork '), MBOX_CHUNK_SIZE)
+        self.assertEqual(mbox.count('Acked-by: '), MBOX_CHUNK_SIZE + 1)
@@ -0,0 +1,102 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import mailbox
+import os
+import shutil
+import StringIO
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from patchwork.management.commands.parsearchive import archive_mails
+from patchwork.models import Patch, Series, SeriesRevision, EventLog
+from patchwork.tests.utils import defaults, TestSeries
+
+
+class ParseArchiveTest(TestCase):
+    fixtures = ['default_states', 'default_events']
+
+    def setUp(self):
+        defaults.project.save()
+        self.dir = tempfile.mkdtemp()
+        self.mails = TestSeries(4).create_mails()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_mbox(self):
+        path = os.path.join(self.dir, 'archive.mbox')
+        mbox = mailbox.mbox(path)
+        for mail in self.mails:
+            mbox.add(mail)
+        mbox.close()
+        return path
+
+    def write_dir(self):
+        # file names are in the reverse order of arrival
+        for i, mail in enumerate(self.mails):
+            path = os.path.join(self.dir, '%d' % (len(self.mails) - i))
+            with open(path, 'w') as f:
+                f.write(mail.as_string())
+            os.utime(path, (1000 + i, 1000 + i))
+        return self.dir
+
+    def parse(self, path, **kwargs):
+        call_command('parsearchive', path, stdout=StringIO.StringIO(),
+                     **kwargs)
+
+    def assertSeriesComplete(self):
+        self.assertEqual(Series.objects.count(), 1)
+        self.assertEqual(SeriesRevision.objects.count(), 1)
+        self.assertEqual(Patch.objects.count(), 4)
+        self.assertEqual(EventLog.objects.count(), 1)
+        revision = SeriesRevision.objects.all()[0]
+        self.assertEqual(revision.root_msgid, self.mails[0].get('Message-Id'))
+        self.assertEqual(revision.cover_letter, defaults.series_cover_letter)
+
+    def testMbox(self):
+        self.parse(self.write_mbox(), batch_size=2)
+        self.assertSeriesComplete()
+
+    def testDirectory(self):
+        self.parse(self.write_dir(), batch_size=3)
+        self.assertSeriesComplete()
+
+    def testArrivalOrder(self):
+        mails = archive_mails(self.write_dir())
+        msgids = [m.get('Message-Id') for m in self.mails]
+        self.assertEqual(len(mails), len(self.mails))
+        for (load, msgid) in zip(mails, msgids):
+            self.assertTrue(msgid in load())
+
+    def testResume(self):
+        path = self.write_mbox()
+        checkpoint = os.path.join(self.dir, 'checkpoint')
+        with open(checkpoint, 'w') as f:
+            f.write('4 %s\n' % os.path.abspath(path))
+
+        self.parse(path, checkpoint=checkpoint)
+
+        # only the last patch has been parsed
+        self.assertEqual(Patch.objects.count(), 1)
+        self.assertEqual(Patch.objects.all()[0].msgid,
+                         self.mails[4].get('Message-Id'))
+        self.assertFalse(os.path.exists(checkpoint))
@@ -0,0 +1,79 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import os
+import shutil
+import socket
+import tempfile
+
+from django.test import TestCase
+
+from patchwork.bin.parsemaild import MailServer, remove_stale_socket
+from patchwork.models import Patch, Comment
+from patchwork.tests.utils import defaults, create_email
+
+
+class ParsemailDaemonTest(TestCase):
+    fixtures = ['default_states', 'default_events']
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'parsemail.sock')
+        self.server = MailServer(self.path)
+
+    def tearDown(self):
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def send(self, mail):
+        # the listen backlog lets us connect and send the whole mail before
+        # the server accepts the connection, no need for a thread.
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(self.path)
+        s.sendall(mail.as_string())
+        s.shutdown(socket.SHUT_WR)
+        self.server.handle_request()
+        status = s.makefile().readline().strip()
+        s.close()
+        return status
+
+    def testPatch(self):
+        mail = create_email(defaults.patch, subject='[PATCH] Test Patch')
+        self.assertEqual(self.send(mail), 'OK')
+        self.assertEqual(Patch.objects.count(), 1)
+        self.assertEqual(Patch.objects.all()[0].content, defaults.patch)
+
+    def testSeveralMails(self):
+        patch = create_email(defaults.patch, subject='[PATCH] Test Patch')
+        reply = create_email(defaults.review, subject='Re: [PATCH] Test Patch',
+                             in_reply_to=patch.get('Message-Id'))
+        self.assertEqual(self.send(patch), 'OK')
+        self.assertEqual(self.send(reply), 'OK')
+        patch = Patch.objects.get(msgid=patch.get('Message-Id'))
+        self.assertEqual(Comment.objects.filter(patch=patch).count(), 2)
+
+    def testStaleSocket(self):
+        # a daemon is listening
+        self.assertFalse(remove_stale_socket(self.path))
+        self.assertTrue(os.path.exists(self.path))
+
+        # nobody is listening anymore
+        self.server.server_close()
+        self.assertTrue(remove_stale_socket(self.path))
+        self.assertFalse(os.path.exists(self.path))
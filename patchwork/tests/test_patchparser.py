@@ -17,12 +17,17 @@
 # along with Patchwork; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import datetime
 import os
+import StringIO
 from email import message_from_string
 from email.utils import make_msgid
+from django.core.management import call_command
 from django.test import TestCase
 from patchwork.models import Project, Person, Patch, Comment, State, \
-         get_default_initial_patch_state
+         PatchFile, get_default_initial_patch_state
+from patchwork.parser import parse_diff, parse_patch, iter_patch, \
+                             hash_patch, hash_commits
 from patchwork.tests.utils import read_patch, read_mail, create_email, \
          defaults, create_user
 
@@ -519,6 +524,21 @@ class GitRenameWithDiffTest(MBoxPatchTest):
         self.assertEqual(patch.content.count("\nrename to "), 2)
         self.assertEqual(patch.content.count('\n-a\n+b'), 1)
 
+    def testDiff(self):
+        content = find_content(self.project, self.mail)
+        files = parse_diff(content.patch.content)
+
+        self.assertEqual(len(files), 2)
+        self.assertEqual(files[0].old_path,
+            'package/rpi-userland/rpi-userland-add-pkgconfig-files.patch')
+        self.assertEqual(files[0].path,
+            'package/rpi-userland/rpi-userland-000-add-pkgconfig-files.patch')
+        self.assertEqual(files[0].hunks, [(4, 100, 7, 100, 7)])
+        self.assertEqual((files[0].insertions, files[0].deletions), (1, 1))
+        # this rename only diff starts right after the first diff
+        self.assertEqual(files[1].start, files[0].end)
+        self.assertEqual(files[1].hunks, [])
+
 class CVSFormatPatchTest(MBoxPatchTest):
     mail_file = '0007-cvs-format-diff.mbox'
 
@@ -531,6 +551,20 @@ class CVSFormatPatchTest(MBoxPatchTest):
         self.assertTrue(comment is not None)
         self.assertTrue(patch.content.startswith('Index'))
 
+    def testDiff(self):
+        content = find_content(self.project, self.mail)
+        files = parse_diff(content.patch.content)
+        lines = content.patch.content.split('\n')
+
+        self.assertEqual([f.path for f in files],
+                         ['bfd/elf-bfd.h', 'bfd/elflink.c', 'bfd/elfxx-mips.c'])
+        self.assertEqual([(f.insertions, f.deletions) for f in files],
+                         [(2, 0), (3, 0), (1, 0)])
+        for f in files:
+            self.assertTrue(lines[f.start].startswith('Index: '))
+            self.assertEqual(len(f.hunks), 1)
+            self.assertTrue(lines[f.hunks[0][0]].startswith('@@ '))
+
 class CharsetFallbackPatchTest(MBoxPatchTest):
     """ Test mail with and invalid charset name, and check that we can parse
         with one of the fallback encodings"""
@@ -559,6 +593,148 @@ class NoNewlineAtEndOfFilePatchTest(MBoxPatchTest):
         # Confirm we got both markers
         self.assertEqual(2, patch.content.count('\ No newline at end of file'))
 
+    def testDiffstat(self):
+        patch = find_content(self.project, self.mail).patch
+        patch.project = self.project
+        patch.project.save()
+        patch.submitter = Person.objects.create(email='author@example.com')
+        patch.save()
+
+        self.assertEqual((patch.n_files, patch.n_insertions,
+                          patch.n_deletions), (3, 3, 1))
+        files = PatchFile.objects.filter(patch=patch)
+        self.assertEqual([f.path for f in files],
+                         ['tools/testing/selftests/powerpc/Makefile',
+                          'tools/testing/selftests/powerpc/vphn/vphn.c',
+                          'tools/testing/selftests/powerpc/vphn/vphn.h'])
+        self.assertEqual(files[1].old_path, '/dev/null')
+        self.assertEqual(files[1].hunks, [[18, 0, 0, 1, 1]])
+
+class StreamingParserTest(TestCase):
+    patch_filename = '0001-add-line.patch'
+    comment = 'Some comment\n\n'
+
+    def testFileObject(self):
+        text = self.comment + read_patch(self.patch_filename)
+        self.assertEqual(parse_patch(StringIO.StringIO(text)),
+                         parse_patch(text))
+        # the patch ends with a newline, the line after it is an empty
+        # comment line
+        self.assertEqual(parse_patch(text),
+                         (read_patch(self.patch_filename),
+                          self.comment + '\n'))
+
+    def testChunks(self):
+        n = 5000
+        text = '--- a/file\n+++ b/file\n@@ -0,0 +1,%d @@\n' % n + \
+               '+line\n' * n
+        chunks = list(iter_patch(text))
+        patch = [chunk for (is_patch, chunk) in chunks if is_patch]
+
+        # the hunk content doesn't come in one piece
+        self.assertTrue(len(patch) > 2)
+        self.assertEqual(''.join(patch), text)
+
+class BatchHashTest(TestCase):
+    patch_filename = '0001-add-line.patch'
+
+    def setUp(self):
+        self.patch = read_patch(self.patch_filename)
+        self.hash = hash_patch(self.patch).hexdigest()
+
+    def log(self, n):
+        """A 'git log -p' output of n commits, the even ones without diff"""
+        commits = []
+        for i in range(n):
+            sha = '%040x' % i
+            text = 'commit %s\nAuthor: A <a@example.com>\n\n' \
+                   '    Commit %d\n\n' % (sha, i)
+            if i % 2:
+                text += self.patch
+            commits.append((sha, text))
+        return commits
+
+    def hash_commits(self, text, jobs):
+        output = StringIO.StringIO()
+        hash_commits(StringIO.StringIO(text), output, jobs)
+        return [line.split('\t') for line in output.getvalue().splitlines()]
+
+    def testGitLog(self):
+        commits = self.log(10)
+        hashes = self.hash_commits(''.join([t for (_, t) in commits]), 1)
+        self.assertEqual(hashes, [[sha, self.hash] for (sha, _) in
+                                  commits[1::2]])
+
+    def testFormatPatch(self):
+        sha = 'a' * 40
+        text = 'From %s Mon Sep 17 00:00:00 2001\nSubject: [PATCH] a\n\n' \
+               '---\n%s' % (sha, self.patch)
+        self.assertEqual(self.hash_commits(text, 1), [[sha, self.hash]])
+
+    def testBackport(self):
+        # the sha of the upstream commit in a commit message doesn't start
+        # another commit
+        shas = ['a' * 40, 'b' * 40]
+        upstream = 'c' * 40
+        text = ''.join(['From %s Mon Sep 17 00:00:00 2001\n'
+                        'Subject: [PATCH] a\n\n'
+                        'commit %s upstream.\n\n---\n%s' %
+                        (sha, upstream, self.patch) for sha in shas])
+        self.assertEqual(self.hash_commits(text, 1),
+                         [[sha, self.hash] for sha in shas])
+
+    def testParallel(self):
+        commits = self.log(200)
+        hashes = self.hash_commits(''.join([t for (_, t) in commits]), 2)
+        self.assertEqual(hashes, [[sha, self.hash] for (sha, _) in
+                                  commits[1::2]])
+
+class RehashCommandTest(TestCase):
+    fixtures = ['default_states', 'default_events']
+
+    def setUp(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        self.other_project = Project(linkname='other-project',
+                                     name='Other Project')
+        self.other_project.save()
+
+        self.patches = []
+        for (i, project) in enumerate([defaults.project] * 4 +
+                                      [self.other_project]):
+            patch = Patch(project=project, msgid='patch-%d' % i,
+                          name=defaults.patch_name,
+                          submitter=defaults.patch_author_person,
+                          content=read_patch('0001-add-line.patch'),
+                          date=datetime.datetime(2015, 1, i + 1))
+            patch.save()
+            self.patches.append(patch)
+        self.hash = self.patches[0].hash
+        Patch.objects.update(hash='0' * 40)
+
+    def rehash(self, *args, **kwargs):
+        call_command('rehash', *args, stdout=StringIO.StringIO(), **kwargs)
+
+    def hashes(self):
+        return [p.hash for p in Patch.objects.order_by('id')]
+
+    def testRehash(self):
+        self.rehash(jobs=1)
+        self.assertEqual(self.hashes(), [self.hash] * 5)
+
+    def testRehashParallel(self):
+        self.rehash(jobs=2, chunk_size=1)
+        self.assertEqual(self.hashes(), [self.hash] * 5)
+
+    def testRehashScope(self):
+        self.rehash(jobs=1, project=[defaults.project.linkname],
+                    since=datetime.datetime(2015, 1, 2))
+        self.assertEqual(self.hashes(), ['0' * 40] + [self.hash] * 3 +
+                                        ['0' * 40])
+
+        self.rehash(str(self.patches[0].id), jobs=1)
+        self.assertEqual(self.hashes(), [self.hash] * 4 + ['0' * 40])
+
 class DelegateRequestTest(TestCase):
     fixtures = ['default_states', 'default_events']
     patch_filename = '0001-add-line.patch'
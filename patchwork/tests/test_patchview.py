@@ -0,0 +1,120 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from patchwork.models import Patch, Person, Project
+
+foo_diff = """diff --git a/foo.c b/foo.c
+--- a/foo.c
++++ b/foo.c
+@@ -1,2 +1,2 @@
+ int a;
+-int b;
++int c;
+"""
+
+bar_diff = """diff --git a/bar.c b/baz.c
+similarity index 90%
+rename from bar.c
+rename to baz.c
+--- a/bar.c
++++ b/baz.c
+@@ -1 +1,2 @@
+ int d;
++int e;
+"""
+
+
+@override_settings(LARGE_PATCH_SIZE=100)
+class LargePatchViewTest(TestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        project = Project(linkname='test-project', name='Test Project',
+                          listid='test.example.com')
+        project.save()
+        person = Person(name='Patch Author', email='author@example.com')
+        person.save()
+        self.patch = Patch(project=project, msgid='patch', name='foo',
+                           submitter=person, content=foo_diff + bar_diff)
+        self.patch.save()
+
+    def get_patch(self):
+        return self.client.get(reverse('patchwork.views.patch.patch',
+                                       kwargs={'patch_id': self.patch.id}))
+
+    def get_file(self, patch_file):
+        return self.client.get(reverse('patchwork.views.patch.patch_file',
+                                       kwargs={'patch_id': self.patch.id,
+                                               'file_id': patch_file.id}))
+
+    def testFileList(self):
+        response = self.get_patch()
+        self.assertEqual([f.path for f in response.context['patch_files']],
+                         ['foo.c', 'baz.c'])
+        self.assertContains(response, '2 files changed, 2 insertions, '
+                                      '1 deletion')
+        self.assertContains(response, 'bar.c &#8594; baz.c')
+        self.assertNotContains(response, 'p_add')
+
+    def testFileDiffs(self):
+        (foo, bar) = self.patch.patchfile_set.all()
+        self.assertEqual(foo.diff(), foo_diff)
+        self.assertEqual(bar.diff(), bar_diff)
+
+        response = self.get_file(bar)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<span class="p_add">+int e;</span>')
+        self.assertNotContains(response, 'int c;')
+
+    def testFileDiffQueries(self):
+        (foo, bar) = self.patch.patchfile_set.all()
+        self.assertEqual((bar.start, bar.end),
+                         (len(foo_diff), len(foo_diff + bar_diff)))
+
+        # only the diff of the file is read, not the whole patch
+        with self.assertNumQueries(1) as context:
+            self.assertEqual(bar.diff(), bar_diff)
+        sql = context.captured_queries[0]['sql']
+        self.assertFalse('headers' in sql)
+        self.assertFalse('int c' in sql)
+
+    def testNonAsciiFileDiffs(self):
+        self.patch.content = foo_diff.replace('int a', u'int \xe9') + \
+                             bar_diff.replace('int d', u'int \U0001f600')
+        self.patch.save()
+        (foo, bar) = self.patch.patchfile_set.all()
+        self.assertEqual(bar.diff(), bar_diff.replace('int d',
+                                                      u'int \U0001f600'))
+
+    def testOtherPatchFile(self):
+        other = Patch(project=self.patch.project, msgid='other', name='bar',
+                      submitter=self.patch.submitter, content=foo_diff)
+        other.save()
+        response = self.get_file(other.patchfile_set.get())
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(LARGE_PATCH_SIZE=None)
+    def testSmallPatch(self):
+        response = self.get_patch()
+        self.assertEqual(response.context['patch_files'], None)
+        self.assertContains(response, '<span class="p_add">+int e;</span>')
@@ -24,12 +24,22 @@ import dateutil.parser
 import hashlib
 import json
 import re
+import time
 
 from django.core import mail
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
 
+from patchwork.middleware import DeferredUpdatesMiddleware
 import patchwork.tests.test_series as test_series
 from patchwork.tests.test_user import TestUser
-from patchwork.models import Series, Patch, SeriesRevision, Test, TestResult
+from patchwork.models import Series, Patch, SeriesRevision, Test, \
+                             TestResult, State, Event, EventLog, Project, \
+                             ProjectCounters, deferred_updates, \
+                             publish_event, wait_for_events
 
 
 entry_points = {
@@ -104,7 +114,7 @@ class APITestBase(test_series.Series0010):
         # will depend on the previous tests run. Make sure to canonicalize
         # the mbox file so we can compare md5sums
         content = re.sub('^X-Patchwork-Id: .*$', 'X-Patchwork-Id: 1',
-                         response.content, flags=re.M)
+                         ''.join(response.streaming_content), flags=re.M)
         content_hash = hashlib.md5()
         content_hash.update(content)
         self.assertEqual(content_hash.hexdigest(), md5sum)
@@ -172,6 +182,31 @@ class APITest(APITestBase):
             self.assertTrue('[%d/4]' % i in patch['name'])
             i += 1
 
+    def testPatchDiffstat(self):
+        patch = self.get_json('/patches/%(patch_id)s/')
+        self.assertEqual(patch['n_files'], self.patch.n_files)
+        self.assertEqual(patch['n_insertions'], self.patch.n_insertions)
+        self.assertEqual(patch['n_deletions'], self.patch.n_deletions)
+        self.assertTrue(patch['n_files'] > 0)
+
+    def testPatchPathFilter(self):
+        patches = self.get_json('/patches/')
+        self.assertEqual(patches['count'], Patch.objects.count())
+
+        patches = self.get_json('/patches/',
+                                {'path': 'drivers/gpu/drm/i915/'})
+        self.assertEqual(patches['count'], Patch.objects.count())
+
+        # patches 2/4 and 4/4
+        patches = self.get_json('/patches/',
+                                {'path': 'drivers/gpu/drm/i915/intel_*'})
+        self.assertEqual(patches['count'], 2)
+        for patch in patches['results']:
+            self.assertTrue('Use for_each' in patch['name'])
+
+        patches = self.get_json('/patches/', {'path': 'drivers/net/'})
+        self.assertEqual(patches['count'], 0)
+
     def testSeriesMbox(self):
         self.check_mbox("/series/%s/revisions/1/mbox/" % self.series.pk,
                         'for_each_-intel_-crtc-v2.mbox',
@@ -221,6 +256,244 @@ class APITest(APITestBase):
                      params={'related': 'expand'})
 
 
+class EventCursorTest(APITestBase):
+    url = '/projects/%(project_id)s/events/'
+
+    def setUp(self):
+        super(EventCursorTest, self).setUp()
+        cache.clear()
+        new_revision = Event.objects.get(name='series-new-revision')
+        for version in range(2, 6):
+            EventLog(event=new_revision, series=self.series,
+                     parameters={'revision': version}).save()
+
+        # events of another project are never returned
+        project = Project(linkname='other', name='Other',
+                          listid='other.example.com')
+        project.save()
+        series = Series(project=project, name='other',
+                        submitter=self.series.submitter)
+        series.save()
+        EventLog(event=new_revision, series=series).save()
+
+    def revisions(self, events):
+        return [e['parameters']['revision'] for e in events['results']]
+
+    def testCursor(self):
+        events = self.get_json(self.url, {'after': 0, 'perpage': 3})
+        self.assertEqual(self.revisions(events), [1, 2, 3])
+        self.assertEqual(events['cursor'], events['results'][-1]['sequence'])
+        self.assertTrue('count' not in events)
+        self.assertTrue('after=%d' % events['cursor'] in events['next'])
+
+        events = self.get_json(self.url,
+                               {'after': events['cursor'], 'perpage': 3})
+        self.assertEqual(self.revisions(events), [4, 5])
+        self.assertEqual(events['next'], None)
+
+        # nothing new, the cursor stays the same
+        cursor = events['cursor']
+        events = self.get_json(self.url, {'after': cursor})
+        self.assertEqual(events['results'], [])
+        self.assertEqual(events['cursor'], cursor)
+
+    def testLinkname(self):
+        events = self.get_json('/projects/%(project_linkname)s/events/',
+                               {'after': 0})
+        self.assertEqual(self.revisions(events), [1, 2, 3, 4, 5])
+
+    def testSameEventTime(self):
+        EventLog.objects.update(event_time=datetime.datetime(2016, 1, 1))
+        events = self.get_json(self.url, {'after': 0, 'perpage': 2})
+        events = self.get_json(self.url, {'after': events['cursor']})
+        self.assertEqual(self.revisions(events), [3, 4, 5])
+
+    def testCommitOrder(self):
+        events = self.get_json(self.url, {'after': 0})
+        self.assertEqual([e['sequence'] for e in events['results']],
+                         [1, 2, 3, 4, 5])
+
+        # an event committed after another one with a greater id, by a
+        # concurrent transaction, is still after the cursor
+        new_revision = Event.objects.get(name='series-new-revision')
+        EventLog(id=100, event=new_revision, series=self.series,
+                 parameters={'revision': 6}).save()
+        events = self.get_json(self.url, {'after': events['cursor']})
+        self.assertEqual(self.revisions(events), [6])
+        EventLog(id=50, event=new_revision, series=self.series,
+                 parameters={'revision': 7}).save()
+        events = self.get_json(self.url, {'after': events['cursor']})
+        self.assertEqual(self.revisions(events), [7])
+
+        # the numbering goes on without the counters of the project
+        ProjectCounters.objects.all().delete()
+        EventLog(event=new_revision, series=self.series,
+                 parameters={'revision': 8}).save()
+        events = self.get_json(self.url, {'after': events['cursor']})
+        self.assertEqual([e['sequence'] for e in events['results']], [8])
+
+    def testInvalidCursor(self):
+        response = self.get(self.url, {'after': 'foo'})
+        self.assertEqual(response.status_code, 400)
+
+    def testNumQueries(self):
+        with self.assertNumQueries(1):
+            self.get(self.url, {'after': 0})
+        with self.assertNumQueries(1):
+            self.get('/projects/%(project_linkname)s/events/', {'after': 0})
+
+    def latest(self):
+        return EventLog.objects.filter(project=self.project) \
+                               .latest('sequence').sequence
+
+    def testWaitNewEvents(self):
+        start = time.time()
+        events = self.get_json(self.url, {'after': self.latest() - 1,
+                                          'wait': 10})
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(self.revisions(events), [5])
+
+    def testWaitTimeout(self):
+        latest = self.latest()
+        start = time.time()
+        # only the events are read from the database, once
+        with self.assertNumQueries(1):
+            events = self.get_json(self.url, {'after': latest, 'wait': 0.3})
+        self.assertTrue(time.time() - start >= 0.3)
+        self.assertEqual(events['results'], [])
+        self.assertEqual(events['cursor'], latest)
+
+    def testWaitFiltered(self):
+        # the new events are filtered out: wait for the next ones instead of
+        # reading them again and again
+        start = time.time()
+        with self.assertNumQueries(2):
+            events = self.get_json(self.url, {'after': 0, 'wait': 0.3,
+                                              'since': '2100-01-01'})
+        self.assertTrue(time.time() - start >= 0.3)
+        self.assertEqual(events['results'], [])
+
+    def testWaitDeferred(self):
+        latest = self.latest()
+        new_revision = Event.objects.get(name='series-new-revision')
+        with deferred_updates():
+            EventLog(event=new_revision, series=self.series,
+                     parameters={'revision': 6}).save()
+            # not committed yet, the clients aren't woken up
+            self.assertEqual(wait_for_events(self.project.id, latest, 0.1),
+                             latest)
+        self.assertEqual(wait_for_events(self.project.id, latest, 0.1),
+                         latest + 1)
+
+    def testWaitRequest(self):
+        # the events logged in a request are published at its end, not when
+        # the transactions of the view are still open
+        latest = self.latest()
+        new_revision = Event.objects.get(name='series-new-revision')
+        middleware = DeferredUpdatesMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        with transaction.atomic():
+            EventLog(event=new_revision, series=self.series,
+                     parameters={'revision': 6}).save()
+            self.assertEqual(wait_for_events(self.project.id, latest, 0.1),
+                             latest)
+        middleware.process_response(request, HttpResponse())
+        self.assertEqual(wait_for_events(self.project.id, latest, 0.1),
+                         latest + 1)
+
+    def testPublishOutOfOrder(self):
+        # events published late by another process don't hide the newer ones
+        latest = self.latest()
+        publish_event(self.project.id, latest + 2)
+        publish_event(self.project.id, latest + 1)
+        start = time.time()
+        self.assertEqual(wait_for_events(self.project.id, latest + 1, 10),
+                         latest + 2)
+        self.assertTrue(time.time() - start < 5)
+
+    def testWaitNotCached(self):
+        cache.clear()
+        params = {'after': self.latest(), 'wait': 0.1}
+        # the latest event is read from the database the first time only
+        with self.assertNumQueries(2):
+            self.get(self.url, params)
+        with self.assertNumQueries(1):
+            self.get(self.url, params)
+
+    @override_settings(EVENTS_MAX_WAIT=0)
+    def testMaxWait(self):
+        start = time.time()
+        self.get(self.url, {'after': self.latest(), 'wait': 10})
+        self.assertTrue(time.time() - start < 5)
+
+    def testInvalidWait(self):
+        response = self.get(self.url, {'after': 0, 'wait': 'foo'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SparseFieldsTest(APITestBase):
+
+    def testListContent(self):
+        patches = self.get_json('/patches/')
+        self.assertFalse('content' in patches['results'][0])
+        self.assertTrue('name' in patches['results'][0])
+
+        # an empty exclude shows all the fields
+        patches = self.get_json('/patches/', {'exclude': ''})
+        self.assertTrue('content' in patches['results'][0])
+
+        patch = self.get_json('/patches/%(patch_id)s/')
+        self.assertEqual(patch['content'], self.patch.content)
+
+    def testFields(self):
+        patches = self.get_json('/patches/', {'fields': 'id,name,foo'})
+        self.assertEqual(sorted(patches['results'][0].keys()),
+                         ['id', 'name'])
+
+        patch = self.get_json('/patches/%(patch_id)s/',
+                              {'exclude': 'content,submitter'})
+        self.assertFalse('content' in patch)
+        self.assertFalse('submitter' in patch)
+        self.assertEqual(patch['id'], self.patch.id)
+
+    def testColumns(self):
+        # unused columns aren't read from the database
+        with self.assertNumQueries(2) as context:
+            self.get('/patches/', {'fields': 'id,name,state'})
+        sql = context.captured_queries[-1]['sql']
+        self.assertTrue('"state_id"' in sql or '`state_id`' in sql)
+        self.assertFalse('content' in sql)
+        self.assertFalse('headers' in sql)
+
+    def testExpand(self):
+        patches = self.get_json('/patches/', {'fields': 'name,submitter',
+                                              'related': 'expand'})
+        patch = patches['results'][0]
+        self.assertEqual(sorted(patch.keys()), ['name', 'submitter'])
+        self.assertTrue('name' in patch['submitter'])
+
+        series = self.get_json('/projects/%(project_id)s/series/',
+                               {'fields': 'id,submitter',
+                                'related': 'expand'})
+        self.assertEqual(sorted(series['results'][0].keys()),
+                         ['id', 'submitter'])
+
+    def testNested(self):
+        # the patches of a revision aren't affected
+        revision = self.get_json('/series/%(series_id)s/revisions/1/',
+                                 {'related': 'expand',
+                                  'exclude': 'cover_letter'})
+        self.assertFalse('cover_letter' in revision)
+        self.assertTrue('content' in revision['patches'][0])
+
+    def testEvents(self):
+        events = self.get_json('/projects/%(project_id)s/events/',
+                               {'fields': 'name,parameters'})
+        self.assertEqual(sorted(events['results'][0].keys()),
+                         ['name', 'parameters'])
+
+
 class TestResultTest(APITestBase):
     rev_url = '/series/%(series_id)s/revisions/%(version)s/test-results/'
     patch_url = '/patches/%(patch_id)s/test-results/'
@@ -510,3 +783,74 @@ class TestResultTest(APITestBase):
             self._post_result(url, 'super test', 'failure')
             self.assertEqual(len(mail.outbox), 1)
             mail.outbox = []
+
+class CommitsTest(APITestBase):
+    url = '/projects/%(project_linkname)s/commits/'
+
+    def setUp(self):
+        super(CommitsTest, self).setUp()
+        self.patches = list(Patch.objects.filter(project=self.project)
+                                         .order_by('id')[:2])
+        self.accepted = State.objects.get(name='Accepted')
+
+    def testNotMaintainer(self):
+        commits = [{'hash': self.patches[0].hash, 'state': 'Accepted'}]
+        (r, data) = self.post_json(self.url, data={'commits': commits})
+        self.assertEqual(r.status_code, 401)
+
+        (r, data) = self.post_json(self.url, data={'commits': commits},
+                                   user=self.user)
+        self.assertEqual(r.status_code, 403)
+        self.assertNotEqual(Patch.objects.get(pk=self.patches[0].pk).state,
+                            self.accepted)
+
+    def testInvalidSubmissions(self):
+        for data in ({}, {'commits': 'foo'}, {'commits': [{'state': 'New'}]},
+                     {'commits': [{'hash': self.patches[0].hash,
+                                   'state': 'NoSuchState'}]}):
+            (r, _) = self.post_json(self.url, data=data, user=self.maintainer)
+            self.assertEqual(r.status_code, 400)
+
+        # nothing is updated if one of the commits is invalid
+        (r, _) = self.post_json(self.url, data={'commits': [
+            {'hash': self.patches[0].hash, 'state': 'Accepted'},
+            {'hash': self.patches[1].hash, 'state': 'NoSuchState'},
+        ]}, user=self.maintainer)
+        self.assertEqual(r.status_code, 400)
+        self.assertNotEqual(Patch.objects.get(pk=self.patches[0].pk).state,
+                            self.accepted)
+
+    def testUpdateCommits(self):
+        unknown = '0' * 40
+        commits = [
+            {'hash': self.patches[0].hash, 'commit_ref': '1234abcd',
+             'state': 'Accepted'},
+            {'hash': unknown, 'commit_ref': 'abcd1234', 'state': 'Accepted'},
+            {'hash': self.patches[1].hash.upper(), 'commit_ref': 'cafe',
+             'state': self.accepted.id},
+        ]
+        (r, data) = self.post_json(self.url, data={'commits': commits},
+                                   user=self.maintainer)
+        self.assertEqual(r.status_code, 200)
+
+        self.assertEqual([c['patches'] for c in data['matched']],
+                         [[self.patches[0].pk], [self.patches[1].pk]])
+        self.assertEqual(data['unmatched'], [{'hash': unknown,
+                                              'commit_ref': 'abcd1234',
+                                              'state': 'Accepted'}])
+
+        for (patch, commit_ref) in zip(self.patches, ('1234abcd', 'cafe')):
+            patch = Patch.objects.get(pk=patch.pk)
+            self.assertEqual(patch.state, self.accepted)
+            self.assertEqual(patch.commit_ref, commit_ref)
+
+    def testNumQueries(self):
+        commits = [{'hash': p.hash, 'commit_ref': 'ref'} for p in
+                   Patch.objects.filter(project=self.project)]
+        commits.append({'hash': '0' * 40, 'commit_ref': 'ref'})
+
+        # states, patches, the savepoint and one update per patch
+        with self.assertNumQueries(4 + len(commits) - 1):
+            (matched, unmatched) = self.project.update_commits(commits)
+        self.assertEqual(len(matched), len(commits) - 1)
+        self.assertEqual(len(unmatched), 1)
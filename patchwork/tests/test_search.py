@@ -0,0 +1,194 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import json
+import StringIO
+import unittest
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from patchwork import search
+from patchwork.models import Comment, Patch, Person, Project, Series, \
+                             SeriesRevision, deferred_updates
+from patchwork.search import parse_query, search_patches
+
+
+class ParseQueryTest(unittest.TestCase):
+
+    def testWords(self):
+        self.assertEqual(parse_query('Foo  bar'), [['foo'], ['bar']])
+
+    def testPhrases(self):
+        self.assertEqual(parse_query('"use after free" i915'),
+                         [['use', 'after', 'free'], ['i915']])
+        self.assertEqual(parse_query('use-after-free'),
+                         [['use', 'after', 'free']])
+        self.assertEqual(parse_query('kmalloc_array'), [['kmalloc', 'array']])
+
+    def testUnbalancedQuotes(self):
+        self.assertEqual(parse_query('foo "bar baz'),
+                         [['foo'], ['bar', 'baz']])
+
+    def testNoWords(self):
+        self.assertEqual(parse_query(' "" -- "'), [])
+
+
+class SearchTest(TestCase):
+    fixtures = ['default_states', 'default_events']
+
+    def setUp(self):
+        if search.get_backend() is None:
+            self.skipTest('requires a database with full-text search')
+        self.project = Project(linkname='test-project', name='Test Project',
+                               listid='test.example.com')
+        self.project.save()
+        self.person = Person(name='Patch Author', email='author@example.com')
+        self.person.save()
+
+    def create_patch(self, name, message=None, project=None):
+        patch = Patch(project=project or self.project, name=name,
+                      msgid='<%s@example.com>' % name, submitter=self.person,
+                      content='')
+        patch.save()
+        if message is not None:
+            self.create_comment(patch, message, msgid=patch.msgid)
+        return patch
+
+    def create_comment(self, patch, content, msgid=None):
+        comment = Comment(patch=patch, submitter=self.person, content=content,
+                          msgid=msgid or '<%s@example.com>' %
+                          Comment.objects.count())
+        comment.save()
+        return comment
+
+    def search(self, text, **kwargs):
+        return list(search_patches(Patch.objects.all(), text, **kwargs))
+
+    def testFields(self):
+        name = self.create_patch('drm/i915: Fix a leak')
+        message = self.create_patch('foo', 'Found with kmemleak')
+        reply = self.create_patch('bar')
+        self.create_comment(reply, 'This one leaks too.')
+        cover = self.create_patch('baz')
+        series = Series(project=self.project, submitter=self.person)
+        series.save()
+        revision = SeriesRevision(series=series,
+                                  cover_letter='Memory leaks fixes')
+        revision.save()
+        revision.add_patch(cover, 1)
+
+        self.assertEqual(set(self.search('leak')),
+                         set([name, reply, cover]))
+        self.assertEqual(self.search('kmemleak'), [message])
+
+    def testPhrases(self):
+        uaf = self.create_patch('foo: Fix a use-after-free')
+        self.create_patch('foo: use the free list after locking it')
+        self.assertEqual(self.search('"use after free"'), [uaf])
+        self.assertEqual(self.search('use-after-free'), [uaf])
+        self.assertEqual(self.search('"use after free" bar'), [])
+
+    def testRanking(self):
+        reply = self.create_patch('foo')
+        self.create_comment(reply, 'There is a deadlock here')
+        name = self.create_patch('bar: Fix a deadlock')
+        self.create_patch('baz: Something else')
+        self.assertEqual(self.search('deadlock', ranked=True), [name, reply])
+
+    def testProject(self):
+        other = Project(linkname='other-project', name='Other Project',
+                        listid='other.example.com')
+        other.save()
+        patch = self.create_patch('foo: Fix a race')
+        self.create_patch('bar: Fix a race', project=other)
+        self.assertEqual(self.search('race', project=self.project), [patch])
+
+    def testUpdates(self):
+        patch = self.create_patch('foo: Fix a race')
+        comment = self.create_comment(patch, 'Tested on a Skylake')
+        self.assertEqual(self.search('skylake'), [patch])
+
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.content = 'Tested on a Broadwell'
+        comment.save()
+        self.assertEqual(self.search('skylake'), [])
+        self.assertEqual(self.search('broadwell'), [patch])
+
+        comment.delete()
+        self.assertEqual(self.search('broadwell'), [])
+        self.assertEqual(self.search('skylake'), [])
+
+        patch.name = 'foo: Fix a deadlock'
+        patch.save()
+        self.assertEqual(self.search('race'), [])
+        self.assertEqual(self.search('deadlock'), [patch])
+
+        patch.delete()
+        self.assertEqual(self.search('deadlock'), [])
+
+    def testDeferredIndexing(self):
+        with deferred_updates():
+            patch = self.create_patch('foo: Fix a race', 'Found by lockdep')
+            self.create_comment(patch, 'Tested on a Skylake')
+            self.assertEqual(self.search('race'), [])
+        self.assertEqual(self.search('race'), [patch])
+        self.assertEqual(self.search('lockdep'), [patch])
+        self.assertEqual(self.search('skylake'), [patch])
+
+        # nothing is indexed if the block fails
+        try:
+            with deferred_updates():
+                patch.name = 'foo: Fix a deadlock'
+                patch.save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.search('deadlock'), [])
+
+    def testNoWords(self):
+        self.create_patch('foo')
+        self.assertEqual(self.search('--'), [])
+
+    def testFilterBar(self):
+        patch = self.create_patch('foo: Fix a use-after-free')
+        self.create_patch('foo: Fix a leak')
+        url = reverse('patchwork.views.patch.list',
+                      kwargs={'project_id': self.project.linkname})
+        response = self.client.get(url, {'q': 'use after free'})
+        self.assertEqual(list(response.context['page'].object_list), [patch])
+
+    def testREST(self):
+        self.create_patch('foo: Fix a deadlock')
+        self.create_patch('bar', 'Fix a deadlock in foo')
+        self.create_patch('baz: Fix a leak')
+        response = self.client.get('/api/1.0/patches/', {'q': 'foo deadlock'})
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content)['results']
+        self.assertEqual([p['name'] for p in results], ['foo: Fix a deadlock',
+                                                        'bar'])
+
+    def testUpdateSearchIndexCommand(self):
+        patch = self.create_patch('foo: Fix a leak', 'kmemleak report')
+        search.remove_documents([patch.id])
+        self.assertEqual(self.search('kmemleak'), [])
+
+        call_command('updatesearchindex', stdout=StringIO.StringIO())
+        self.assertEqual(self.search('kmemleak'), [patch])
@@ -18,15 +18,19 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import os
+import StringIO
 
+from django.core.management import call_command
 from django.test import TestCase
 from patchwork.models import Patch, Series, SeriesRevision, Project, \
-                             SERIES_DEFAULT_NAME, EventLog, User, Person
+                             SERIES_DEFAULT_NAME, EventLog, User, Person, \
+                             ThreadLock, Message
 from patchwork.tests.utils import read_mail
 from patchwork.tests.utils import defaults, read_mail, TestSeries
 
 from patchwork.bin.parsemail import parse_mail, build_references_list, \
-                                    clean_series_name
+                                    clean_series_name, thread_lock_slot, \
+                                    lock_thread
 
 class SeriesTest(TestCase):
     fixtures = ['default_states', 'default_events']
@@ -287,6 +291,93 @@ class ReferencesListTest(TestCase):
                            mails[2].get('Message-Id'),
                            mails[0].get('Message-Id')])
 
+class ThreadLockTest(TestCase):
+    fixtures = ['default_states', 'default_events']
+
+    def setUp(self):
+        defaults.project.save()
+
+    def testSameThread(self):
+        mails = TestSeries(3).create_mails()
+        slots = set([thread_lock_slot(defaults.project, m) for m in mails])
+        self.assertEquals(len(slots), 1)
+
+    def testDifferentThreads(self):
+        slots = set()
+        for i in range(10):
+            mail = TestSeries(1, has_cover_letter=False).create_mails()[0]
+            slots.add(thread_lock_slot(defaults.project, mail))
+        # there may be collisions, but not that many
+        self.assertTrue(len(slots) > 1)
+
+    def testLockThread(self):
+        mails = TestSeries(2).create_mails()
+        for mail in mails:
+            lock_thread(mail)
+        self.assertEquals(ThreadLock.objects.count(), 1)
+        self.assertEquals(ThreadLock.objects.all()[0].slot,
+                          thread_lock_slot(defaults.project, mails[0]))
+
+        # mails without a project don't take any lock
+        mail = TestSeries(1).create_mails()[0]
+        del mail['List-ID']
+        lock_thread(mail)
+        self.assertEquals(ThreadLock.objects.count(), 1)
+
+class MessageIndexTest(TestCase):
+    fixtures = ['default_states', 'default_events']
+
+    def setUp(self):
+        defaults.project.save()
+        self.series = TestSeries(2)
+        self.mails = self.series.create_mails()
+        # a review of patch 1/2 and a reply to that review with only the
+        # direct parent in References:
+        self.reply_1 = self.series.create_reply(self.mails[1])
+        self.reply_2 = self.series.create_reply(self.reply_1,
+                references=self.reply_1.get('Message-Id'))
+        self.mails += [self.reply_1, self.reply_2]
+        self.series.insert(self.mails)
+
+    def assertIndex(self):
+        msgids = [m.get('Message-Id') for m in self.mails]
+        (cover, patch_1, patch_2, reply_1, reply_2) = \
+            [Message.objects.get(msgid=msgid) for msgid in msgids]
+
+        self.assertEquals(Message.objects.count(), 5)
+        for message in (cover, patch_1, patch_2, reply_1, reply_2):
+            self.assertEquals(message.root_msgid, msgids[0])
+
+        self.assertTrue(cover.revision is not None)
+        self.assertEquals(cover.parent_msgid, None)
+        self.assertEquals(patch_1.patch.msgid, msgids[1])
+        self.assertEquals(patch_1.comment.msgid, msgids[1])
+        self.assertEquals(reply_1.patch, None)
+        self.assertEquals(reply_1.comment.patch, patch_1.patch)
+        self.assertEquals(reply_2.parent_msgid, msgids[3])
+        self.assertEquals(reply_2.references_list(),
+                          [msgids[3], msgids[1], msgids[0]])
+
+    def testIndex(self):
+        self.assertIndex()
+
+    def testReferencesNumQueries(self):
+        reply = self.series.create_reply(self.reply_2,
+                references=self.reply_2.get('Message-Id'))
+        with self.assertNumQueries(1):
+            refs = build_references_list(reply, defaults.project)
+        self.assertEquals(len(refs), 4)
+
+    def testBackfill(self):
+        Message.objects.all().delete()
+        call_command('indexmessages', stdout=StringIO.StringIO())
+        self.assertIndex()
+
+        # running it again doesn't duplicate anything
+        call_command('indexmessages', defaults.project.linkname,
+                     stdout=StringIO.StringIO())
+        self.assertEquals(Message.objects.count(), 5)
+
 #
 # New version of a single patch
 #
@@ -0,0 +1,152 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from patchwork.models import Comment, Patch, Person, Project
+from patchwork.templatetags.syntax import commentsyntax, highlight_comment, \
+                                          highlight_cache_key, \
+                                          highlight_patch, patchsyntax
+
+
+class HighlightTest(TestCase):
+
+    def testPatch(self):
+        content = '\n'.join([
+            'diff --git a/foo.c b/foo.c',
+            'index 1234567..89abcde 100644',
+            '--- a/foo.c',
+            '+++ b/foo.c',
+            '@@ -1,3 +1,3 @@ int foo(void)',
+            ' int a;',
+            '-int b;',
+            '+int c;',
+            '! int d;',
+            '',
+            ' if (a < b)',
+        ])
+        self.assertEqual(highlight_patch(content), '\n'.join([
+            '<span class="p_header">diff --git a/foo.c b/foo.c</span>',
+            '<span class="p_header">index 1234567..89abcde 100644</span>',
+            '<span class="p_header">--- a/foo.c</span>',
+            '<span class="p_header">+++ b/foo.c</span>',
+            '<span class="p_chunk">@@ -1,3 +1,3 @@</span> '
+            '<span class="p_context"> int foo(void)</span>',
+            ' int a;',
+            '<span class="p_del">-int b;</span>',
+            '<span class="p_add">+int c;</span>',
+            '<span class="p_mod">! int d;</span>',
+            '',
+            ' if (a &lt; b)',
+        ]))
+
+    def testComment(self):
+        content = '\n'.join([
+            'From: Foo <foo@example.com>',
+            '',
+            '> quoted text',
+            'Some text',
+            '',
+            '  Signed-off-by: Foo <foo@example.com>',
+            'acked-by: Bar <bar@example.com>',
+            'Reviewed-by: Baz <baz@example.com>',
+        ])
+        self.assertEqual(highlight_comment(content), '\n'.join([
+            '<span class="from">From: Foo &lt;foo@example.com&gt;</span>',
+            '',
+            '<span class="quote">&gt; quoted text</span>',
+            'Some text',
+            '',
+            '<span class="signed-off-by">  Signed-off-by: Foo '
+            '&lt;foo@example.com&gt;</span>',
+            '<span class="acked-by">acked-by: Bar '
+            '&lt;bar@example.com&gt;</span>',
+            '<span class="reviewed-by">Reviewed-by: Baz '
+            '&lt;baz@example.com&gt;</span>',
+        ]))
+
+
+class HighlightCacheTest(TestCase):
+
+    def setUp(self):
+        caches[settings.HIGHLIGHT_CACHE].clear()
+
+    def testCached(self):
+        patch = Patch(content='+foo\n')
+        html = patchsyntax(patch)
+        self.assertEqual(html, '<span class="p_add">+foo</span>\n')
+
+        # the second rendering comes from the cache
+        cache = caches[settings.HIGHLIGHT_CACHE]
+        key = highlight_cache_key('patch', '+foo\n')
+        self.assertEqual(cache.get(key), html)
+        cache.set(key, 'cached')
+        self.assertEqual(patchsyntax(Patch(content='+foo\n')), 'cached')
+
+    def testKinds(self):
+        # the same text as a patch and as a comment
+        content = 'From: foo\n+bar'
+        self.assertEqual(patchsyntax(Patch(content=content)),
+                         'From: foo\n<span class="p_add">+bar</span>')
+        self.assertEqual(commentsyntax(Comment(content=content)),
+                         '<span class="from">From: foo</span>\n+bar')
+
+    def testEdited(self):
+        comment = Comment(content='> foo')
+        self.assertEqual(commentsyntax(comment),
+                         '<span class="quote">&gt; foo</span>')
+        comment.content = 'foo'
+        self.assertEqual(commentsyntax(comment), 'foo')
+
+    def testNoContent(self):
+        self.assertEqual(patchsyntax(Patch(content=None)), '')
+
+    @override_settings(HIGHLIGHT_CACHE='missing')
+    def testDefaultCache(self):
+        cache = caches['default']
+        cache.clear()
+        html = patchsyntax(Patch(content='+foo\n'))
+        self.assertEqual(cache.get(highlight_cache_key('patch', '+foo\n')),
+                         html)
+
+
+class PatchViewHighlightTest(TestCase):
+    fixtures = ['default_states']
+
+    def testPatchView(self):
+        project = Project(linkname='test-project', name='Test Project',
+                          listid='test.example.com')
+        project.save()
+        person = Person(name='Patch Author', email='author@example.com')
+        person.save()
+        patch = Patch(project=project, msgid='patch', name='foo',
+                      submitter=person, content='--- a/foo\n+++ b/foo\n+bar\n')
+        patch.save()
+        Comment(patch=patch, msgid=patch.msgid, submitter=person,
+                content='Signed-off-by: Patch Author').save()
+
+        response = self.client.get(reverse('patchwork.views.patch.patch',
+                                           kwargs={'patch_id': patch.id}))
+        self.assertContains(response, '<span class="p_add">+bar</span>')
+        self.assertContains(response, '<span class="signed-off-by">'
+                                      'Signed-off-by: Patch Author</span>')
@@ -19,10 +19,16 @@
 
 import unittest
 import datetime
+import logging
+import StringIO
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
 from django.test import TestCase, TransactionTestCase
-from patchwork.models import Project, Patch, Comment, Tag, PatchTag
+from patchwork.models import Project, Patch, Comment, Tag, PatchTag, \
+                             TAG_SLOTS
 from patchwork.tests.utils import defaults
-from patchwork.parser import extract_tags
+from patchwork import parser
+from patchwork.parser import extract_tags, get_tag_matcher, TagMatcher
 
 from django.conf import settings
 from django.db import connection
@@ -79,6 +85,79 @@ class ExtractTagsTest(TestCase):
     def testAckInReply(self):
         self.assertTagsEqual("> Acked-by: %s\n" % self.name_email, 0, 0, 0)
 
+class TagMatcherTest(TestCase):
+    slow_pattern = r'^Acked-by: (\w+\s?)*$'
+
+    def testCount(self):
+        matcher = TagMatcher(['^Acked-by:', '^Reviewed-by:', '^Tested-by:'])
+        content = 'Acked-by: a\nreviewed-by: b\n> Tested-by: c\nAcked-by: d'
+        self.assertEqual(matcher.count(content), [2, 1, 0])
+
+    def testPatternGroups(self):
+        matcher = TagMatcher(['^(Acked|Nacked)-by:', '^(Re(view)ed)-by:',
+                              '^(x)-by: \\1$', '^Tested-by:'])
+        content = 'Acked-by: a\nNacked-by: b\nReviewed-by: c\nx-by: x\n' \
+                  'x-by: y\nTested-by: d\n'
+        self.assertEqual(matcher.count(content), [2, 1, 1, 1])
+
+    def testBrokenPatterns(self):
+        matcher = TagMatcher(['(', '^Acked-by:'])
+        self.assertEqual(matcher.count('Acked-by: a'), [0, 1])
+
+    def testUncombinedPatterns(self):
+        # the same group name, or too many groups, for a single regex
+        for patterns in (['^Acked-by:(?P<w>.*)', '^Tested-by:(?P<w>.*)'],
+                         ['^Acked-by:' + '(a)?' * 60,
+                          '^Tested-by:' + '(t)?' * 60]):
+            matcher = TagMatcher(patterns)
+            self.assertTrue(matcher.combine_error)
+            self.assertEqual(matcher.count('Acked-by: a\nTested-by: t\n'
+                                           'Acked-by: b\n'), [2, 1])
+
+    def testOverlappingPatterns(self):
+        # unlike with a regex per pattern, text matching several patterns
+        # is only counted for the first one
+        matcher = TagMatcher(['^Reviewed-by:', '^Reviewed-by: .*@intel'])
+        self.assertEqual(matcher.count('Reviewed-by: a@intel.com\n'),
+                         [1, 0])
+
+    def testSlowPatterns(self):
+        # slow patterns are still used, the slow matches are logged
+        logger = logging.getLogger('patchwork.parser')
+        stream = StringIO.StringIO()
+        handler = logging.StreamHandler(stream)
+        logger.addHandler(handler)
+        warning_time = parser.TAG_MATCH_WARNING_TIME
+        parser.TAG_MATCH_WARNING_TIME = -1
+        try:
+            matcher = TagMatcher([self.slow_pattern])
+            self.assertEqual(matcher.count('Acked-by: a b\n'), [1])
+        finally:
+            parser.TAG_MATCH_WARNING_TIME = warning_time
+            logger.removeHandler(handler)
+        self.assertTrue(self.slow_pattern in stream.getvalue())
+
+    def testCache(self):
+        patterns = ['^Acked-by:', '^Reviewed-by:']
+        matcher = get_tag_matcher(patterns)
+        self.assertTrue(get_tag_matcher(list(patterns)) is matcher)
+        self.assertFalse(get_tag_matcher(patterns + ['^Tested-by:'])
+                         is matcher)
+
+    def testTagValidation(self):
+        tag = Tag(name='Foo', abbrev='F', pattern='^Foo-by:')
+        tag.full_clean()
+        for pattern in ('^Foo-by: (', self.slow_pattern):
+            tag.pattern = pattern
+            self.assertRaises(ValidationError, tag.full_clean)
+
+        # the pattern has to be combined with the ones of the other tags
+        Tag(name='Bar', abbrev='B', pattern='^Bar-by:(?P<who>.*)').save()
+        tag.pattern = '^Foo-by:(?P<who>.*)'
+        self.assertRaises(ValidationError, tag.full_clean)
+        tag.pattern = '^Foo-by:(?:.*)'
+        tag.full_clean()
+
 class PatchTagsTest(TransactionTestCase):
     ACK = 1
     REVIEW = 2
@@ -189,6 +268,52 @@ class PatchTagsTest(TransactionTestCase):
         c1.save()
         self.assertTagsEqual(self.patch, 1, 1, 0)
 
+    def testLoadedCommentUpdate(self):
+        comment = self.create_tag_comment(self.patch, self.ACK)
+        self.create_tag_comment(self.patch, self.REVIEW)
+
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.content = self.create_tag(self.TEST)
+        comment.save()
+        self.assertTagsEqual(self.patch, 0, 1, 1)
+
+        Comment.objects.get(pk=comment.pk).delete()
+        self.assertTagsEqual(self.patch, 0, 1, 0)
+
+    def testUnknownCommentUpdate(self):
+        comment = self.create_tag_comment(self.patch, self.ACK)
+
+        # we don't know what's counted for this comment, recount everything
+        comment = Comment.objects.only('id', 'patch').get(pk=comment.pk)
+        comment.content = self.create_tag(self.REVIEW)
+        comment.save()
+        self.assertTagsEqual(self.patch, 0, 1, 0)
+
+    def testCommentMove(self):
+        other = Patch(project=self.patch.project, msgid='y',
+                      name=defaults.patch_name,
+                      submitter=defaults.patch_author_person, content='')
+        other.save()
+        comment = self.create_tag_comment(self.patch, self.ACK)
+        comment.patch = other
+        comment.save()
+        self.assertTagsEqual(self.patch, 0, 0, 0)
+        self.assertTagsEqual(other, 1, 0, 0)
+        other.delete()
+
+    def testCommentAddNumQueries(self):
+        for i in range(10):
+            self.create_tag_comment(self.patch, self.ACK)
+        self.patch.project.tags
+
+        # no matter how many comments there are: inserting the comment and
+        # updating the tag count in PatchTag and in Patch, each with its
+        # BEGIN, then adding the comment to the search document of the
+        # patch, and bumping its mbox generation with another BEGIN
+        with self.assertNumQueries(9):
+            self.create_tag_comment(self.patch, self.ACK)
+        self.assertTagsEqual(self.patch, 11, 0, 0)
+
 class PatchTagManagerTest(PatchTagsTest):
 
     def assertTagsEqual(self, patch, acks, reviews, tests):
@@ -215,3 +340,135 @@ class PatchTagManagerTest(PatchTagsTest):
 
         self.assertEqual(counts, (acks, reviews, tests))
 
+
+class RetagCommandTest(TestCase):
+    fixtures = ['default_tags', 'default_states', 'default_events']
+
+    def setUp(self):
+        # not defaults.project, its cached list of tags may be stale
+        self.project = Project(linkname='test-project', name='Test Project',
+                               use_tags=True)
+        self.project.save()
+        defaults.patch_author_person.save()
+        self.other_project = Project(linkname='other-project',
+                                     name='Other Project', use_tags=True)
+        self.other_project.save()
+        self.ack = Tag.objects.get(name='Acked-by')
+        self.review = Tag.objects.get(name='Reviewed-by')
+
+        self.patches = []
+        for (i, project) in enumerate([self.project] * 4 +
+                                      [self.other_project]):
+            patch = Patch(project=project, msgid='patch-%d' % i,
+                          name=defaults.patch_name,
+                          submitter=defaults.patch_author_person,
+                          content='')
+            patch.save()
+            for j in range(i):
+                comment = Comment(patch=patch, msgid='comment-%d-%d' % (i, j),
+                                  submitter=defaults.patch_author_person,
+                                  content='Acked-by: foo <foo@bar.org>\n' +
+                                          'Reviewed-by: foo <foo@bar.org>\n' *
+                                          (j % 2))
+                comment.save()
+            self.patches.append(patch)
+
+        # what the tags should be, before they get out of sync
+        self.expected = self.tag_counts()
+        PatchTag.objects.filter(tag=self.ack).update(count=42)
+        PatchTag.objects.filter(tag=self.review).delete()
+        PatchTag(patch=self.patches[0], tag=self.review, count=1).save()
+
+    def tag_counts(self):
+        return dict(((pt.patch_id, pt.tag_id), pt.count)
+                    for pt in PatchTag.objects.all())
+
+    def retag(self, *args, **kwargs):
+        call_command('retag', *args, stdout=StringIO.StringIO(), **kwargs)
+
+    def testRetag(self):
+        self.retag(jobs=1)
+        self.assertEqual(self.tag_counts(), self.expected)
+
+        for patch in Patch.objects.all():
+            self.assertEqual(
+                (patch.tag_count_0, patch.tag_count_1, patch.tag_count_2),
+                tuple(self.expected.get((patch.id, tag), 0)
+                      for tag in (self.ack.id, self.review.id, 3)))
+
+    def testRetagParallel(self):
+        self.retag(jobs=2, chunk_size=1)
+        self.assertEqual(self.tag_counts(), self.expected)
+
+    def testRetagProject(self):
+        self.retag(jobs=1, project=[self.other_project.linkname])
+        counts = self.tag_counts()
+        other = self.patches[-1].id
+        self.assertEqual(counts[(other, self.ack.id)], 4)
+        self.assertEqual(counts[(other, self.review.id)], 2)
+        self.assertEqual(counts[(self.patches[1].id, self.ack.id)], 42)
+
+    def testRetagIds(self):
+        self.retag(str(self.patches[0].id), jobs=1)
+        self.assertFalse(PatchTag.objects.filter(patch=self.patches[0])
+                                         .exists())
+        self.assertEqual(self.tag_counts()[(self.patches[1].id,
+                                            self.ack.id)], 42)
+
+class TagSlotsTest(TestCase):
+    fixtures = ['default_tags', 'default_states', 'default_events']
+
+    def setUp(self):
+        self.project = Project(linkname='test-project', name='Test Project',
+                               use_tags=True)
+        self.project.save()
+        defaults.patch_author_person.save()
+        self.patch = Patch(project=self.project, msgid='x',
+                           name=defaults.patch_name,
+                           submitter=defaults.patch_author_person,
+                           content='')
+        self.patch.save()
+
+    def add_comment(self, content):
+        comment = Comment(patch=self.patch, msgid=content,
+                          submitter=defaults.patch_author_person,
+                          content=content)
+        comment.save()
+
+    def testNoSubqueries(self):
+        query = Patch.objects.with_tag_counts(self.project)
+        self.assertFalse('patchwork_patchtag' in str(query.query))
+
+    def testStaleSave(self):
+        stale = Patch.objects.get(pk=self.patch.pk)
+        self.add_comment('Acked-by: foo <foo@bar.org>')
+        stale.name = 'foo'
+        stale.save()
+
+        patch = Patch.objects.get(pk=self.patch.pk)
+        self.assertEqual(patch.name, 'foo')
+        self.assertEqual(patch.tag_count_0, 1)
+
+    def testSlots(self):
+        for i in range(TAG_SLOTS + 1):
+            Tag(name='Tag%d' % i, abbrev='%d' % i,
+                pattern='^Tag%d-by:' % i).save()
+        tags = Tag.objects.order_by('id')
+        self.assertEqual([tag.slot for tag in tags],
+                         range(TAG_SLOTS) + [None] * 4)
+
+        # the last tag with a slot and the first one without are counted
+        self.add_comment('Tag%d-by: foo\nTag%d-by: foo\n' %
+                         (TAG_SLOTS - 4, TAG_SLOTS - 3))
+        project = Project.objects.get(pk=self.project.pk)
+        patch = Patch.objects.with_tag_counts(project).get(pk=self.patch.pk)
+        counts = [getattr(patch, tag.attr_name) for tag in tags]
+        self.assertEqual(counts, [0] * (TAG_SLOTS - 1) + [1, 1, 0, 0, 0])
+
+    def testSlotReuse(self):
+        self.add_comment('Tested-by: foo <foo@bar.org>')
+        Tag.objects.get(name='Tested-by').delete()
+        tag = Tag(name='Foo', abbrev='F', pattern='^Foo:')
+        tag.save()
+        self.assertEqual(tag.slot, 2)
+        self.assertEqual(Patch.objects.get(pk=self.patch.pk).tag_count_2, 0)
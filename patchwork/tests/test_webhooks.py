@@ -0,0 +1,283 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import BaseHTTPServer
+import datetime
+import json
+import socket
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from patchwork import webhooks
+from patchwork.models import Person, Project, Series, SeriesRevision, Test, \
+                             TestResult, Webhook, WebhookDelivery, \
+                             series_revision_complete
+from patchwork.tests.utils import create_user
+
+
+class Receiver(BaseHTTPServer.HTTPServer):
+    """A local HTTP server recording the requests POSTed to it"""
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_POST(self):
+            time.sleep(self.server.delay)
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            self.server.requests.append((self.headers, body))
+            self.send_response(self.server.status)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           self.Handler)
+        self.requests = []
+        self.status = 200
+        self.delay = 0
+        self.url = 'http://127.0.0.1:%d/hook' % self.server_port
+
+    def events(self, i=-1):
+        return json.loads(self.requests[i][1])['events']
+
+
+class WebhookTest(TestCase):
+    fixtures = ['default_states', 'default_events']
+
+    def setUp(self):
+        self.receivers = []
+        self.receiver = self.start_receiver()
+
+        self.project = Project(linkname='test-project', name='Test Project',
+                               listid='test.example.com')
+        self.project.save()
+        self.webhook = Webhook(project=self.project, url=self.receiver.url)
+        self.webhook.save()
+        self.person = Person(name='Series Author', email='author@example.com')
+        self.person.save()
+        self.series = Series(project=self.project, name='foo',
+                             submitter=self.person)
+        self.series.save()
+
+    def tearDown(self):
+        for (receiver, thread) in self.receivers:
+            receiver.shutdown()
+            receiver.server_close()
+            thread.join()
+
+    def start_receiver(self):
+        receiver = Receiver()
+        thread = threading.Thread(target=receiver.serve_forever)
+        thread.start()
+        self.receivers.append((receiver, thread))
+        return receiver
+
+    def new_revision(self, version=1):
+        revision = SeriesRevision(series=self.series, version=version)
+        revision.save()
+        series_revision_complete.send(sender=SeriesRevision,
+                                      revision=revision)
+        return revision
+
+    def create_result(self, revision):
+        test = Test(project=self.project, name='build')
+        test.save()
+        result = TestResult(test=test, revision=revision,
+                            user=create_user(),
+                            state=TestResult.STATE_FAILURE,
+                            url='http://example.com/logs')
+        result.save()
+        return result
+
+    def deliveries(self):
+        return WebhookDelivery.objects.order_by('id')
+
+    def testNewRevision(self):
+        self.new_revision(2)
+        self.assertEqual(self.receiver.requests, [])
+
+        self.assertEqual(webhooks.deliver(), 1)
+        (headers, body) = self.receiver.requests[0]
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertTrue('X-Patchwork-Signature' not in headers)
+        self.assertEqual(json.loads(body)['project'], 'test-project')
+        event = self.receiver.events()[0]
+        self.assertEqual(event['name'], 'series-new-revision')
+        self.assertEqual(event['series'], self.series.id)
+        self.assertEqual(event['parameters'], {'revision': 2})
+
+        delivery = self.deliveries().get()
+        self.assertEqual(event['delivery'], delivery.id)
+        self.assertEqual(delivery.state, WebhookDelivery.STATE_DELIVERED)
+        self.assertEqual(delivery.attempts, 1)
+        self.assertEqual(delivery.last_status, 200)
+
+        # nothing left to deliver
+        self.assertEqual(webhooks.deliver(), 0)
+
+    def testTestResult(self):
+        revision = self.new_revision()
+        self.create_result(revision)
+        webhooks.deliver()
+        event = self.receiver.events()[1]
+        self.assertEqual(event['name'], 'test-result')
+        self.assertEqual(event['series'], self.series.id)
+        self.assertEqual(event['parameters']['revision'], 1)
+        self.assertEqual(event['parameters']['test_name'], 'build')
+        self.assertEqual(event['parameters']['state'], 'failure')
+
+    def testSubscriptions(self):
+        self.webhook.series_events = False
+        self.webhook.save()
+        other = Project(linkname='other', name='Other',
+                        listid='other.example.com')
+        other.save()
+        Webhook(project=other, url=self.receiver.url).save()
+
+        self.create_result(self.new_revision())
+        self.assertEqual([d.event for d in self.deliveries()],
+                         ['test-result'])
+
+        self.webhook.active = False
+        self.webhook.save()
+        self.new_revision(2)
+        self.assertEqual(self.deliveries().count(), 1)
+        self.assertEqual(webhooks.deliver(), 0)
+
+    @override_settings(WEBHOOK_BATCH_SIZE=2)
+    def testBatches(self):
+        for version in range(1, 4):
+            self.new_revision(version)
+        self.assertEqual(webhooks.deliver(), 2)
+        self.assertEqual([e['parameters']['revision']
+                          for e in self.receiver.events()], [1, 2])
+        self.assertEqual(webhooks.deliver(), 1)
+        self.assertEqual(len(self.receiver.requests), 2)
+
+    @override_settings(WEBHOOK_BATCH_SIZE=2)
+    def testBacklog(self):
+        # a backlog for the first webhook doesn't hold up the other one
+        for version in range(1, 6):
+            self.new_revision(version)
+        other_receiver = self.start_receiver()
+        Webhook(project=self.project, url=other_receiver.url).save()
+        self.new_revision(6)
+
+        self.assertEqual(webhooks.deliver(max_batches=2), 3)
+        self.assertEqual([e['parameters']['revision']
+                          for e in self.receiver.events()], [1, 2])
+        self.assertEqual([e['parameters']['revision']
+                          for e in other_receiver.events()], [6])
+
+    def testSlowWebhook(self):
+        self.receiver.delay = 1
+        fast_receiver = self.start_receiver()
+        Webhook(project=self.project, url=fast_receiver.url).save()
+        self.new_revision()
+
+        pool = ThreadPool(2)
+        try:
+            deliverer = webhooks.Deliverer(pool, 2)
+            self.assertEqual(deliverer.start(), 2)
+            # the result of the fast webhook is recorded first, and its next
+            # events are delivered while the slow one is still in flight
+            self.assertEqual(deliverer.record(5), 1)
+            self.assertEqual(self.deliveries().filter(
+                state=WebhookDelivery.STATE_DELIVERED).count(), 1)
+            self.new_revision(2)
+            self.assertEqual(deliverer.start(), 1)
+            self.assertEqual(deliverer.record(5), 1)
+            self.assertEqual(len(fast_receiver.requests), 2)
+            self.assertEqual(len(self.receiver.requests), 0)
+
+            while deliverer.in_flight:
+                deliverer.record(5)
+            self.assertEqual(len(self.receiver.requests), 1)
+        finally:
+            pool.terminate()
+
+    def testSignature(self):
+        self.webhook.secret = 'secret'
+        self.webhook.save()
+        self.new_revision()
+        webhooks.deliver()
+        (headers, body) = self.receiver.requests[0]
+        self.assertEqual(headers['X-Patchwork-Signature'],
+                         webhooks.signature('secret', body))
+
+    @override_settings(WEBHOOK_RETRY_DELAY=60, WEBHOOK_MAX_ATTEMPTS=2)
+    def testRetry(self):
+        self.receiver.status = 500
+        self.new_revision()
+        self.assertEqual(webhooks.deliver(), 1)
+        delivery = self.deliveries().get()
+        self.assertEqual(delivery.state, WebhookDelivery.STATE_PENDING)
+        self.assertEqual(delivery.last_status, 500)
+        self.assertTrue(delivery.next_attempt > datetime.datetime.now() +
+                        datetime.timedelta(seconds=50))
+
+        # not due yet
+        self.assertEqual(webhooks.deliver(), 0)
+
+        self.deliveries().update(next_attempt=datetime.datetime.now())
+        webhooks.deliver()
+        delivery = self.deliveries().get()
+        self.assertEqual(delivery.state, WebhookDelivery.STATE_FAILED)
+        self.assertEqual(delivery.attempts, 2)
+        self.assertEqual(len(self.receiver.requests), 2)
+
+    def testConnectionError(self):
+        # a port nothing listens on
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.webhook.url = 'http://127.0.0.1:%d/' % sock.getsockname()[1]
+        self.webhook.save()
+        sock.close()
+
+        self.new_revision()
+        webhooks.deliver()
+        delivery = self.deliveries().get()
+        self.assertEqual(delivery.state, WebhookDelivery.STATE_PENDING)
+        self.assertEqual(delivery.last_status, None)
+        self.assertNotEqual(delivery.last_error, '')
+
+    def testCommand(self):
+        other = Webhook(project=self.project, url=self.receiver.url)
+        other.save()
+        self.new_revision()
+        self.new_revision(2)
+        call_command('deliverwebhooks', once=True, jobs=2)
+        self.assertEqual(len(self.receiver.requests), 2)
+        self.assertEqual(self.deliveries().filter(
+            state=WebhookDelivery.STATE_DELIVERED).count(), 4)
+
+    def testPrune(self):
+        self.new_revision()
+        self.new_revision(2)
+        old = datetime.datetime.now() - datetime.timedelta(days=31)
+        self.deliveries().filter(id=self.deliveries()[0].id) \
+                         .update(event_time=old)
+        webhooks.prune()
+        self.assertEqual([d.payload['parameters']['revision']
+                          for d in self.deliveries()], [2])
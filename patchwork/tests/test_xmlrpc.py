@@ -22,8 +22,9 @@ import xmlrpclib
 from django.test import LiveServerTestCase
 from django.core.urlresolvers import reverse
 from django.conf import settings
-from patchwork.models import Person, Patch
-from patchwork.tests.utils import defaults
+from patchwork.models import Person, Patch, State
+from patchwork.tests.test_user import TestUser
+from patchwork.tests.utils import defaults, read_patch
 
 @unittest.skipUnless(settings.ENABLE_XMLRPC,
         "requires xmlrpc interface (use the ENABLE_XMLRPC setting)")
@@ -53,3 +54,70 @@ class XMLRPCTest(LiveServerTestCase):
         patches = self.rpc.patch_list()
         self.assertEqual(len(patches), 1)
         self.assertEqual(patches[0]['id'], patch.id)
+
+    def testListPath(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        patches = []
+        for (msgid, content) in (('1', defaults.patch),
+                                 ('2', read_patch('0001-add-line.patch'))):
+            patch = Patch(project=defaults.project,
+                          submitter=defaults.patch_author_person,
+                          msgid=msgid, content=content)
+            patch.save()
+            patches.append(patch)
+
+        result = self.rpc.patch_list({'path': 'meep'})
+        self.assertEqual([p['id'] for p in result], [patches[1].id])
+        result = self.rpc.patch_list({'path__startswith': 'a'})
+        self.assertEqual([p['id'] for p in result], [patches[0].id])
+        self.assertEqual(self.rpc.patch_list({'path__contains': 'a'}), [])
+
+    def testListSearch(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        patches = []
+        for name in ('drm/i915: Fix a leak', 'drm/i915: Fix a use-after-free',
+                     'drm: Fix a use-after-free'):
+            patch = Patch(project=defaults.project, name=name,
+                          submitter=defaults.patch_author_person,
+                          msgid=name, content=defaults.patch)
+            patch.save()
+            patches.append(patch)
+
+        result = self.rpc.patch_list({'search': '"use after free" i915'})
+        self.assertEqual([p['id'] for p in result], [patches[1].id])
+        result = self.rpc.patch_list({'search': 'fix',
+                                      'project_id': defaults.project.id})
+        self.assertEqual(len(result), 3)
+        self.assertEqual(self.rpc.patch_list({'search__contains': 'fix'}),
+                         [])
+
+    def testUpdateCommits(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        patch = Patch(project=defaults.project,
+                      submitter=defaults.patch_author_person,
+                      msgid=defaults.patch_name, content=defaults.patch)
+        patch.save()
+        commits = [{'hash': patch.hash, 'commit_ref': '1234abcd',
+                    'state': 'Accepted'},
+                   {'hash': '0' * 40, 'commit_ref': 'abcd1234'}]
+
+        user = TestUser()
+        url = self.url.replace('://', '://%s:%s@' % (user.username,
+                                                      user.password))
+        rpc = xmlrpclib.Server(url)
+        self.assertRaises(xmlrpclib.Fault, rpc.patch_update_commits,
+                          defaults.project.linkname, commits)
+
+        user.add_to_maintainers(defaults.project)
+        result = rpc.patch_update_commits(defaults.project.linkname, commits)
+        self.assertEqual([c['patches'] for c in result['matched']],
+                         [[patch.id]])
+        self.assertEqual([c['hash'] for c in result['unmatched']],
+                         ['0' * 40])
+
+        patch = Patch.objects.get(pk=patch.pk)
+        self.assertEqual(patch.state, State.objects.get(name='Accepted'))
+        self.assertEqual(patch.commit_ref, '1234abcd')
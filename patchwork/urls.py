@@ -38,6 +38,11 @@ series_list_router.register(r'series', api.SeriesListViewSet)
 event_router = routers.NestedSimpleRouter(project_router, 'projects',
                                           lookup='project')
 event_router.register(r'events', api.EventLogViewSet)
+# /projects/$project/commits/
+commits_router = routers.NestedSimpleRouter(project_router, 'projects',
+                                            lookup='project')
+commits_router.register(r'commits', api.ProjectCommitsViewSet,
+                        base_name='project-commits')
 # /series/$id/
 series_router = routers.SimpleRouter()
 series_router.register(r'series', api.SeriesViewSet)
@@ -75,6 +80,7 @@ urlpatterns = patterns('',
     (r'^api/1.0/', include(patches_router.urls)),
     (r'^api/1.0/', include(patch_results_router.urls)),
     (r'^api/1.0/', include(event_router.urls)),
+    (r'^api/1.0/', include(commits_router.urls)),
 
     # project view:
     url(r'^$', 'patchwork.views.projects', name='root'),
@@ -91,6 +97,8 @@ urlpatterns = patterns('',
     # patch views
     (r'^patch/(?P<patch_id>\d+)/$', 'patchwork.views.patch.patch'),
     (r'^patch/(?P<patch_id>\d+)/raw/$', 'patchwork.views.patch.content'),
+    (r'^patch/(?P<patch_id>\d+)/files/(?P<file_id>\d+)/$',
+        'patchwork.views.patch.patch_file'),
     (r'^patch/(?P<patch_id>\d+)/mbox/$', 'patchwork.views.patch.mbox'),
     (r'^patch/msgid/(?P<msgid>[^/]+)/$', 'patchwork.views.patch.msgid'),
 
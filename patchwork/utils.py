@@ -56,6 +56,14 @@ class Order(object):
     }
     default_order = ('date', True)
 
+    # value sorting before all the others, standing for NULL when paging
+    # through a list with keys()
+    null_values = {
+        'state':        -1,
+        'submitter':    '',
+        'delegate':     '',
+    }
+
     def __init__(self, str = None, editable = False):
         self.reversed = False
         self.editable = editable
@@ -116,6 +124,19 @@ class Order(object):
 
         return qs.order_by(*orders)
 
+    def keys(self):
+        """The (field, null value, descending) tuples the patches are sorted
+           by when using keyset pagination. This is the same order as apply(),
+           with the patch id added to break ties."""
+        (default_name, default_reverse) = self.default_order
+        keys = [(self.order_map[self.order], self.null_values.get(self.order),
+                 self.reversed)]
+        if self.order != default_name:
+            keys.append((self.order_map[default_name], None,
+                         self.reversed ^ default_reverse))
+        keys.append(('id', None, keys[-1][2]))
+        return keys
+
 bundle_actions = ['create', 'add', 'remove']
 def set_bundle(user, project, action, data, patches, context):
     # set up the bundle
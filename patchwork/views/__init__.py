@@ -20,9 +20,12 @@
 
 from base import *
 from patchwork.utils import Order, get_patch_ids, bundle_actions, set_bundle
-from patchwork.paginator import Paginator
+from patchwork.paginator import get_paginator
 from patchwork.forms import MultiplePatchForm
-from patchwork.models import Comment
+from patchwork import mboxcache
+from patchwork.models import Comment, Patch, Person
+from django.http import StreamingHttpResponse
+from django.middleware.gzip import GZipMiddleware
 import re
 import datetime
 
@@ -114,7 +117,8 @@ def generic_list(request, project, view,
     # rendering the list template
     patches = patches.select_related('state', 'submitter', 'delegate')
 
-    paginator = Paginator(request, patches)
+    paginator = get_paginator(request, patches,
+                              None if editable_order else order)
 
     context.update({
             'page':             paginator.current_page,
@@ -162,14 +166,21 @@ class PatchMbox(MIMENonMultipart):
         self.set_payload(_text.encode(self.patch_charset))
         encode_7or8bit(self)
 
-def patch_to_mbox(patch):
+def patch_to_mbox(patch, comments=None):
+    """The mbox message of a patch. 'comments' are the comments of the
+       patch, ordered by date, fetched from the database if not given."""
     postscript_re = re.compile('\n-{2,3} ?\n')
 
+    if comments is None:
+        comments = Comment.objects.filter(patch=patch)
+
     comment = None
-    try:
-        comment = Comment.objects.get(patch = patch, msgid = patch.msgid)
-    except Exception:
-        pass
+    replies = []
+    for c in comments:
+        if c.msgid == patch.msgid:
+            comment = c
+        else:
+            replies.append(c)
 
     body = ''
     if comment:
@@ -183,8 +194,7 @@ def patch_to_mbox(patch):
     else:
         postscript = ''
 
-    for comment in Comment.objects.filter(patch = patch) \
-            .exclude(msgid = patch.msgid):
+    for comment in replies:
         body += comment.patch_responses()
 
     if postscript:
@@ -216,3 +226,65 @@ def patch_to_mbox(patch):
         mail['Date'] = email.utils.formatdate(utc_timestamp)
 
     return mail
+
+def patches_to_mbox(patches):
+    """The mbox messages of a list of patches. The submitters and comments
+       of all the patches are fetched in two queries."""
+    patches = list(patches)
+    submitters = Person.objects.in_bulk(set(p.submitter_id for p in patches))
+    comments = dict((p.id, []) for p in patches)
+    for comment in Comment.objects.filter(patch_id__in=comments.keys()) \
+                                  .defer('headers'):
+        comments[comment.patch_id].append(comment)
+
+    mails = []
+    for patch in patches:
+        patch.submitter = submitters[patch.submitter_id]
+        mails.append(patch_to_mbox(patch, comments[patch.id]))
+    return mails
+
+# number of patches fetched at once when generating a mbox
+MBOX_CHUNK_SIZE = 20
+
+def cache_mboxes(ids):
+    """Generate the mbox of the patches with these ids and store them in the
+       mbox cache. Returns a dictionary of the mboxes, by patch id."""
+    patches = Patch.objects.in_bulk(ids)
+    # patches deleted since their ids were read are left out
+    patches = [patches[id] for id in ids if id in patches]
+    mboxes = {}
+    for (patch, mail) in zip(patches, patches_to_mbox(patches)):
+        mboxes[patch.id] = mail.as_string(True)
+        mboxcache.put(patch.id, patch.mbox_generation, mboxes[patch.id])
+    return mboxes
+
+def iter_mbox(patches):
+    """Generate the mbox of a queryset of patches, one patch at a time. The
+       mboxes come from the mbox cache when possible, the other patches are
+       fetched a few at a time rather than all at once."""
+    keys = list(patches.values_list('id', 'mbox_generation'))
+    first = True
+    for start in range(0, len(keys), MBOX_CHUNK_SIZE):
+        chunk = keys[start:start + MBOX_CHUNK_SIZE]
+        mboxes = dict((id, mboxcache.get(id, generation))
+                      for (id, generation) in chunk)
+        missing = [id for (id, _) in chunk if mboxes[id] is None]
+        if missing:
+            mboxes.update(cache_mboxes(missing))
+
+        for (id, _) in chunk:
+            if mboxes[id] is None:
+                continue
+            if not first:
+                yield '\n'
+            first = False
+            yield mboxes[id]
+
+def mbox_response(request, patches, filename):
+    """A response streaming the mbox of a queryset of patches, compressed
+       with gzip if the client accepts it"""
+    response = StreamingHttpResponse(iter_mbox(patches),
+                                     content_type='text/plain')
+    response['Content-Disposition'] = 'attachment; filename=' + \
+        filename.replace(';', '').replace('\n', '')
+    return GZipMiddleware().process_response(request, response)
@@ -27,25 +27,27 @@ except:
 from django.conf import settings
 from django.core import mail
 from django.db.models import Q
-from django.http import HttpResponse
 from patchwork.models import Project, Series, SeriesRevision, Patch, EventLog, \
-                             Test, TestResult
+                             Test, TestResult, wait_for_events
 from rest_framework import views, viewsets, mixins, generics, filters, \
                            permissions, status
 from rest_framework.authentication import BasicAuthentication
 from rest_framework.decorators import api_view, renderer_classes, detail_route
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.templatetags.rest_framework import replace_query_param
 from rest_framework.generics import get_object_or_404
 from patchwork.serializers import ProjectSerializer, SeriesSerializer, \
                                   RevisionSerializer, PatchSerializer, \
                                   EventLogSerializer, TestResultSerializer
-from patchwork.views import patch_to_mbox
+from patchwork.search import search_patches
+from patchwork.views import mbox_response
 from patchwork.views.patch import mbox as patch_mbox
 import django_filters
+import time
 
 
-API_REVISION = 2
+API_REVISION = 4
 
 class RelatedOrderingFilter(filters.OrderingFilter):
     """
@@ -114,6 +116,28 @@ class SelectRelatedMixin(object):
 
         return queryset.select_related(*select_fields)
 
+class SparseFieldsMixin(object):
+    """Only read from the database the columns of the fields selected with
+       the 'fields' and 'exclude' GET parameters"""
+    # fields the view itself needs, always read
+    required_fields = ()
+
+    def sparse_queryset(self, queryset):
+        select_related = queryset.query.select_related
+        if select_related is True:
+            return queryset
+
+        selected = self.serializer_class.selected_fields(self.request,
+                                                         self.action == 'list')
+        selected += self.required_fields
+        # related objects are selected through their foreign key
+        if select_related:
+            selected += select_related.keys()
+
+        opts = queryset.model._meta
+        columns = [f.name for f in opts.concrete_fields if f.name in selected]
+        return queryset.only(opts.pk.name, *columns)
+
 def is_integer(s):
     try:
         int(s)
@@ -134,9 +158,37 @@ class ProjectViewSet(mixins.ListModelMixin, ListMixin, viewsets.GenericViewSet):
         serializer = ProjectSerializer(queryset)
         return Response(serializer.data)
 
+class ProjectCommitsViewSet(viewsets.ViewSet):
+    authentication_classes = (BasicAuthentication, )
+
+    def create(self, request, project_pk=None):
+        if is_integer(project_pk):
+            project = get_object_or_404(Project, pk=project_pk)
+        else:
+            project = get_object_or_404(Project, linkname=project_pk)
+
+        if not project.is_editable(request.user):
+            self.permission_denied(request)
+
+        commits = None
+        if hasattr(request.DATA, 'get'):
+            commits = request.DATA.get('commits')
+        if not isinstance(commits, list):
+            return Response({'commits': ['A list of commits is required.', ]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            (matched, unmatched) = project.update_commits(commits)
+        except ValueError as e:
+            return Response({'commits': [str(e), ]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'matched': matched, 'unmatched': unmatched})
+
 class SeriesListViewSet(mixins.ListModelMixin,
                         SeriesListMixin,
                         SelectRelatedMixin,
+                        SparseFieldsMixin,
                         viewsets.GenericViewSet):
     permission_classes = (MaintainerPermission, )
     select_fields = ('project', 'submitter', 'reviewer')
@@ -148,23 +200,22 @@ class SeriesListViewSet(mixins.ListModelMixin,
             queryset = self.queryset.filter(project__pk=pk)
         else:
             queryset = self.queryset.filter(project__linkname=pk)
-        return self.select_related(queryset)
+        return self.sparse_queryset(self.select_related(queryset))
 
 class SeriesViewSet(mixins.ListModelMixin,
                     mixins.RetrieveModelMixin,
                     SeriesListMixin,
+                    SparseFieldsMixin,
                     viewsets.GenericViewSet):
     permission_classes = (MaintainerPermission, )
     queryset = Series.objects.all()
 
-def series_mbox(revision):
-    patches = revision.ordered_patches()
-    data = '\n'.join([patch_to_mbox(x).as_string(True) for x in patches])
-    response = HttpResponse(content_type="text/plain")
-    response.write(data)
-    response['Content-Disposition'] = 'attachment; filename=' + \
-        revision.series.filename()
-    return response
+    def get_queryset(self):
+        return self.sparse_queryset(self.queryset.all())
+
+def series_mbox(request, revision):
+    return mbox_response(request, revision.ordered_patches(),
+                         revision.series.filename())
 
 class RevisionViewSet(mixins.ListModelMixin, ListMixin,
                       viewsets.GenericViewSet):
@@ -185,7 +236,7 @@ class RevisionViewSet(mixins.ListModelMixin, ListMixin,
     @detail_route(methods=['get'])
     def mbox(self, request, series_pk=None, pk=None):
         rev = get_object_or_404(SeriesRevision, series=series_pk, version=pk)
-        return series_mbox(rev)
+        return series_mbox(request, rev)
 
 class ResultMixin(object):
     def _prepare_mail(self, result):
@@ -281,13 +332,41 @@ def endpoint(endpoint):
         return func
     return decorator
 
+class PatchFilter(django_filters.FilterSet):
+
+    def path_filter(query_set, path):
+        queryset = query_set
+        if path:
+            queryset = queryset.touching(path)
+        return queryset
+
+    path = django_filters.CharFilter(name='path', action=path_filter)
+
+    def search_filter(query_set, text):
+        queryset = query_set
+        if text:
+            queryset = search_patches(queryset, text, ranked=True)
+        return queryset
+
+    q = django_filters.CharFilter(name='q', action=search_filter)
+
+    class Meta:
+        model = Patch
+        fields = ['path', 'q']
+
 class PatchViewSet(mixins.ListModelMixin,
                    mixins.RetrieveModelMixin,
-                   ListMixin, ResultMixin,
+                   ListMixin, ResultMixin, SparseFieldsMixin,
                    viewsets.GenericViewSet):
     permission_classes = (MaintainerPermission, )
     queryset = Patch.objects.all()
     serializer_class = PatchSerializer
+    filter_backends = ListMixin.filter_backends + \
+                      (filters.DjangoFilterBackend, )
+    filter_class = PatchFilter
+
+    def get_queryset(self):
+        return self.sparse_queryset(self.queryset.all())
 
     @detail_route(methods=['get'])
     def mbox(self, request, pk=None):
@@ -318,18 +397,82 @@ class EventTimeFilter(django_filters.FilterSet):
 
 class EventLogViewSet(mixins.ListModelMixin,
                       ListMixin,
+                      SparseFieldsMixin,
                       viewsets.GenericViewSet):
     permission_classes = (MaintainerPermission, )
     queryset = EventLog.objects.all().select_related('event')
     serializer_class = EventLogSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = EventTimeFilter
+    required_fields = ('sequence', )
 
     def get_queryset(self):
 
         pk = self.kwargs['project_pk']
         if is_integer(pk):
-            queryset = self.queryset.filter(series__project__pk=pk)
+            queryset = self.queryset.filter(project_id=pk)
         else:
-            queryset = self.queryset.filter(series__project__linkname=pk)
-        return queryset
+            queryset = self.queryset.filter(project__linkname=pk)
+        return self.sparse_queryset(queryset)
+
+    def list(self, request, *args, **kwargs):
+        after = request.QUERY_PARAMS.get('after')
+        if after is None:
+            return super(EventLogViewSet, self).list(request, *args, **kwargs)
+
+        # The sequence numbers of the events are the cursor: events are
+        # walked in the order they were committed using the (project,
+        # sequence) index, so a page costs the same however long the log is
+        # and, unlike with 'since', events logged with the same timestamp or
+        # committed late by a concurrent transaction can't be missed.
+        if not is_integer(after):
+            return Response({'after': ['A valid sequence number is '
+                                       'required.', ]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        after = int(after)
+
+        # long polling: wait for new events before reading them
+        wait = request.QUERY_PARAMS.get('wait')
+        project_id = None
+        if wait is not None:
+            try:
+                wait = min(float(wait), settings.EVENTS_MAX_WAIT)
+            except ValueError:
+                return Response({'wait': ['A number of seconds is required.']},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            pk = self.kwargs['project_pk']
+            if is_integer(pk):
+                project_id = int(pk)
+            else:
+                project_id = Project.objects.filter(linkname=pk) \
+                                            .values_list('id', flat=True) \
+                                            .first()
+        deadline = time.time() + (wait or 0)
+
+        perpage = self.get_paginate_by()
+        queryset = self.filter_queryset(self.get_queryset())
+        latest = after
+        while True:
+            if project_id is not None and time.time() < deadline:
+                latest = wait_for_events(project_id, latest,
+                                         deadline - time.time())
+            events = list(queryset.filter(sequence__gt=after)
+                                  .order_by('sequence')[:perpage + 1])
+            # the new events can be filtered out, wait for the next ones
+            if events or project_id is None or time.time() >= deadline:
+                break
+
+        next_url = None
+        if len(events) > perpage:
+            events = events[:perpage]
+            next_url = replace_query_param(request.build_absolute_uri(),
+                                           'after', events[-1].sequence)
+
+        serializer = self.get_serializer(events, many=True)
+        return Response({
+            'next': next_url,
+            'previous': None,
+            'cursor': events[-1].sequence if events else after,
+            'results': serializer.data,
+        })
@@ -21,12 +21,12 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.shortcuts import render_to_response, get_object_or_404
 from patchwork.requestcontext import PatchworkRequestContext
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotFound
+from django.http import HttpResponseRedirect, HttpResponseNotFound
 import django.core.urlresolvers
 from patchwork.models import Patch, Bundle, BundlePatch, Project
 from patchwork.utils import get_patch_ids
 from patchwork.forms import BundleForm, DeleteBundleForm
-from patchwork.views import generic_list, patch_to_mbox
+from patchwork.views import generic_list, mbox_response
 from patchwork.filters import DelegateFilter
 
 @login_required
@@ -193,15 +193,8 @@ def mbox(request, username, bundlename):
     if not (request.user == bundle.owner or bundle.public):
         return HttpResponseNotFound()
 
-    mbox = '\n'.join([patch_to_mbox(p).as_string(True)
-                        for p in bundle.ordered_patches()])
-
-    response = HttpResponse(content_type='text/plain')
-    response['Content-Disposition'] = \
-	'attachment; filename=bundle-%d-%s.mbox' % (bundle.id, bundle.name)
-
-    response.write(mbox)
-    return response
+    return mbox_response(request, bundle.ordered_patches(),
+                         'bundle-%d-%s.mbox' % (bundle.id, bundle.name))
 
 @login_required
 def bundle_redir(request, bundle_id):
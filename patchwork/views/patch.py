@@ -18,12 +18,14 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 
-from patchwork.models import Patch, Project, Bundle, TestResult
+from patchwork.models import Patch, PatchFile, Project, Bundle, TestResult
 from patchwork.forms import PatchForm, CreateBundleForm
 from patchwork.requestcontext import PatchworkRequestContext
+from patchwork.templatetags.syntax import patch_html
+from django.conf import settings
 from django.shortcuts import render_to_response, get_object_or_404, redirect
 from django.http import HttpResponse, HttpResponseForbidden
-from patchwork.views import generic_list, patch_to_mbox
+from patchwork.views import generic_list, mbox_response
 
 def patch(request, patch_id):
     context = PatchworkRequestContext(request)
@@ -76,7 +78,17 @@ def patch(request, patch_id):
                 form.save()
                 context.add_message('Patch updated')
 
+    # only list the files of large patches, their diffs are fetched from
+    # patch_file() when opened
+    patch_files = None
+    if settings.LARGE_PATCH_SIZE is not None and patch.content and \
+       len(patch.content) > settings.LARGE_PATCH_SIZE:
+        patch_files = patch.patchfile_set.all()
+        if not patch_files:
+            patch_files = None
+
     context['patch'] = patch
+    context['patch_files'] = patch_files
     context['patchform'] = form
     context['createbundleform'] = createbundleform
     context['project'] = patch.project
@@ -94,13 +106,14 @@ def content(request, patch_id):
         patch.filename().replace(';', '').replace('\n', '')
     return response
 
+def patch_file(request, patch_id, file_id):
+    patch_file = get_object_or_404(PatchFile, patch_id=patch_id, id=file_id)
+    return HttpResponse(patch_html(patch_file.diff()))
+
 def mbox(request, patch_id):
     patch = get_object_or_404(Patch, id=patch_id)
-    response = HttpResponse(content_type="text/plain")
-    response.write(patch_to_mbox(patch).as_string(True))
-    response['Content-Disposition'] = 'attachment; filename=' + \
-        patch.filename().replace(';', '').replace('\n', '')
-    return response
+    return mbox_response(request, Patch.objects.filter(id=patch.id),
+                         patch.filename())
 
 
 def list(request, project_id):
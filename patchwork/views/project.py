@@ -18,7 +18,7 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 
-from patchwork.models import Patch, Project, Series
+from patchwork.models import Project
 from django.shortcuts import render_to_response, get_object_or_404
 from django.contrib.auth.models import User
 from patchwork.requestcontext import PatchworkRequestContext
@@ -30,10 +30,9 @@ def project(request, project_id):
 
     context['maintainers'] = User.objects.filter( \
             profile__maintainer_projects = project)
-    context['n_patches'] = Patch.objects.filter(project = project,
-            archived = False).count()
-    context['n_archived_patches'] = Patch.objects.filter(project = project,
-            archived = True).count()
-    context['n_series'] = Series.objects.filter(project = project).count()
+    counters = project.get_counters()
+    context['n_patches'] = counters.n_patches
+    context['n_archived_patches'] = counters.n_archived_patches
+    context['n_series'] = counters.n_series
 
     return render_to_response('patchwork/project.html', context)
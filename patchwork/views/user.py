@@ -183,12 +183,11 @@ def unlink(request, person_id):
 def todo_lists(request):
     todo_lists = []
 
-    for project in Project.objects.all():
-        patches = request.user.profile.todo_patches(project = project)
-        if not patches.count():
-            continue
-
-        todo_lists.append({'project': project, 'n_patches': patches.count()})
+    counters = request.user.todo_counters.filter(count__gt = 0) \
+                      .select_related('project').order_by('project__linkname')
+    for counter in counters:
+        todo_lists.append({'project': counter.project,
+                           'n_patches': counter.count})
 
     if len(todo_lists) == 1:
         return todo_list(request, todo_lists[0]['project'].linkname)
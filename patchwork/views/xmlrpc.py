@@ -32,8 +32,9 @@ from django.http import (
     HttpResponse, HttpResponseRedirect, HttpResponseServerError)
 from django.views.decorators.csrf import csrf_exempt
 
-from patchwork.models import Patch, Project, Person, State
-from patchwork.views import patch_to_mbox
+from patchwork.models import Patch, Project, Person, State, PatchFile
+from patchwork.search import search_patches
+from patchwork.views import iter_mbox
 
 
 class PatchworkXMLRPCDispatcher(SimpleXMLRPCDispatcher,
@@ -470,6 +471,17 @@ def patch_list(filt=None):
      * commit_ref
      * hash
      * msgid
+     * path
+     * search
+
+    ``path`` only supports the ``startswith`` lookup type (the default one
+    for this field) and matches patches modifying at least one file starting
+    with the given path, eg. ``{'path': 'drivers/gpu/drm/i915/'}``.
+
+    ``search`` doesn't take a lookup type either. It's a full-text search of
+    the patch names, commit messages, replies and cover letters for words
+    and "quoted phrases", returning the patches sorted by relevance, eg.
+    ``{'search': '"use after free" i915'}``.
 
     It is also possible to specify the number of patches returned via
     a ``max_count`` filter.
@@ -537,11 +549,14 @@ def patch_list(filt=None):
             'commit_ref',
             'hash',
             'msgid',
+            'path',
+            'search',
             'max_count',
         ]
 
         dfilter = {}
         max_count = 0
+        search = None
 
         for key in filt:
             parts = key.split('__')
@@ -561,12 +576,24 @@ def patch_list(filt=None):
                 dfilter['delegate'] = Person.objects.filter(id=filt[key])[0]
             elif parts[0] == 'state_id':
                 dfilter['state'] = State.objects.filter(id=filt[key])[0]
+            elif parts[0] == 'path':
+                if len(parts) > 1 and parts[1] != 'startswith':
+                    return []
+                dfilter['id__in'] = PatchFile.patches_touching(filt[key])
+            elif parts[0] == 'search':
+                if len(parts) > 1:
+                    return []
+                search = filt[key]
             elif parts[0] == 'max_count':
                 max_count = filt[key]
             else:
                 dfilter[key] = filt[key]
 
         patches = Patch.objects.filter(**dfilter)
+        if search:
+            patches = search_patches(patches, search,
+                                     project=dfilter.get('project'),
+                                     ranked=True)
 
         if max_count > 0:
             return map(patch_to_dict, patches[:max_count])
@@ -657,11 +684,7 @@ def patch_get_mbox(patch_id):
         The serialized patch matching the ID, if any, in mbox format,
         else an empty string.
     """
-    try:
-        patch = Patch.objects.filter(id=patch_id)[0]
-        return patch_to_mbox(patch).as_string(True)
-    except Patch.DoesNotExist:
-        return ''
+    return ''.join(iter_mbox(Patch.objects.filter(id=patch_id)))
 
 
 @xmlrpc_method()
@@ -743,6 +766,49 @@ def patch_set(user, patch_id, params):
         raise
 
 
+@xmlrpc_method(login_required=True)
+def patch_update_commits(user, project, commits):
+    """Update the patches of a project matching a list of commits.
+
+    Look up the patches of the project by the patchwork hashes of the
+    commits, all at once, and set their state and commit reference. All
+    the patches are updated in a single transaction. This is meant to be
+    used by git hooks, with all the commits of a push in one call.
+
+    **NOTE:** Authentication is required for this method.
+
+    Args:
+        user (User): The user making the request. This will be
+            populated from HTTP Basic Auth.
+        project (str or int): The linkname or ID of the project.
+        commits (list): A list of dictionaries with a ``hash`` key,
+            the patchwork hash of a commit, and optional ``commit_ref``
+            and ``state`` (name or ID) keys.
+
+    Returns:
+        A dictionary with ``matched`` and ``unmatched`` lists of
+        commits. Matched commits have an additional ``patches`` key
+        with the IDs of the updated patches.
+
+    Raises:
+        Exception: User did not have necessary permissions to edit this
+            project.
+        ValueError: A commit was invalid or had an unknown state. No
+            patch is updated.
+        Project.DoesNotExist: The project did not exist.
+    """
+    if isinstance(project, int):
+        project = Project.objects.get(id=project)
+    else:
+        project = Project.objects.get(linkname=project)
+
+    if not project.is_editable(user):
+        raise Exception('No permissions to edit this project')
+
+    (matched, unmatched) = project.update_commits(commits)
+    return {'matched': matched, 'unmatched': unmatched}
+
+
 @xmlrpc_method()
 def state_list(search_str=None, max_count=0):
     """List states matching a given name filter.
@@ -0,0 +1,238 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Intel Corporation
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+# Delivery of the events of the projects to their webhooks.
+#
+# Events are queued as WebhookDelivery rows as they happen, deliver() and
+# Deliverer POST the due ones. Only the calling thread uses the database, the
+# HTTP requests are made by a pool of threads, with one batch of events per
+# webhook at a time. A request fails if it doesn't return a 2xx status, its
+# events are then retried later with an exponential backoff.
+#
+# The body of a request is a JSON object with the linkname of the 'project'
+# and a list of 'events', each with the id of its 'delivery', which can be
+# used to ignore the events received twice.
+
+import datetime
+import hashlib
+import hmac
+import httplib
+import itertools
+import json
+import Queue
+import socket
+import urllib2
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Min
+
+from patchwork.models import WebhookDelivery
+
+
+def _due_batches(now, max_batches, exclude=()):
+    """The deliveries to do now, by batches of up to WEBHOOK_BATCH_SIZE
+       deliveries to the same webhook, oldest first. Up to 'max_batches'
+       webhooks get a batch, the ones waiting for the longest time first,
+       whatever the backlog of the others, except the webhooks with an id in
+       'exclude'."""
+    due = WebhookDelivery.objects.filter(state=WebhookDelivery.STATE_PENDING,
+                                         next_attempt__lte=now,
+                                         webhook__active=True) \
+                                 .exclude(webhook__in=list(exclude))
+    webhooks = due.order_by().values('webhook') \
+                  .annotate(oldest=Min('id')).order_by('oldest')
+
+    return [list(due.filter(webhook=w['webhook'])
+                    .select_related('webhook__project')
+                    .order_by('id')[:settings.WEBHOOK_BATCH_SIZE])
+            for w in webhooks[:max_batches]]
+
+
+def _request(batch):
+    webhook = batch[0].webhook
+    events = []
+    for delivery in batch:
+        event = dict(delivery.payload)
+        event['delivery'] = delivery.id
+        events.append(event)
+    body = json.dumps({'project': webhook.project.linkname, 'events': events})
+    return (webhook.url, webhook.secret, body)
+
+
+def signature(secret, body):
+    """The X-Patchwork-Signature header of a request"""
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), body,
+                                hashlib.sha256).hexdigest()
+
+
+def post(request):
+    """POST a request made by _request(). Returns the HTTP status, None if
+       there isn't any, and the error if the request failed. Doesn't use
+       the database."""
+    (url, secret, body) = request
+    headers = {
+        'Content-Type': 'application/json',
+        'User-Agent': 'patchwork',
+    }
+    if secret:
+        headers['X-Patchwork-Signature'] = signature(secret, body)
+
+    try:
+        response = urllib2.urlopen(urllib2.Request(url, body, headers),
+                                   timeout=settings.WEBHOOK_TIMEOUT)
+        response.close()
+    except urllib2.HTTPError as e:
+        return (e.code, str(e))
+    except (urllib2.URLError, httplib.HTTPException, socket.error) as e:
+        return (None, str(e) or e.__class__.__name__)
+
+    status = response.getcode()
+    if not 200 <= status < 300:
+        return (status, 'unexpected HTTP status %d' % status)
+    return (status, '')
+
+
+def _record(batch, status, error, now):
+    """Store the result of the POST of a batch of deliveries"""
+    if not error:
+        WebhookDelivery.objects.filter(id__in=[d.id for d in batch]) \
+                               .update(state=WebhookDelivery.STATE_DELIVERED,
+                                       attempts=F('attempts') + 1,
+                                       delivered=now, last_status=status,
+                                       last_error='')
+        return
+
+    # the backoff depends on the number of attempts of each delivery
+    by_attempts = {}
+    for delivery in batch:
+        by_attempts.setdefault(delivery.attempts + 1, []).append(delivery.id)
+
+    for (attempts, ids) in by_attempts.items():
+        delay = min(settings.WEBHOOK_RETRY_DELAY * 2 ** (attempts - 1),
+                    settings.WEBHOOK_MAX_RETRY_DELAY)
+        state = WebhookDelivery.STATE_PENDING
+        if attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+            state = WebhookDelivery.STATE_FAILED
+        WebhookDelivery.objects.filter(id__in=ids).update(
+            state=state, attempts=attempts,
+            next_attempt=now + datetime.timedelta(seconds=delay),
+            last_status=status, last_error=error)
+
+
+def _post_batch(batch, request, results=None):
+    """POST the request of a batch, putting (batch, status, error) in the
+       'results' queue if given. Doesn't use the database."""
+    try:
+        (status, error) = post(request)
+    except Exception as e:
+        # never leave a batch without a result
+        (status, error) = (None, str(e) or e.__class__.__name__)
+    if results is not None:
+        results.put((batch, status, error))
+    return (batch, status, error)
+
+
+def _post_args(args):
+    return _post_batch(*args)
+
+
+def _record_result(batch, status, error):
+    with transaction.atomic():
+        _record(batch, status, error, datetime.datetime.now())
+
+
+def deliver(pool=None, max_batches=1):
+    """POST the due deliveries, up to 'max_batches' batches at once, in the
+       threads of 'pool' if given. The result of each request is recorded as
+       soon as it completes. Returns the number of deliveries tried."""
+    batches = _due_batches(datetime.datetime.now(), max_batches)
+    if not batches:
+        return 0
+
+    args = [(batch, _request(batch)) for batch in batches]
+    if pool:
+        results = pool.imap_unordered(_post_args, args)
+    else:
+        results = itertools.imap(_post_args, args)
+    for (batch, status, error) in results:
+        _record_result(batch, status, error)
+
+    return sum(len(batch) for batch in batches)
+
+
+class Deliverer(object):
+    """Keep POSTing the due deliveries in the threads of 'pool', with up to
+       'jobs' requests at once and one per webhook. A slow webhook only
+       delays its own deliveries: new batches are started for the other
+       webhooks while its request is in flight."""
+
+    def __init__(self, pool, jobs):
+        self.pool = pool
+        self.jobs = jobs
+        # {webhook id: batch} of the requests in flight
+        self.in_flight = {}
+        # (batch, status, error) of the completed requests, filled by the
+        # threads of the pool
+        self.results = Queue.Queue()
+
+    def start(self):
+        """Start the requests of the due batches, for the webhooks without
+           a request in flight. Returns the number of started requests."""
+        free = self.jobs - len(self.in_flight)
+        if free <= 0:
+            return 0
+
+        batches = _due_batches(datetime.datetime.now(), free,
+                               exclude=self.in_flight.keys())
+        for batch in batches:
+            self.in_flight[batch[0].webhook_id] = batch
+            self.pool.apply_async(_post_batch,
+                                  (batch, _request(batch), self.results))
+        return len(batches)
+
+    def record(self, timeout=0):
+        """Record the results of the completed requests, waiting up to
+           'timeout' seconds for one if there isn't any yet. Returns the
+           number of recorded deliveries."""
+        recorded = 0
+        try:
+            if timeout > 0:
+                result = self.results.get(timeout=timeout)
+            else:
+                result = self.results.get_nowait()
+            while True:
+                (batch, status, error) = result
+                del self.in_flight[batch[0].webhook_id]
+                _record_result(batch, status, error)
+                recorded += len(batch)
+                result = self.results.get_nowait()
+        except Queue.Empty:
+            pass
+        return recorded
+
+
+def prune(days=None):
+    """Remove the deliveries of events older than 'days' days
+       (settings.WEBHOOK_LOG_DAYS by default) from the log"""
+    if days is None:
+        days = settings.WEBHOOK_LOG_DAYS
+    limit = datetime.datetime.now() - datetime.timedelta(days=days)
+    WebhookDelivery.objects.filter(event_time__lt=limit).delete()